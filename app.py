@@ -1,94 +1,1117 @@
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import datetime
+import hashlib
+import importlib
 import io
 import os
 import re
+import functools
+import gzip
+import inspect
 import json
+import logging
+import mimetypes
+import queue
+import random
 import secrets
-from typing import Counter
-from cryptography.hazmat.backends import default_backend
-from openai import OpenAI
-import firebase_admin
-import firebase_admin.auth
-from google.resumable_media.requests import upload
+import threading
+import time
+from urllib.parse import urlparse
+import google_crc32c
+import prometheus_client
+from prometheus_client import multiprocess
 import requests
 import socket
-from bs4 import BeautifulSoup
+import sys
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from firebase_admin import credentials, firestore
-from flask import Flask, jsonify, render_template, request
+from urllib3.exceptions import ReadTimeoutError
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
 from flask_cors import CORS
-from google.cloud import storage, vision
-from google.oauth2 import service_account
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', secrets.token_hex(32))
-# Initialize Firebase Admin
-cred = credentials.Certificate('./service.json')
-firebase_admin.initialize_app(cred)
-client=OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-# Initialize Firestore client
-db = firestore.client()
 
+######## Client Registry ########
+# Google and OpenAI clients are created on first use rather than at import,
+# so a cold start only pays for the clients the first request touches
+class ClientRegistry:
+    """Thread-safe registry that builds each named client once, on first use."""
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        # Re-entrant: a factory may ask for the clients it depends on
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        """Register a factory and return a proxy that resolves it lazily."""
+        self._factories[name] = factory
+        return LazyClient(self, name)
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._factories[name]()
+                    self._instances[name] = instance
+        return instance
+
+    def override(self, name, instance):
+        """Use `instance` for `name` instead of building it (e.g. a local fake)."""
+        with self._lock:
+            self._instances[name] = instance
+
+    def initialized(self):
+        return sorted(self._instances)
+
+class LazyClient:
+    """Stand-in that forwards attribute access to a registry client.
+
+    Use `clients.get(name)` instead wherever the real object is passed to a
+    library (e.g. as `credentials=`), since the proxy fails type checks.
+    """
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+clients = ClientRegistry()
+
+def lazy_import(name):
+    """Module proxy that imports `name` on first attribute access."""
+    return clients.register(f'module:{name}', lambda: importlib.import_module(name))
+
+def lazy_decorator(module, name):
+    """Apply the decorator `module.<name>` on the first call rather than at definition."""
+    def decorate(fn):
+        decorated = []
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not decorated:
+                decorated.append(getattr(module, name)(fn))
+            return decorated[0](*args, **kwargs)
+        return wrapper
+    return decorate
+
+# The Firestore SDK and google.api_core pull in gRPC and cryptography, which
+# dominate import time; they load when a request first needs them
+firestore = lazy_import('firebase_admin.firestore')
+api_exceptions = lazy_import('google.api_core.exceptions')
+
+######## Observability ########
+# JSON logs at LOG_LEVEL, Prometheus histograms served on /metrics and a
+# Server-Timing header on every response
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Takes structured fields as keyword arguments: logger.info('Uploaded', convo_id=...)."""
+    RESERVED = ('exc_info', 'stack_info', 'stacklevel', 'extra')
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in self.RESERVED}
+        kwargs['extra'] = {**kwargs.get('extra', {}), 'fields': fields}
+        return msg, kwargs
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonLogFormatter())
+app_logger = logging.getLogger('botpress_api')
+app_logger.addHandler(log_handler)
+app_logger.setLevel(LOG_LEVEL)
+app_logger.propagate = False
+logger = StructuredLogger(app_logger, {})
+
+ROUTE_LATENCY = prometheus_client.Histogram(
+    'http_route_duration_seconds', 'Flask route latency',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+DEPENDENCY_LATENCY = prometheus_client.Histogram(
+    'dependency_duration_seconds', 'Latency of calls to external services',
+    ['dependency', 'operation', 'outcome'], buckets=LATENCY_BUCKETS
+)
+OPENAI_TOKENS = prometheus_client.Counter(
+    'openai_tokens_total', 'OpenAI tokens consumed', ['model', 'kind']
+)
+
+# Dependency timings of the current request for its Server-Timing header; a
+# contextvar rather than flask.g so the async routes record them as well
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def start_server_timing():
+    request_timings.set([])
+
+def server_timing_header(elapsed):
+    """Sum the request's dependency timings per name and add the total."""
+    timings = {}
+    for name, seconds in request_timings.get() or []:
+        timings[name] = timings.get(name, 0) + seconds
+    request_timings.set(None)
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    return ', '.join(entries)
+
+@contextlib.contextmanager
+def track(dependency, operation):
+    """Time a dependency call into DEPENDENCY_LATENCY and the request's Server-Timing."""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        DEPENDENCY_LATENCY.labels(dependency, operation, outcome).observe(elapsed)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((f"{dependency}-{operation}", elapsed))
+
+def timed(dependency, operation, fn):
+    """Wrap `fn` in track(); generators are drained so the timing covers the RPC."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with track(dependency, operation):
+            result = fn(*args, **kwargs)
+            if inspect.isgenerator(result):
+                result = list(result)
+            return result
+    return wrapper
+
+def record_openai_usage(model, usage):
+    if not usage:
+        return
+    if not isinstance(usage, dict):
+        usage = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+    OPENAI_TOKENS.labels(model, 'prompt').inc(usage.get('prompt_tokens') or 0)
+    OPENAI_TOKENS.labels(model, 'completion').inc(usage.get('completion_tokens') or 0)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    start_server_timing()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    ROUTE_LATENCY.labels(route, request.method, response.status_code).observe(elapsed)
+
+    response.headers['Server-Timing'] = server_timing_header(elapsed)
+
+    logger.info("Request handled", method=request.method, route=route,
+                status=response.status_code, duration_ms=round(elapsed * 1000, 1))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Aggregate the samples every gunicorn worker wrote
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
+
+######## Conditional Requests ########
+# The read routes Botpress polls carry a weak ETag derived from the stored
+# data they answer from, and a matching If-None-Match gets an empty 304
+# before any model, GCS or serialization work. The ETags are weak so they
+# still match once the body has been compressed. JSON bodies of at least
+# COMPRESS_MIN_BYTES are sent with br (when the brotli package is installed)
+# or gzip, whichever the client accepts.
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+brotli_codec = None
+
+def data_etag(*parts):
+    serialized = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+def conditional_json(payload, etag=None):
+    """jsonify(payload) with an ETag, or a 304 when the client already has it."""
+    etag = etag or data_etag(payload)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    return response
+
+def post_etag(cache_key, generated_at, image_urls):
+    """The /GetPOSTDATA body is a function of the generation and the image URLs."""
+    return data_etag(cache_key, round(generated_at.timestamp() * 1e6), image_urls)
+
+def stored_post_etag(post_data_doc, cache_key, image_urls):
+    """ETag of the stored post when it is what /GetPOSTDATA would serve for these inputs, else None.
+
+    `image_urls` may be None when they are only known after listing the
+    bucket; the stored ones are trusted then.
+    """
+    if not GENERATION_CACHE_PERSIST or post_data_doc is None or not post_data_doc.exists:
+        return None
+    stored_data = post_data_doc.to_dict()
+    cached = stored_generation(stored_data, cache_key)
+    stored_urls = stored_data.get('image_urls', [])
+    if cached is None or (image_urls is not None and stored_urls != image_urls):
+        return None
+    return post_etag(cache_key, cached[1], stored_urls)
+
+def compress_body(data, accept_encodings):
+    """Return (compressed, encoding), or None when the body is small or nothing acceptable is available."""
+    global brotli_codec
+    if len(data) < COMPRESS_MIN_BYTES:
+        return None
+    if brotli_codec is None:
+        try:
+            import brotli
+            brotli_codec = brotli
+        except ImportError:
+            brotli_codec = False
+    if brotli_codec and accept_encodings['br']:
+        return brotli_codec.compress(data, quality=5), 'br'
+    if accept_encodings['gzip']:
+        return gzip.compress(data, compresslevel=6), 'gzip'
+    return None
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    compressed = compress_body(response.get_data(), request.accept_encodings)
+    if compressed is not None:
+        response.set_data(compressed[0])
+        response.headers['Content-Encoding'] = compressed[1]
+    return response
+
+######## Outbound HTTP ########
+# Every third-party HTTP call goes through one pooled session with timeouts,
+# a per-host concurrency cap and jittered retries
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+OPENAI_READ_TIMEOUT = float(os.environ.get('OPENAI_READ_TIMEOUT', 120))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))
+HTTP_MAX_PER_HOST = int(os.environ.get('HTTP_MAX_PER_HOST', 10))
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+http_session = requests.Session()
+http_session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=HTTP_MAX_PER_HOST))
+http_session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=HTTP_MAX_PER_HOST))
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+def host_semaphore(url):
+    host = urlparse(url).netloc
+    with host_semaphores_lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(HTTP_MAX_PER_HOST)
+        return host_semaphores[host]
+
+def http_request(method, url, retry=None, timeout=None, dependency='http', **kwargs):
+    """Send a request through the shared session.
+
+    Idempotent methods are retried on connection errors, timeouts and
+    429/5xx responses with full-jitter exponential backoff; pass
+    `retry=True` to opt a POST in when repeating it is safe. Each attempt
+    is timed under `dependency`.
+    """
+    method = method.upper()
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    attempts = request_attempts(method, retry)
+
+    for attempt in range(attempts):
+        try:
+            with host_semaphore(url), track(dependency, method.lower()):
+                response = http_session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if not should_retry(attempt, attempts):
+                raise
+        else:
+            if not should_retry(attempt, attempts, response.status_code):
+                return response
+            response.close()
+        time.sleep(retry_delay(attempt))
+
+# The retry policy, shared with the async client in asgi.py
+def request_attempts(method, retry=None):
+    """How many times a request may be sent; only idempotent methods retry by default."""
+    if retry is None:
+        retry = method.upper() in IDEMPOTENT_METHODS
+    return HTTP_MAX_RETRIES + 1 if retry else 1
+
+def should_retry(attempt, attempts, status_code=None):
+    """Whether to send again after `attempt` failed to connect (no `status_code`) or got a response."""
+    if attempt >= attempts - 1:
+        return False
+    return status_code is None or status_code in RETRY_STATUSES
+
+def retry_delay(attempt):
+    """Full-jitter exponential backoff before the next attempt."""
+    return random.uniform(0, HTTP_BACKOFF_BASE * 2 ** attempt)
+
+GCP_PROJECT = 'botpressbot-6083e'
+# Both point at public services; override them to run against local fakes
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+GEOIP_URL = os.environ.get('GEOIP_URL', 'http://ip-api.com/json').rstrip('/')
+
+def create_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+    # Initialize Firebase Admin
+    cred = credentials.Certificate('./service.json')
+    return firebase_admin.initialize_app(cred)
+
+def create_google_credentials():
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file('./service.json')
+
+def create_firestore_client():
+    return firestore.client(app=clients.get('firebase'))
+
+def create_storage_client():
+    from google.cloud import storage
+    if os.environ.get('STORAGE_EMULATOR_HOST'):
+        from google.auth.credentials import AnonymousCredentials
+        # Local fake GCS (e.g. `python -m fakes.gcs`); the client sends requests there itself
+        return storage.Client(credentials=AnonymousCredentials(), project=GCP_PROJECT)
+    return storage.Client(credentials=clients.get('google_credentials'), project=GCP_PROJECT)
+
+def create_vision_client():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient(credentials=clients.get('google_credentials'))
+
+def create_openai_client():
+    from openai import OpenAI
+    return OpenAI(
+        api_key=os.environ.get('OPENAI_API_KEY'),
+        base_url=OPENAI_BASE_URL,
+        timeout=OPENAI_READ_TIMEOUT,
+        max_retries=HTTP_MAX_RETRIES
+    )
+
+def create_label_publisher():
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient(credentials=clients.get('google_credentials'))
+
+clients.register('firebase', create_firebase_app)
+clients.register('google_credentials', create_google_credentials)
+client = clients.register('openai', create_openai_client)
+# Initialize Firestore client
+db = clients.register('firestore', create_firestore_client)
 # Initialize Google Cloud Storage client
-google_credentials = service_account.Credentials.from_service_account_file('./service.json')
-storage_client = storage.Client(credentials=google_credentials, project='botpressbot-6083e')
+storage_client = clients.register('storage', create_storage_client)
+# Shared Vision client; building one per request costs a fresh gRPC channel
+vision_client = clients.register('vision', create_vision_client)
+label_publisher = clients.register('label_publisher', create_label_publisher)
+
+def lazy_collection(name):
+    """Firestore collection reference that doesn't build the client until used."""
+    return clients.register(f'collection:{name}', lambda: db.collection(name))
 
 # Bucket name
 bucket_name = 'imagesbucket_matt'  # Replace with your bucket name
 
 # Firestore user collection reference
-user_coll_ref = db.collection('users')
-upload_counter=1
-# Set the environment variable for authentication
-
-# Define the path to the temp folder
-temp_folder = os.path.expanduser("~/RestApiForBotpress/temp")
-
-# Ensure the temp folder exists
-os.makedirs(temp_folder, exist_ok=True)
-
-def download_image_to_temp(image_url, temp_folder):
-    """Download image from the given URL and save it to the temp folder."""
-    response = requests.get(image_url)
-    if response.status_code == 200:
-        # Create a unique file name in the temp folder
-        file_name = os.path.join(temp_folder, os.path.basename(image_url))
-        with open(file_name, 'wb') as temp_file:
-            temp_file.write(response.content)
-        return file_name  # Return the path to the temp file
-    else:
-        raise Exception(f"Failed to download image. Status code: {response.status_code}")
+user_coll_ref = lazy_collection('users')
+# Uploads allowed per conversation
+MAX_UPLOADS = 5
+# Shared pool for fanning out independent Firestore/GCS/OpenAI calls in a request
+IO_WORKERS = int(os.environ.get('IO_WORKERS', 16))
+io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=IO_WORKERS)
+# Vision accepts at most 16 images per synchronous batch request
+VISION_BATCH_SIZE = 16
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+def flag_enabled(value):
+    return str(value or '').lower() in ('1', 'true', 'yes')
+
+######## Label Cache ########
+# Labels keyed by the SHA-256 of the image bytes: an in-process LRU tier in
+# front of the `label_cache` Firestore collection
+LABEL_CACHE_SIZE = int(os.environ.get('LABEL_CACHE_SIZE', 1024))
+LABEL_CACHE_TTL = int(os.environ.get('LABEL_CACHE_TTL', 3600))
+LABEL_CACHE_FIRESTORE_TTL_DAYS = int(os.environ.get('LABEL_CACHE_FIRESTORE_TTL_DAYS', 30))
+
+label_cache = TTLCache(LABEL_CACHE_SIZE, LABEL_CACHE_TTL)
+label_cache_coll_ref = lazy_collection('label_cache')
+label_cache_stats = {'memory_hits': 0, 'firestore_hits': 0, 'misses': 0}
+label_cache_stats_lock = threading.Lock()
+
+def count_label_cache(outcome, n=1):
+    with label_cache_stats_lock:
+        label_cache_stats[outcome] += n
+
+def get_cached_labels(digests):
+    """Return a {digest: labels} dict for the digests found in either cache tier."""
+    found = memory_cached_labels(digests)
+    remaining = [digest for digest in digests if digest not in found]
+    if remaining:
+        refs = [label_cache_coll_ref.document(digest) for digest in remaining]
+        with track('firestore', 'get_all'):
+            docs = list(db.get_all(refs))
+        found.update(collect_cached_labels(docs, remaining))
+    return found
+
+def memory_cached_labels(digests):
+    """{digest: labels} for the digests the in-process tier holds."""
+    found = {}
+    for digest in digests:
+        labels_array = label_cache.get(digest)
+        if labels_array is not None:
+            found[digest] = labels_array
+    count_label_cache('memory_hits', len(found))
+    return found
+
+def collect_cached_labels(docs, digests):
+    """Turn label_cache snapshots for `digests` into {digest: labels}, skipping expired entries."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    found = {}
+    for doc in docs:
+        if not doc.exists:
+            continue
+        cached = doc.to_dict()
+        expires_at = cached.get('expires_at')
+        if expires_at and expires_at < now:
+            continue
+        found[doc.id] = cached.get('labels', [])
+        label_cache.set(doc.id, found[doc.id])
+        count_label_cache('firestore_hits')
+    count_label_cache('misses', len([digest for digest in digests if digest not in found]))
+    return found
+
+def label_cache_documents(labels_by_digest):
+    """Put labels in the in-process tier and return the label_cache documents to write."""
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=LABEL_CACHE_FIRESTORE_TTL_DAYS)
+    documents = {}
+    for digest, labels_array in labels_by_digest.items():
+        label_cache.set(digest, labels_array)
+        documents[digest] = {
+            'labels': labels_array,
+            'expires_at': expires_at
+        }
+    return documents
 
-def detect_labels(image_url):
-    """Detects labels in the image."""
-    # Initialize a Vision client
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = './service.json'
-    client = vision.ImageAnnotatorClient()
+def store_cached_labels(labels_by_digest):
+    """Write freshly detected labels to both cache tiers."""
+    batch = db.batch()
+    for digest, document in label_cache_documents(labels_by_digest).items():
+        batch.set(label_cache_coll_ref.document(digest), document)
+    try:
+        with track('firestore', 'commit'):
+            batch.commit()
+    except Exception as e:
+        # The cache is an optimization; a failed write must not fail the upload
+        logger.warning("Error writing label cache", error=str(e))
+
+def detect_labels(image_bytes):
+    """Detects labels in the given image bytes."""
+    from google.cloud import vision
 
-    # Download the image to the temp folder
-    temp_image_path = download_image_to_temp(image_url, temp_folder)
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    cached = get_cached_labels([digest])
+    if digest in cached:
+        return cached[digest]
 
-    # Load the image content from the temp file
-    with io.open(temp_image_path, 'rb') as image_file:
-        content = image_file.read()
-        image = vision.Image(content=content)
+    image = vision.Image(content=image_bytes)
 
     # Perform label detection
-    response = client.label_detection(image=image)
+    with track('vision', 'label_detection'):
+        response = vision_client.label_detection(image=image)
     labels = response.label_annotations
 
     labels_array = [label.description for label in labels]
 
     if response.error.message:
         raise Exception(f'{response.error.message}')
+    store_cached_labels({digest: labels_array})
     return labels_array
 
+def detect_labels_batch(images_bytes):
+    """Detects labels for several images with batched Vision requests."""
+    digests = image_digests(images_bytes)
+    labels_by_digest = get_cached_labels(list(dict.fromkeys(digests)))
+
+    detected = {}
+    for chunk, requests_batch in label_detection_batches(uncached_images(digests, images_bytes, labels_by_digest)):
+        with track('vision', 'batch_annotate'):
+            response = vision_client.batch_annotate_images(requests=requests_batch)
+        detected.update(labels_from_batch(chunk, response))
+
+    if detected:
+        store_cached_labels(detected)
+        labels_by_digest.update(detected)
+    return [labels_by_digest[digest] for digest in digests]
+
+def image_digests(images_bytes):
+    return [hashlib.sha256(image_bytes).hexdigest() for image_bytes in images_bytes]
+
+def uncached_images(digests, images_bytes, labels_by_digest):
+    """Images neither cache tier knows, once per distinct digest."""
+    pending = {}
+    for digest, image_bytes in zip(digests, images_bytes):
+        if digest not in labels_by_digest:
+            pending.setdefault(digest, image_bytes)
+    return pending
+
+def label_detection_batches(pending):
+    """Yield (digests, requests) in chunks of VISION_BATCH_SIZE for {digest: image_bytes}."""
+    from google.cloud import vision
+
+    pending_digests = list(pending)
+    for start in range(0, len(pending_digests), VISION_BATCH_SIZE):
+        chunk = pending_digests[start:start + VISION_BATCH_SIZE]
+        yield chunk, [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=pending[digest]),
+                features=[vision.Feature(type_=vision.Feature.Type.LABEL_DETECTION)]
+            )
+            for digest in chunk
+        ]
+
+def labels_from_batch(chunk, response):
+    """{digest: labels} from a batch_annotate_images response; any per-image error fails the batch."""
+    detected = {}
+    for digest, image_response in zip(chunk, response.responses):
+        if image_response.error.message:
+            raise Exception(f'{image_response.error.message}')
+        detected[digest] = [label.description for label in image_response.label_annotations]
+    return detected
+
+######## Image Normalization ########
+# Vision gains nothing above ~640px; posts get a web rendition and a thumbnail
+# stored next to the original under {convo_id}/web/ and {convo_id}/thumb/
+VISION_MAX_SIDE = 640
+WEB_MAX_SIDE = int(os.environ.get('WEB_MAX_SIDE', 1600))
+THUMBNAIL_MAX_SIDE = 320
+WEB_JPEG_QUALITY = int(os.environ.get('WEB_JPEG_QUALITY', 82))
+RENDITIONS = ('web', 'thumb')
+
+def encode_jpeg(image, max_side, quality):
+    from PIL import Image
+
+    resized = image.copy()
+    resized.thumbnail((max_side, max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    resized.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+def normalize_image(image_bytes, renditions=True):
+    """Fix EXIF orientation and build downscaled JPEG copies of an upload.
+
+    Returns {'vision': bytes, 'web': bytes, 'thumb': bytes}; the web and
+    thumbnail entries are None when `renditions` is False. Images Pillow
+    cannot decode are sent to Vision unchanged and get no renditions.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Let the JPEG decoder skip resolution we are about to throw away
+        image.draft('RGB', (WEB_MAX_SIDE, WEB_MAX_SIDE) if renditions else (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+    except Exception as e:
+        logger.warning("Could not normalize image", error=str(e))
+        return {'vision': image_bytes, 'web': None, 'thumb': None}
+
+    return {
+        'vision': encode_jpeg(image, VISION_MAX_SIDE, 85),
+        'web': encode_jpeg(image, WEB_MAX_SIDE, WEB_JPEG_QUALITY) if renditions else None,
+        'thumb': encode_jpeg(image, THUMBNAIL_MAX_SIDE, 80) if renditions else None
+    }
+
+def public_url(blob_name):
+    return f"https://storage.googleapis.com/{bucket_name}/{blob_name}"
+
+def rendition_name(folder_path, filename, rendition):
+    return f"{folder_path}{rendition}/{os.path.splitext(filename)[0]}.jpg"
+
+def upload_image_renditions(folder_path, filename, image_bytes, content_type, normalized):
+    """Upload the original and its renditions in parallel.
+
+    Pass `image_bytes=None` when the original is already stored. Returns
+    {'original': url, 'web': url, 'thumb': url} for whatever was stored.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    uploads = {'original': (f"{folder_path}{filename}", image_bytes, content_type)}
+    if image_bytes is None:
+        uploads.pop('original')
+    for rendition in RENDITIONS:
+        if normalized.get(rendition):
+            uploads[rendition] = (rendition_name(folder_path, filename, rendition), normalized[rendition], 'image/jpeg')
+
+    futures = [
+        io_executor.submit(
+            contextvars.copy_context().run,
+            timed('gcs', 'upload', bucket.blob(blob_name).upload_from_string), data, content_type=blob_content_type
+        )
+        for blob_name, data, blob_content_type in uploads.values()
+    ]
+    for future in futures:
+        future.result()
+    urls = {key: public_url(blob_name) for key, (blob_name, _, _) in uploads.items()}
+    urls['original'] = public_url(f"{folder_path}{filename}")
+    return urls
+
+######## Streaming Upload ########
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 20 * 1024 * 1024))
+# Resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+class EmptyUpload(Exception):
+    pass
+
+def stream_to_gcs(stream, blob_name, content_type):
+    """Copy a request body into a resumable GCS upload chunk by chunk.
+
+    SHA-256 and CRC32C are computed as the chunks pass through; the CRC32C
+    is checked against the one GCS computed. Raises UploadTooLarge as soon
+    as UPLOAD_MAX_BYTES is exceeded and EmptyUpload for an empty body,
+    leaving the unfinished session to expire. Returns (image_bytes, sha256_hex, crc32c_b64); the bytes are
+    kept because Vision and the renditions still need them.
+    """
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+    sha256 = hashlib.sha256()
+    crc32c = google_crc32c.Checksum()
+    buffer = io.BytesIO()
+    size = 0
+
+    with track('gcs', 'resumable_upload'):
+        writer = blob.open('wb', chunk_size=UPLOAD_CHUNK_SIZE, content_type=content_type)
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > UPLOAD_MAX_BYTES:
+                raise UploadTooLarge()
+            sha256.update(chunk)
+            crc32c.update(chunk)
+            buffer.write(chunk)
+            writer.write(chunk)
+        if size == 0:
+            raise EmptyUpload()
+        writer.close()
+
+    digest = sha256.hexdigest()
+    checksum = base64.b64encode(crc32c.digest()).decode('ascii')
+    # The metadata patch also returns the object's server-side CRC32C
+    blob.metadata = {'sha256': digest}
+    blob.patch()
+    if blob.crc32c != checksum:
+        blob.delete()
+        raise Exception(f"CRC32C mismatch for {blob_name}: sent {checksum}, stored {blob.crc32c}")
+    return buffer.getvalue(), digest, checksum
+
+def record_image_hash(convo_id, digest, blob_name, size, crc32c):
+    """Remember an upload by content hash; returns the earlier record if this is a duplicate."""
+    hash_ref = user_coll_ref.document(convo_id).collection('images').document(digest)
+    try:
+        with track('firestore', 'create'):
+            hash_ref.create({
+                'blob_name': blob_name,
+                'size': size,
+                'crc32c': crc32c,
+                'uploaded': datetime.datetime.now()
+            })
+        return None
+    except api_exceptions.AlreadyExists:
+        with track('firestore', 'get'):
+            return hash_ref.get().to_dict()
+
+def upload_quota_ref(convo_id):
+    return user_coll_ref.document(convo_id).collection('quota').document('uploads')
+
+@lazy_decorator(firestore, 'transactional')
+def reserve_upload_slots_txn(transaction, quota_ref, count):
+    claim = claim_upload_slots(quota_ref.get(transaction=transaction), count)
+    if claim is None:
+        return None
+    first_slot, quota_update = claim
+    transaction.set(quota_ref, quota_update, merge=True)
+    return first_slot
+
+def claim_upload_slots(snapshot, count):
+    """(first_slot, quota_update) for claiming `count` slots against a quota snapshot, or None over the cap."""
+    used = (snapshot.to_dict() or {}).get('count', 0) if snapshot.exists else 0
+    if used + count > MAX_UPLOADS:
+        return None
+    return used + 1, {
+        'count': firestore.Increment(count),
+        'updated': datetime.datetime.now()
+    }
+
+def reserve_upload_slots(convo_id, count=1):
+    """Claim `count` upload slots for the conversation before anything is uploaded.
+
+    Returns the first claimed slot number, or None when the conversation's
+    quota would be exceeded. The counter lives in Firestore so every worker
+    process sees the same value.
+    """
+    with track('firestore', 'transaction'):
+        return reserve_upload_slots_txn(db.transaction(), upload_quota_ref(convo_id), count)
+
+def release_upload_slots(convo_id, count=1):
+    """Give back slots whose upload failed."""
+    with track('firestore', 'update'):
+        upload_quota_ref(convo_id).update({'count': firestore.Increment(-count)})
+
+def upload_limit_error(count=1):
+    if count == 1:
+        return {"error": f"You have reached the limit of {MAX_UPLOADS} uploads for this conversation"}
+    return {"error": f"Uploading {count} image(s) would exceed the limit of {MAX_UPLOADS} uploads for this conversation"}
+
+def upload_failed(convo_id, error, count=1):
+    """Give the reserved slots back and answer with a JSON error.
+
+    Anything that fails between reserving a slot and saving the image's
+    labels lands here; the quota never resets, so a leaked slot is lost for
+    good.
+    """
+    logger.warning("Upload failed", convo_id=convo_id, error=str(error))
+    try:
+        release_upload_slots(convo_id, count)
+    except Exception as e:
+        logger.error("Error releasing upload slots", convo_id=convo_id, count=count, error=str(e))
+    return jsonify({"error": f"Upload failed: {str(error)}"}), 500
+
+def save_image_labels(convo_id, labels_by_counter, images=None):
+    """Append labels for one or more images to the conversation's labels document.
+
+    `labels_by_counter` maps each image's upload slot to its labels. Entries
+    are appended with ArrayUnion and the manifest's label counts are
+    incremented in one batched write, so concurrent uploads never read or
+    overwrite each other's labels. `images` optionally adds the uploads to
+    the manifest in the same write (see manifest_update).
+    """
+    # Save the labels in a subcollection under the current document
+    batch = db.batch()
+    for doc_ref, update in image_labels_writes(user_coll_ref.document(convo_id), convo_id, labels_by_counter, images):
+        batch.set(doc_ref, update, merge=True)
+    with track('firestore', 'commit'):
+        batch.commit()
+    # New labels change the post's inputs; draft it once the uploads settle
+    schedule_draft_generation(convo_id)
+
+def image_labels_writes(user_doc_ref, convo_id, labels_by_counter, images=None):
+    """The (document, merge update) pairs save_image_labels commits together."""
+    return [
+        (user_doc_ref.collection('labels').document(convo_id), image_labels_update(labels_by_counter)),
+        (manifest_ref(user_doc_ref, convo_id), manifest_update(images, labels_by_counter.values()))
+    ]
+
+def image_labels_update(labels_by_counter):
+    now = datetime.datetime.now()
+    entries = [
+        {f"image{counter}": labels_array, "timestamp": now}
+        for counter, labels_array in labels_by_counter.items()
+    ]
+    return {
+        "labels": firestore.ArrayUnion(entries),
+        "counter": firestore.Increment(len(entries))
+    }
+
+######## Conversation Manifest ########
+# users/{id}/manifest/{id} holds what a post is generated from: the uploaded
+# images keyed by file name (with their slot, for ordering) and how many
+# images carried each normalized label. Uploads merge into it with
+# Increment, so building the prompt is one document read with no bucket
+# listing and no re-collecting of labels. Prompts keep the most frequent
+# labels that fit in POST_LABEL_TOKEN_BUDGET.
+POST_LABEL_TOKEN_BUDGET = int(os.environ.get('POST_LABEL_TOKEN_BUDGET', 150))
+
+def manifest_ref(user_doc_ref, convo_id):
+    return user_doc_ref.collection('manifest').document(convo_id)
+
+def normalize_label(label):
+    return ' '.join(str(label).split()).lower()
+
+def manifest_image(slot, urls):
+    """The manifest entry for an upload, pointing posts at its web rendition when there is one."""
+    return {'slot': slot, 'url': urls.get('web') or urls['original'], 'original_url': urls['original']}
+
+def manifest_update(images=None, labels_arrays=()):
+    """Merge-set body adding `images` ({filename: manifest_image(...)}) and counting each image's labels once."""
+    label_counts = collections.Counter()
+    for labels_array in labels_arrays:
+        label_counts.update({normalize_label(label) for label in labels_array} - {''})
+    update = {'updated': datetime.datetime.now()}
+    if images:
+        update['images'] = images
+    if labels_arrays:
+        update['label_counts'] = {label: firestore.Increment(count) for label, count in label_counts.items()}
+        update['labeled_images'] = firestore.Increment(len(labels_arrays))
+    return update
+
+def record_manifest_images(convo_id, images):
+    """Add uploads to the manifest before their labels are known (queued labeling)."""
+    with track('firestore', 'set'):
+        manifest_ref(user_coll_ref.document(convo_id), convo_id).set(manifest_update(images), merge=True)
+
+def manifest_image_urls(manifest):
+    """Image URLs in upload order."""
+    images = manifest.get('images') or {}
+    ordered = sorted(images.items(), key=lambda item: (item[1].get('slot') or 0, item[0]))
+    return [image['url'] for _, image in ordered]
+
+def legacy_label_counts(labels_data):
+    """Count labels from a labels document written before the manifest existed."""
+    label_counts = collections.Counter()
+    for entry in labels_data.get('labels', []):
+        for key, labels_array in entry.items():
+            if key.startswith('image'):
+                label_counts.update({normalize_label(label) for label in labels_array} - {''})
+    return label_counts
+
+def ranked_labels(label_counts, budget=None):
+    """Labels by descending frequency, dropping the least frequent ones past the token budget."""
+    budget = POST_LABEL_TOKEN_BUDGET if budget is None else budget
+    ranked = sorted(collections.Counter(label_counts).items(), key=lambda item: (-item[1], item[0]))
+    labels = []
+    used = 0
+    for label, _ in ranked:
+        cost = count_tokens(label) + 1  # plus the ", " separator
+        if used + cost > budget:
+            break
+        labels.append(label)
+        used += cost
+    return labels
+
+######## Label Job Queue ########
+# 'local' runs jobs on an in-process worker pool, 'pubsub' publishes them to a
+# topic consumed by `python app.py label-worker`
+LABEL_QUEUE_BACKEND = os.environ.get('LABEL_QUEUE_BACKEND', 'local')
+LABEL_WORKERS = int(os.environ.get('LABEL_WORKERS', 4))
+LABEL_QUEUE_SIZE = int(os.environ.get('LABEL_QUEUE_SIZE', 100))
+LABEL_TOPIC = os.environ.get('LABEL_TOPIC', 'label-jobs')
+LABEL_SUBSCRIPTION = os.environ.get('LABEL_SUBSCRIPTION', 'label-jobs-worker')
+
+# Job status lives in Firestore so any web worker can answer a status poll
+label_job_coll_ref = lazy_collection('label_jobs')
+
+label_job_queue = queue.Queue(maxsize=LABEL_QUEUE_SIZE)
+label_workers_lock = threading.Lock()
+label_workers = []
+
+def run_label_job(job, image_bytes=None):
+    """Label a stored image and record the result on its job document."""
+    job_ref = label_job_coll_ref.document(job['job_id'])
+    with track('firestore', 'update'):
+        job_ref.update({'status': 'running', 'updated': datetime.datetime.now()})
+    try:
+        if image_bytes is None:
+            with track('gcs', 'download'):
+                original = storage_client.bucket(bucket_name).blob(job['blob_name']).download_as_bytes()
+            image_bytes = normalize_image(original, renditions=False)['vision']
+        labels_array = detect_labels(image_bytes)
+        save_image_labels(job['convo_id'], {job['counter']: labels_array})
+        with track('firestore', 'update'):
+            job_ref.update({'status': 'done', 'labels': labels_array, 'updated': datetime.datetime.now()})
+    except Exception as e:
+        logger.error("Label job failed", job_id=job['job_id'], error=str(e))
+        with track('firestore', 'update'):
+            job_ref.update({'status': 'failed', 'error': str(e), 'updated': datetime.datetime.now()})
+
+def label_worker_loop():
+    while True:
+        job, image_bytes = label_job_queue.get()
+        try:
+            run_label_job(job, image_bytes)
+        finally:
+            label_job_queue.task_done()
+
+def start_local_label_workers():
+    with label_workers_lock:
+        while len(label_workers) < LABEL_WORKERS:
+            worker = threading.Thread(target=label_worker_loop, daemon=True)
+            worker.start()
+            label_workers.append(worker)
+
+def enqueue_label_job(convo_id, blob_name, file_url, counter, image_bytes):
+    """Queue labeling for an uploaded image and return the job id."""
+    job = {
+        'job_id': secrets.token_hex(16),
+        'convo_id': convo_id,
+        'blob_name': blob_name,
+        'counter': counter
+    }
+    with track('firestore', 'set'):
+        label_job_coll_ref.document(job['job_id']).set({
+            'status': 'queued',
+            'convo_id': convo_id,
+            'file_url': file_url,
+            'created': datetime.datetime.now(),
+            'updated': datetime.datetime.now()
+        })
+
+    if LABEL_QUEUE_BACKEND == 'pubsub':
+        topic_path = label_publisher.topic_path(GCP_PROJECT, LABEL_TOPIC)
+        label_publisher.publish(topic_path, json.dumps(job).encode('utf-8')).result()
+        return job['job_id']
+
+    start_local_label_workers()
+    try:
+        label_job_queue.put((job, image_bytes), timeout=1)
+    except queue.Full:
+        # Queue is saturated; label inline rather than drop the job
+        run_label_job(job, image_bytes)
+    return job['job_id']
+
+def run_label_worker():
+    """Consume label jobs from Pub/Sub with at most LABEL_WORKERS in flight."""
+    from google.cloud import pubsub_v1
+    from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+    subscriber = pubsub_v1.SubscriberClient(credentials=clients.get('google_credentials'))
+    subscription_path = subscriber.subscription_path(GCP_PROJECT, LABEL_SUBSCRIPTION)
+
+    def callback(message):
+        run_label_job(json.loads(message.data.decode('utf-8')))
+        message.ack()
+
+    streaming_pull = subscriber.subscribe(
+        subscription_path,
+        callback=callback,
+        flow_control=pubsub_v1.types.FlowControl(max_messages=LABEL_WORKERS),
+        scheduler=ThreadScheduler(
+            concurrent.futures.ThreadPoolExecutor(max_workers=LABEL_WORKERS)
+        )
+    )
+    logger.info("Listening for label jobs", subscription=subscription_path)
+    with subscriber:
+        streaming_pull.result()
+
+######## User Profile Cache ########
+# Read-through cache of users/{id} for the lookup routes. The write routes in
+# this app invalidate it directly; with USER_CACHE_LISTEN=true a snapshot
+# listener also drops entries changed by other workers.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+# Without the listener, a profile written through another worker or instance
+# is served stale by this one for up to USER_CACHE_TTL seconds
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+USER_CACHE_LISTEN = os.environ.get('USER_CACHE_LISTEN', 'false').lower() == 'true'
+
+# Only existing profiles are cached: a user created on another worker must be
+# found on the next lookup here, not after the TTL
+user_profile_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_profile_watch = None
+
+def get_user_profile(user_id):
+    """Return the users/{user_id} data, or None when the document does not exist."""
+    user_data = user_profile_cache.get(user_id)
+    if user_data is None:
+        with track('firestore', 'get'):
+            user_doc = user_coll_ref.document(user_id).get()
+        if not user_doc.exists:
+            return None
+        user_data = user_doc.to_dict()
+        user_profile_cache.set(user_id, user_data)
+    return user_data
+
+def invalidate_user_profile(user_id):
+    user_profile_cache.pop(user_id)
+
+def on_user_profiles_changed(doc_snapshots, changes, read_time):
+    for change in changes:
+        invalidate_user_profile(change.document.id)
+
+def start_user_profile_listener():
+    """Watch profiles written after this process started and drop them from the cache."""
+    global user_profile_watch
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    user_profile_watch = user_coll_ref.where('profileUpdatedAt', '>', started_at).on_snapshot(on_user_profiles_changed)
+
+if USER_CACHE_LISTEN:
+    start_user_profile_listener()
+
 # Home route to display all endpoints
 @app.route('/', methods=['GET'])
 def index():
-    global upload_counter
-    upload_counter=1
     return render_template('index.html')
 
 @app.route('/login', methods=['POST'])
@@ -120,17 +1143,20 @@ def store_user_info():
         user_name = data['person']
         website = data['url']
         business_info = data['businessInfo']
-        print(data)
-        user_coll_ref.document(session_id).set({
-            'userName': user_name,
-            'website': website,
-            'businessInfo': business_info,
-            'lastUsageDate': datetime.datetime.now(),
-            'freeUsageCount': 0,
-            'subscriptionTier': 'Free',
-            'limit': 1,
-            'subscriptionStatus': 'active'
-        })
+        logger.debug("Saving user data", data=data)
+        with track('firestore', 'set'):
+            user_coll_ref.document(session_id).set({
+                'userName': user_name,
+                'website': website,
+                'businessInfo': business_info,
+                'lastUsageDate': datetime.datetime.now(),
+                'freeUsageCount': 0,
+                'subscriptionTier': 'Free',
+                'limit': 1,
+                'subscriptionStatus': 'active',
+                'profileUpdatedAt': firestore.SERVER_TIMESTAMP
+            })
+        invalidate_user_profile(session_id)
 
         return jsonify({'Status': True, 'Message': f'Thanks, {user_name}. I’ve saved your information.'})
     except Exception:
@@ -139,75 +1165,232 @@ def store_user_info():
 # Save image in bucket endpoint
 @app.route('/Save_Image_in_Bucket', methods=['POST'])
 def upload_image():
-    global upload_counter
     convo_id = request.form.get('id')
-    print("id " + convo_id)
-    print(upload_counter)
+    logger.debug("Upload received", convo_id=convo_id)
+    if not convo_id:
+        return jsonify({"error": "id is required"}), 400
 
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
-    print("files object", request.files)
+    logger.debug("Upload files", files=list(request.files))
     file = request.files.get('file')
 
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
+
+    # Claim a slot before touching GCS so over-quota uploads cost nothing
+    upload_slot = reserve_upload_slots(convo_id)
+    if upload_slot is None:
+        return jsonify(upload_limit_error()), 400
+    logger.debug("Upload slot reserved", convo_id=convo_id, upload_slot=upload_slot)
         
     filename = file.filename
-    print(f"Uploaded file: {filename}")
+    logger.info("Uploaded file", convo_id=convo_id, filename=filename)
     folder_path = f"{convo_id}/"
 
-    # Create a blob object with the folder path and file name
-    blob = storage_client.bucket(bucket_name).blob(f"{folder_path}{filename}")
+    try:
+        # Read the request body once; the original and its renditions go to
+        # GCS and the downscaled copy goes to Vision
+        image_bytes = file.read()
+        normalized = normalize_image(image_bytes)
+        urls = upload_image_renditions(folder_path, filename, image_bytes, file.mimetype, normalized)
+
+        file_url = urls['original']
+        upload_counter = upload_slot + 1
+
+        # Optionally hand labeling off to the job queue and respond right away
+        if flag_enabled(request.args.get('async', request.form.get('async'))):
+            record_manifest_images(convo_id, {filename: manifest_image(upload_slot, urls)})
+            job_id = enqueue_label_job(convo_id, f"{folder_path}{filename}", file_url, upload_slot, normalized['vision'])
+            return jsonify({
+                "file_name": filename,
+                "file_url": file_url,
+                "web_url": urls.get('web'),
+                "thumbnail_url": urls.get('thumb'),
+                "job_id": job_id,
+                "status_url": f"/GetLabelJobStatus?job_id={job_id}",
+                "upload_counter": upload_counter
+            }), 202
+
+        labels_array = detect_labels(normalized['vision'])
+        save_image_labels(convo_id, {upload_slot: labels_array}, {filename: manifest_image(upload_slot, urls)})
+    except Exception as e:
+        return upload_failed(convo_id, e)
 
-    # Upload the file
-    blob.upload_from_file(file)
+    logger.info("File uploaded successfully", convo_id=convo_id, file_url=file_url,
+                last_image_label=labels_array, upload_counter=upload_counter)
+    return jsonify({
+        "file_name": filename,
+        "file_url": file_url,
+        "web_url": urls.get('web'),
+        "thumbnail_url": urls.get('thumb'),
+        "last_image_label": labels_array,
+        "upload_counter": upload_counter  # Send upload_counter to frontend
+    }), 200
 
-    # Return success response
-    file_url = f"https://storage.googleapis.com/{bucket_name}/{folder_path}{filename}"
-    labels_array = detect_labels(file_url)
+# Streaming save image endpoint
+@app.route('/Save_Image_in_Bucket/stream', methods=['PUT', 'POST'])
+def upload_image_stream():
+    """Streaming variant of /Save_Image_in_Bucket.
+
+    The raw request body is the image (no multipart), with ?id=<convo_id>
+    and ?filename=<name>. It is piped to GCS as it arrives instead of being
+    spooled by Flask first. Responds like /Save_Image_in_Bucket plus `sha256`,
+    and with `duplicate: true` when the conversation already has this image.
+    """
+    convo_id = request.args.get('id')
+    filename = os.path.basename(request.args.get('filename') or '')
+    if not convo_id or not filename:
+        return jsonify({"error": "id and filename are required"}), 400
+    if request.content_length is not None and request.content_length > UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"File is larger than {UPLOAD_MAX_BYTES} bytes"}), 413
+    if request.content_length == 0:
+        return jsonify({"error": "The request body is empty"}), 400
+
+    # Claim a slot before touching GCS so over-quota uploads cost nothing
+    upload_slot = reserve_upload_slots(convo_id)
+    if upload_slot is None:
+        return jsonify(upload_limit_error()), 400
 
-    # Save the labels in a subcollection under the current document
-    user_doc_ref = user_coll_ref.document(convo_id)
-    image_labels_ref = user_doc_ref.collection('labels')
+    folder_path = f"{convo_id}/"
+    blob_name = f"{folder_path}{filename}"
+    content_type = request.mimetype or 'application/octet-stream'
+    try:
+        image_bytes, digest, crc32c = stream_to_gcs(request.stream, blob_name, content_type)
+    except UploadTooLarge:
+        release_upload_slots(convo_id)
+        return jsonify({"error": f"File is larger than {UPLOAD_MAX_BYTES} bytes"}), 413
+    except EmptyUpload:
+        # Chunked bodies have no Content-Length to check up front
+        release_upload_slots(convo_id)
+        return jsonify({"error": "The request body is empty"}), 400
+    except Exception as e:
+        return upload_failed(convo_id, e)
 
-    # Fetch the existing document for convo_id
-    labels_doc = image_labels_ref.document(convo_id).get()
+    try:
+        duplicate = record_image_hash(convo_id, digest, blob_name, len(image_bytes), crc32c)
+        if duplicate is not None:
+            # Same content already uploaded in this conversation; keep the first copy
+            if duplicate['blob_name'] != blob_name:
+                storage_client.bucket(bucket_name).blob(blob_name).delete()
+        else:
+            normalized = normalize_image(image_bytes)
+            try:
+                urls = upload_image_renditions(folder_path, filename, None, content_type, normalized)
+            except Exception as e:
+                logger.warning("Error storing renditions", blob_name=blob_name, error=str(e))
+                urls = {'original': public_url(blob_name)}
+
+            labels_array = detect_labels(normalized['vision'])
+            save_image_labels(convo_id, {upload_slot: labels_array}, {filename: manifest_image(upload_slot, urls)})
+    except Exception as e:
+        return upload_failed(convo_id, e)
 
-    if labels_doc.exists:
-        # Append new labels to the existing ones
-        existing_data = labels_doc.to_dict()
-        existing_labels = existing_data.get("labels", [])
-    else:
-        existing_labels = []
+    if duplicate is not None:
+        release_upload_slots(convo_id)
+        return jsonify({
+            "file_name": os.path.basename(duplicate['blob_name']),
+            "file_url": public_url(duplicate['blob_name']),
+            "sha256": digest,
+            "duplicate": True,
+            "upload_counter": upload_slot
+        }), 200
 
-    # Append the new labels to the existing labels
-    existing_labels.append({
-        f"image{upload_counter}": labels_array,
-        "timestamp": datetime.datetime.now()
-    })
+    return jsonify({
+        "file_name": filename,
+        "file_url": urls['original'],
+        "web_url": urls.get('web'),
+        "thumbnail_url": urls.get('thumb'),
+        "sha256": digest,
+        "last_image_label": labels_array,
+        "upload_counter": upload_slot + 1
+    }), 200
 
-    # Update the document with the new list of labels
-    image_labels_ref.document(convo_id).set({
-        "labels": existing_labels,
-        "counter": upload_counter
-    })
+# Save several images in bucket endpoint
+@app.route('/Save_Images_in_Bucket', methods=['POST'])
+def upload_images():
+    convo_id = request.form.get('id')
+    if not convo_id:
+        return jsonify({"error": "id is required"}), 400
+
+    files = [file for file in request.files.getlist('file') if file.filename != '']
+    if not files:
+        return jsonify({'error': 'No file part'}), 400
+
+    first_slot = reserve_upload_slots(convo_id, len(files))
+    if first_slot is None:
+        return jsonify(upload_limit_error(len(files))), 400
+
+    folder_path = f"{convo_id}/"
 
-    upload_counter += 1
-    if upload_counter>5:
-        return jsonify({"error": "You have reached the limit of 5 uploads per day"}), 400
+    def store(image, normalized):
+        filename, mimetype, image_bytes = image
+        return upload_image_renditions(folder_path, filename, image_bytes, mimetype, normalized)
+
+    try:
+        images = [(file.filename, file.mimetype, file.read()) for file in files]
+        normalized_images = list(io_executor.map(lambda image: normalize_image(image[2]), images))
+
+        # Upload to GCS concurrently while Vision labels the whole batch in one call
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(images)) as executor:
+            url_futures = [executor.submit(store, image, normalized) for image, normalized in zip(images, normalized_images)]
+            labels_arrays = detect_labels_batch([normalized['vision'] for normalized in normalized_images])
+            file_urls = [future.result() for future in url_futures]
+
+        labels_by_counter = {first_slot + i: labels for i, labels in enumerate(labels_arrays)}
+        manifest_images = {
+            filename: manifest_image(first_slot + i, urls)
+            for i, ((filename, _, _), urls) in enumerate(zip(images, file_urls))
+        }
+        save_image_labels(convo_id, labels_by_counter, manifest_images)
+    except Exception as e:
+        return upload_failed(convo_id, e, len(files))
 
-    print(jsonify({
-             "message": f"File {filename} uploaded successfully!",
-             "file_url": file_url,
-             "last_image_label": labels_array,
-             "upload_counter": upload_counter}))
     return jsonify({
-        "file_name": filename,
-        "file_url": file_url,
-        "last_image_label": labels_array,
-        "upload_counter": upload_counter  # Send upload_counter to frontend
+        "files": [
+            {
+                "file_name": filename,
+                "file_url": urls['original'],
+                "web_url": urls.get('web'),
+                "thumbnail_url": urls.get('thumb'),
+                "labels": labels
+            }
+            for (filename, _, _), urls, labels in zip(images, file_urls, labels_arrays)
+        ],
+        "upload_counter": first_slot + len(images)
     }), 200
 
+# Label cache statistics endpoint
+@app.route('/GetLabelCacheStats', methods=['GET'])
+def get_label_cache_stats():
+    with label_cache_stats_lock:
+        stats = dict(label_cache_stats)
+    lookups = sum(stats.values())
+    stats['hit_ratio'] = (stats['memory_hits'] + stats['firestore_hits']) / lookups if lookups else 0.0
+    stats['memory_entries'] = len(label_cache)
+    return jsonify(stats)
+
+# Label job status endpoint
+@app.route('/GetLabelJobStatus', methods=['GET'])
+def get_label_job_status():
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "job_id is required"}), 400
+
+    with track('firestore', 'get'):
+        job_doc = label_job_coll_ref.document(job_id).get()
+    if not job_doc.exists:
+        return jsonify({"error": f"No job found for job_id: {job_id}"}), 404
+
+    job_data = job_doc.to_dict()
+    return jsonify({
+        "job_id": job_id,
+        "status": job_data.get("status"),
+        "file_url": job_data.get("file_url"),
+        "labels": job_data.get("labels", []),
+        "error": job_data.get("error")
+    })
+
 # Save business info endpoint 
 @app.route('/Save_businessInfo_against_UserData', methods=['POST'])
 def save_business_info_endpoint():
@@ -233,8 +1416,109 @@ def call_openai_api(model, messages):
         "messages": messages
     }
 
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=json_data)
-    return response.json()
+    # Chat completions have no side effects, so retrying the POST is safe
+    response = http_request(
+        "POST", f"{OPENAI_BASE_URL}/chat/completions",
+        retry=True, timeout=(HTTP_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT),
+        dependency='openai', headers=headers, json=json_data
+    )
+    response_json = response.json()
+    record_openai_usage(model, response_json.get('usage'))
+    return response_json
+
+######## Generation Cache ########
+# Generated posts keyed by model + normalized prompt inputs, kept in memory and
+# persisted next to post_data so other workers can reuse them
+GENERATION_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_SIZE', 512))
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 6 * 3600))
+GENERATION_CACHE_PERSIST = os.environ.get('GENERATION_CACHE_PERSIST', 'true').lower() == 'true'
+
+generation_cache = TTLCache(GENERATION_CACHE_SIZE, GENERATION_CACHE_TTL)
+inflight_calls = {}
+inflight_calls_lock = threading.Lock()
+
+def single_flight(key, fn):
+    """Run `fn` once per key; concurrent callers with the same key share its result."""
+    with inflight_calls_lock:
+        future = inflight_calls.get(key)
+        leader = future is None
+        if leader:
+            future = concurrent.futures.Future()
+            inflight_calls[key] = future
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn()
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with inflight_calls_lock:
+            inflight_calls.pop(key, None)
+
+def generation_cache_key(model, business_info, labels):
+    """Hash the model and prompt inputs, ignoring whitespace, case and label order."""
+    normalized = json.dumps({
+        'model': model,
+        'business_info': ' '.join(str(business_info).split()),
+        'labels': sorted({label.strip().lower() for label in labels if label.strip()})
+    }, sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def lookup_post_generation(cache_key, post_data_ref=None, stored=None):
+    """Return a cached (message_content, generated_at) for the key, or None.
+
+    `stored` may be an already fetched post_data snapshot, saving the read.
+    """
+    cached = generation_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    if GENERATION_CACHE_PERSIST and (stored is not None or post_data_ref is not None):
+        if stored is None:
+            with track('firestore', 'get'):
+                stored = post_data_ref.get()
+        if stored.exists:
+            stored_data = stored.to_dict()
+            # The last served post, then the speculative draft
+            for record in (stored_data, stored_data.get('draft') or {}):
+                cached = stored_generation(record, cache_key)
+                if cached is not None:
+                    generation_cache.set(cache_key, cached)
+                    return cached
+    return None
+
+def stored_generation(record, cache_key):
+    """(raw_content, generated_at) from a stored generation record built from `cache_key`'s inputs.
+
+    Online generations expire after GENERATION_CACHE_TTL; those written by
+    batch.py stay valid until the inputs change.
+    """
+    generated_at = record.get('generated_at')
+    if record.get('generation_key') != cache_key or not record.get('raw_content') or generated_at is None:
+        return None
+    age = datetime.datetime.now(datetime.timezone.utc) - generated_at
+    if record.get('generation_source') != 'batch' and age.total_seconds() >= GENERATION_CACHE_TTL:
+        return None
+    return record['raw_content'], generated_at
+
+def generate_post_content(model, messages, cache_key, post_data_ref=None, regenerate=False, stored=None):
+    """Return (message_content, generated_at) for the prompt, calling OpenAI only on a cache miss."""
+    if not regenerate:
+        cached = lookup_post_generation(cache_key, post_data_ref, stored)
+        if cached is not None:
+            return cached
+
+    def generate():
+        response = call_openai_api(model=model, messages=messages)
+        logger.debug("OpenAI response", response=response)
+        result = (response['choices'][0]['message']['content'], datetime.datetime.now(datetime.timezone.utc))
+        generation_cache.set(cache_key, result)
+        return result
+
+    return single_flight(cache_key, generate)
 
 @app.route('/Update_UserData_in_Firestore', methods=['POST'])
 def update_user_info():
@@ -244,145 +1528,400 @@ def update_user_info():
         new_field_value = data['newField']  # New field to be added
 
         # Update the document with the new field
-        user_coll_ref.document(session_id).update({
-            'Schedule': new_field_value,  # Adding the new field
-            'lastUpdatedDate': datetime.datetime.now()  # Optionally, track when this update occurred
-        })
+        with track('firestore', 'update'):
+            user_coll_ref.document(session_id).update({
+                'Schedule': new_field_value,  # Adding the new field
+                'lastUpdatedDate': datetime.datetime.now(),  # Optionally, track when this update occurred
+                'profileUpdatedAt': firestore.SERVER_TIMESTAMP
+            })
+        invalidate_user_profile(session_id)
 
         return jsonify({'Status': True, 'Message': 'User data updated successfully. New field added.'})
     except Exception as e:
         return jsonify({'Status': False, 'Message': f'Error: {str(e)}'})
 ######################## Get User Data ########################                                
+# Function to extract headline
+def extract_headline(content):
+    # Headline usually has emojis and is in the first line
+    lines = content.split('\n')
+    headline = lines[0].strip()
+    return headline
+
+# Function to extract content
+def extract_content(content):
+    # Content follows the headline, stopping before the first hashtag
+    content_part = content.split('\n\n#')[0].strip()
+    return content_part
+
+# Function to extract tags
+def extract_tags(content):
+    # Tags usually start after the first hashtag (#)
+    tags = re.findall(r'#\w+', content)
+    return ', '.join(tags)
+
+def get_image_urls(bucket_name, conversation_id):
+    # Get the bucket
+    bucket = storage_client.bucket(bucket_name)
+
+    # Specify the prefix for your conversation ID
+    prefix = f'{conversation_id}/'  # Assuming images are stored in folders named by conversation_id
+
+    # List all objects with the prefix
+    with track('gcs', 'list'):
+        blobs = list(bucket.list_blobs(prefix=prefix))
+    blob_names = {blob.name for blob in blobs}
+
+    # Collect URLs, preferring the web rendition of each original
+    image_urls = []
+    for blob in blobs:
+        relative_name = blob.name[len(prefix):]
+        if '/' in relative_name:
+            continue  # a rendition, not an original
+        web_name = rendition_name(prefix, relative_name, 'web')
+        # Generate the signed URL or public URL if the bucket is publicly accessible
+        url = public_url(web_name if web_name in blob_names else blob.name)
+        image_urls.append(url)
+
+    return image_urls
+
+def load_post_inputs(user_doc_ref, convo_id):
+    """Read the business info, labels and images a post is generated from.
+
+    The user, manifest, labels and post_data documents are fetched in one
+    batched get_all. Returns (business_info, all_labels, labels_exist,
+    image_urls, post_data_doc); see parse_post_inputs for image_urls.
+    """
+    refs = post_input_refs(user_doc_ref, convo_id)
+    with track('firestore', 'get_all'):
+        docs = {doc.reference.path: doc for doc in db.get_all(refs)}
+    user_doc, manifest_doc, image_labels_doc, post_data_doc = (docs.get(ref.path) for ref in refs)
+    return (*parse_post_inputs(user_doc, manifest_doc, image_labels_doc), post_data_doc)
+
+def post_input_refs(user_doc_ref, convo_id):
+    return [
+        user_doc_ref,
+        manifest_ref(user_doc_ref, convo_id),
+        user_doc_ref.collection('labels').document(convo_id),
+        user_doc_ref.collection('post_data').document(convo_id)
+    ]
+
+def parse_post_inputs(user_doc, manifest_doc, image_labels_doc):
+    """Return (business_info, all_labels, labels_exist, image_urls) from the user, manifest and labels snapshots.
+
+    The manifest is used once it has counted every labeled image.
+    Conversations labeled before it existed fall back to the labels document
+    and get image_urls=None: their images have to be listed from the bucket.
+    """
+    user_data = user_doc.to_dict() if user_doc and user_doc.exists else {}
+    business_info = user_data.get('businessInfo')
+    logger.debug("Business info", business_info=business_info)
+
+    manifest = manifest_doc.to_dict() if manifest_doc and manifest_doc.exists else {}
+    labels_data = image_labels_doc.to_dict() if image_labels_doc and image_labels_doc.exists else {}
+    labels_exist = bool(labels_data or manifest.get('labeled_images'))
+
+    if manifest and manifest.get('labeled_images', 0) >= labels_data.get('counter', 0):
+        label_counts = manifest.get('label_counts') or {}
+        image_urls = manifest_image_urls(manifest)
+    else:
+        label_counts = legacy_label_counts(labels_data)
+        image_urls = None
+    all_labels = ranked_labels(label_counts)
+    logger.debug("Post labels", labels=all_labels, dropped=len(label_counts) - len(all_labels))
+    return business_info, all_labels, labels_exist, image_urls
+
+def build_post_messages(business_name, all_labels):
+    # Join labels into a single string
+    labels = ', '.join(all_labels)
+    logger.debug("Labels", labels=labels)
+
+    # Generate the prompt for GPT
+    prompt = f"""
+        Write a social media post for {business_name}. The post should highlight the latest trends related to the following topics: {labels}. Make the content engaging and include a call to action. Also, suggest a catchy headline and relevant tags. Ensure the post mentions contacting for more information.
+        """
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+def build_post_data(message_content, image_urls):
+    """Split the generated text into the post fields returned to Botpress."""
+    # Extract headline, content, and tags
+    return {
+        "headline": extract_headline(message_content),
+        "content": extract_content(message_content),
+        "tags": extract_tags(message_content),
+        "image_urls": image_urls,
+        "image_length": len(image_urls)
+    }
+
+def post_data_document(post_data, message_content, cache_key, generated_at, source=None):
+    """The stored post_data document: the post fields plus what the generation cache needs.
+
+    `source` is 'batch' for posts written by batch.py (see stored_generation).
+    """
+    document = {
+        **post_data,
+        "generation_key": cache_key,
+        "raw_content": message_content,
+        "generated_at": generated_at
+    }
+    if source:
+        document["generation_source"] = source
+    return document
+
+def stored_generation_source(post_data_doc, cache_key, generated_at):
+    """The source of the stored generation when it is the one being written again, so rewrites keep it."""
+    if post_data_doc is None or not post_data_doc.exists:
+        return None
+    stored_data = post_data_doc.to_dict()
+    stored_at = stored_data.get('generated_at')
+    if (stored_data.get('generation_key') == cache_key and stored_at is not None
+            and round(stored_at.timestamp() * 1e6) == round(generated_at.timestamp() * 1e6)):
+        return stored_data.get('generation_source')
+    return None
+
+def save_post_data(post_data_ref, message_content, image_urls, cache_key, generated_at, stored=None):
+    """Split the generated text into post fields, store them and return the response body.
+
+    `stored` is the post_data snapshot read with the inputs; when it already
+    holds this generation with these images, the write is skipped.
+    """
+    post_data = build_post_data(message_content, image_urls)
+    if not stored_post_current(stored, cache_key, generated_at, image_urls):
+        # Save data into Firestore 'post_data' collection for the convo_id
+        source = stored_generation_source(stored, cache_key, generated_at)
+        with track('firestore', 'set'):
+            post_data_ref.set(post_data_document(post_data, message_content, cache_key, generated_at, source))
+    return post_data
+
+def stored_post_current(post_data_doc, cache_key, generated_at, image_urls):
+    """True when the post_data snapshot already is this generation with these image URLs.
+
+    A draft-only document has no top-level generation_key, so promoting a
+    draft still writes.
+    """
+    if post_data_doc is None or not post_data_doc.exists:
+        return False
+    stored_data = post_data_doc.to_dict()
+    stored_at = stored_data.get('generated_at')
+    return (stored_data.get('generation_key') == cache_key
+            and stored_data.get('image_urls') == image_urls
+            and stored_at is not None
+            and round(stored_at.timestamp() * 1e6) == round(generated_at.timestamp() * 1e6))
+
+######## Draft Generation ########
+# Each labeling (re)starts a per-conversation timer; when uploads have been
+# quiet for DRAFT_DEBOUNCE_SECONDS the post is generated in the background
+# and stored as post_data.draft, tagged with its generation key, for
+# /GetPOSTDATA to pick up. Timers are per process, so uploads spread over
+# several workers can still produce one draft per worker.
+DRAFT_GENERATION = os.environ.get('DRAFT_GENERATION', 'true').lower() == 'true'
+DRAFT_DEBOUNCE_SECONDS = float(os.environ.get('DRAFT_DEBOUNCE_SECONDS', 15))
+DRAFT_WORKERS = int(os.environ.get('DRAFT_WORKERS', 4))
+draft_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DRAFT_WORKERS)
+draft_timers = {}
+draft_timers_lock = threading.Lock()
+
+def schedule_draft_generation(convo_id):
+    """Debounce: restart the conversation's timer so a burst of uploads drafts once."""
+    if not DRAFT_GENERATION or not convo_id:
+        return
+    with draft_timers_lock:
+        timer = draft_timers.pop(convo_id, None)
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer(DRAFT_DEBOUNCE_SECONDS, on_draft_timer, args=(convo_id,))
+        timer.daemon = True
+        draft_timers[convo_id] = timer
+        timer.start()
+
+def on_draft_timer(convo_id):
+    with draft_timers_lock:
+        # A newer upload may have replaced this timer just as it fired
+        if draft_timers.get(convo_id) is not threading.current_thread():
+            return
+        del draft_timers[convo_id]
+    draft_executor.submit(generate_draft, convo_id)
+
+def generate_draft(convo_id):
+    """Generate and store the post for the conversation's current inputs, unless one is stored already."""
+    try:
+        user_doc_ref = user_coll_ref.document(convo_id)
+        business_info, all_labels, labels_exist, _, post_data_doc = load_post_inputs(user_doc_ref, convo_id)
+        if not labels_exist or not business_info:
+            return
+        cache_key = generation_cache_key("gpt-4o", business_info, all_labels)
+        if lookup_post_generation(cache_key, stored=post_data_doc) is not None:
+            return
+        message_content, generated_at = generate_post_content(
+            "gpt-4o", build_post_messages(business_info, all_labels), cache_key, stored=post_data_doc
+        )
+        with track('firestore', 'set'):
+            user_doc_ref.collection("post_data").document(convo_id).set({
+                "draft": {
+                    "generation_key": cache_key,
+                    "raw_content": message_content,
+                    "generated_at": generated_at
+                }
+            }, merge=True)
+        logger.info("Draft generated", convo_id=convo_id, generation_key=cache_key)
+    except Exception as e:
+        logger.warning("Draft generation failed", convo_id=convo_id, error=str(e))
+
 @app.route('/GetPOSTDATA', methods=['GET'])
 def get_post_data():
     user_coll_ref = db.collection('users')
     convo_id = request.args.get('convo_id')
     if convo_id:
-        print("convo_id", convo_id)
+        logger.debug("Generating post", convo_id=convo_id)
     else:
-        print("convo id not created")
+        logger.warning("convo id not created")
     user_coll_ref = user_coll_ref.document(convo_id)
+    timings = {}
+    started = time.perf_counter()
     try:
-        # Get the data from the request
-
-        user_doc = user_coll_ref.get()
-        user_data = user_doc.to_dict()
-        business_info = user_data.get('businessInfo')
-        print("business info", business_info)
-        image_labels_ref = user_coll_ref.collection('labels')
-
-        # Fetch the existing document for convo_id
-        image_labels_doc = image_labels_ref.document(convo_id).get()
-        labels_data = image_labels_doc.to_dict()
-
-        print("labels data",labels_data)
-        # Extract labels from image1 to image4
-        all_labels = []
-        for image_key in ['image1', 'image2', 'image3', 'image4']:
-            labels_list = labels_data.get(image_key, [])
-            all_labels.extend(labels_list)
-
-        # Join labels into a single string
-        labels = ', '.join(all_labels)
-        print('labels', labels)
-        if not image_labels_doc.exists or not business_info:
+        business_info, all_labels, labels_exist, image_urls, post_data_doc = load_post_inputs(user_coll_ref, convo_id)
+        timings['firestore_read_ms'] = (time.perf_counter() - started) * 1000
+        if not labels_exist or not business_info:
             return jsonify({"error": "Both labelsData and businessInfo are required."}), 400
 
-        business_name = business_info
-
-        # Generate the prompt for GPT
-        prompt = f"""
-        Write a social media post for {business_name}. The post should highlight the latest trends related to the following topics: {labels}. Make the content engaging and include a call to action. Also, suggest a catchy headline and relevant tags. Ensure the post mentions contacting for more information.
-        """
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
+        # Answer a repeat poll for the stored post with a 304
+        regenerate = flag_enabled(request.args.get('regenerate'))
+        cache_key = generation_cache_key("gpt-4o", business_info, all_labels)
+        etag = None if regenerate else stored_post_etag(post_data_doc, cache_key, image_urls)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
 
-        # Call the GPT model
-        response = call_openai_api(model="gpt-4o", messages=messages)
-        print("openai response:", response)
-        # Extract GPT output
-        message_content = response['choices'][0]['message']['content']
-
-        # Function to extract headline
-        def extract_headline(content):
-            # Headline usually has emojis and is in the first line
-            lines = content.split('\n')
-            headline = lines[0].strip()
-            return headline
-
-        # Function to extract content
-        def extract_content(content):
-            # Content follows the headline, stopping before the first hashtag
-            content_part = content.split('\n\n#')[0].strip()
-            return content_part
-
-        # Function to extract tags
-        def extract_tags(content):
-            # Tags usually start after the first hashtag (#)
-            tags = re.findall(r'#\w+', content)
-            return ', '.join(tags)
-        def get_image_urls(bucket_name, conversation_id, project_id=None):
-            # Initialize the client
-            storage_client = storage.Client(project=project_id)
-
-            # Get the bucket
-            bucket = storage_client.bucket(bucket_name)
-
-            # Specify the prefix for your conversation ID
-            prefix = f'{conversation_id}/'  # Assuming images are stored in folders named by conversation_id
-
-            # List all objects with the prefix
-            blobs = bucket.list_blobs(prefix=prefix)
-
-            # Collect URLs
-            image_urls = []
-            for blob in blobs:
-                # Generate the signed URL or public URL if the bucket is publicly accessible
-                url = f"https://storage.googleapis.com/{bucket_name}/{blob.name}"
-                image_urls.append(url)
+        messages = build_post_messages(business_info, all_labels)
 
+        # Conversations without a manifest list their images while the model is generating
+        def list_images():
+            list_started = time.perf_counter()
+            image_urls = get_image_urls(bucket_name, convo_id)
+            timings['gcs_list_ms'] = (time.perf_counter() - list_started) * 1000
             return image_urls
+        image_urls_future = io_executor.submit(contextvars.copy_context().run, list_images) if image_urls is None else None
 
-        # Example usage
-        bucket_name = "imagesbucket_matt"
-        conversation_id = convo_id
-        project_id = "botpressbot-6083e"  # optional, only if you're working with a specific project
-        image_urls = get_image_urls(bucket_name, conversation_id)
-        image_length=len(image_urls)
-        for url in image_urls:
-            print(url)
-        # Extract headline, content, and tags
-        headline = extract_headline(message_content)
-        content = extract_content(message_content)
-        tags = extract_tags(message_content)
-
-        # Save data into Firestore 'post_data' collection for the convo_id
+        # Call the GPT model unless an identical generation is cached;
+        # ?regenerate=true forces a fresh call
+        llm_started = time.perf_counter()
         post_data_ref = user_coll_ref.collection("post_data").document(convo_id)
-        post_data_ref.set({
-            "headline": headline,
-            "content": content,
-            "tags": tags,
-            "image_urls": image_urls,
-            "image_length": image_length
-        })
-        return jsonify({
-            "headline": headline,
-            "content": content,
-            "tags": tags,
-            "image_urls":image_urls,
-            "image_length":image_length
-        })
+        message_content, generated_at = generate_post_content(
+            "gpt-4o", messages, cache_key, post_data_ref, regenerate=regenerate, stored=post_data_doc
+        )
+        timings['openai_ms'] = (time.perf_counter() - llm_started) * 1000
+
+        if image_urls_future is not None:
+            image_urls = image_urls_future.result()
+        logger.debug("Image URLs", convo_id=convo_id, image_urls=image_urls)
+
+        write_started = time.perf_counter()
+        response_body = save_post_data(post_data_ref, message_content, image_urls, cache_key, generated_at, post_data_doc)
+        timings['firestore_write_ms'] = (time.perf_counter() - write_started) * 1000
+
+        if app.debug:
+            timings['total_ms'] = (time.perf_counter() - started) * 1000
+            response_body = {**response_body, "timings": {stage: round(ms, 1) for stage, ms in timings.items()}}
+        response = jsonify(response_body)
+        response.set_etag(post_etag(cache_key, generated_at, image_urls), weak=True)
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/GetPOSTDATA/stream', methods=['GET'])
+def stream_post_data():
+    """Server-Sent Events variant of /GetPOSTDATA.
+
+    Emits `token` events as gpt-4o produces text, a `headline` event once the
+    first line is complete, a `tag` event per hashtag and a final `done` event
+    carrying the same body /GetPOSTDATA returns.
+    """
+    convo_id = request.args.get('convo_id')
+    if not convo_id:
+        return jsonify({"error": "convo_id is required"}), 400
+    regenerate = flag_enabled(request.args.get('regenerate'))
+    user_doc_ref = user_coll_ref.document(convo_id)
 
+    try:
+        business_info, all_labels, labels_exist, image_urls, post_data_doc = load_post_inputs(user_doc_ref, convo_id)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    if not labels_exist or not business_info:
+        return jsonify({"error": "Both labelsData and businessInfo are required."}), 400
+
+    messages = build_post_messages(business_info, all_labels)
+    post_data_ref = user_doc_ref.collection("post_data").document(convo_id)
+    cache_key = generation_cache_key("gpt-4o", business_info, all_labels)
+
+    def events():
+        try:
+            cached = None if regenerate else lookup_post_generation(cache_key, post_data_ref, stored=post_data_doc)
+            if cached is not None:
+                message_content, generated_at = cached
+                yield sse_event('headline', {"headline": extract_headline(message_content)})
+                for tag in re.findall(r'#\w+', message_content):
+                    yield sse_event('tag', {"tag": tag})
+            else:
+                message_content = ''
+                headline_sent = False
+                tags_sent = 0
+                stream_started = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model="gpt-4o", messages=messages, stream=True,
+                    stream_options={"include_usage": True}
+                )
+                for chunk in stream:
+                    if chunk.usage:
+                        record_openai_usage("gpt-4o", chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ''
+                    if not delta:
+                        continue
+                    message_content += delta
+                    yield sse_event('token', {"text": delta})
+
+                    if not headline_sent and '\n' in message_content:
+                        headline_sent = True
+                        yield sse_event('headline', {"headline": extract_headline(message_content)})
+
+                    # A tag is complete once a non-word character follows it
+                    complete_tags = re.findall(r'#\w+(?=\W)', message_content)
+                    for tag in complete_tags[tags_sent:]:
+                        yield sse_event('tag', {"tag": tag})
+                    tags_sent = len(complete_tags)
+
+                if not headline_sent:
+                    yield sse_event('headline', {"headline": extract_headline(message_content)})
+                for tag in re.findall(r'#\w+', message_content)[tags_sent:]:
+                    yield sse_event('tag', {"tag": tag})
+
+                DEPENDENCY_LATENCY.labels('openai', 'chat_stream', 'ok').observe(time.perf_counter() - stream_started)
+                generated_at = datetime.datetime.now(datetime.timezone.utc)
+                generation_cache.set(cache_key, (message_content, generated_at))
+
+            urls = image_urls if image_urls is not None else get_image_urls(bucket_name, convo_id)
+            yield sse_event('done', save_post_data(post_data_ref, message_content, urls, cache_key, generated_at, post_data_doc))
+        except Exception as e:
+            yield sse_event('error', {"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 def upload_blob(bucket_name, source_file_name, destination_blob_name):
 
 
     project_id = os.environ['PROJECT_ID']
 
+    from google.cloud import storage
     storage_client = storage.Client(project=project_id)
 
     bucket = storage_client.get_bucket(bucket_name)
@@ -392,15 +1931,12 @@ def upload_blob(bucket_name, source_file_name, destination_blob_name):
 
     blob.upload_from_filename(source_file_name)
 
-    print(
-        f"File {source_file_name} uploaded to {destination_blob_name}."
-    )
+    logger.info("File uploaded", source=source_file_name, destination=destination_blob_name)
 
 def check_existing_user(user_id):
-    user_doc = db.collection('users').document(user_id).get()
+    user_data = get_user_profile(user_id)
 
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
+    if user_data is not None:
         return {
             "found": True,
             "Data": {
@@ -421,7 +1957,9 @@ def check_existing_user(user_id):
 def save_business_info(userID, businessInfo):
     try:
         user_ref = db.collection('users').document(userID)
-        user_ref.update({'businessInfo': businessInfo})
+        with track('firestore', 'update'):
+            user_ref.update({'businessInfo': businessInfo, 'profileUpdatedAt': firestore.SERVER_TIMESTAMP})
+        invalidate_user_profile(userID)
         return {"Status": True, "Message": "Business Info Updated"}
     except Exception as e:
         return {"Status": False, "Message": f"Error: {str(e)}"}
@@ -434,17 +1972,119 @@ def get_website_address():
         return jsonify({"error": "User ID not provided"}), 400
 
     # Fetch the document for the given user_id
-    user_doc_ref = db.collection('users').document(user_id)
-    user_doc = user_doc_ref.get()
+    user_data = get_user_profile(user_id)
 
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
+    if user_data is not None:
         website_address = user_data.get('website', '')
-        return jsonify({"website_address": website_address})
+        return conditional_json({"website_address": website_address})
     else:
         return jsonify({"error": "User not found"}), 404
 
 ############# Post Data Wordpress ##################        
+# Publishing runs on its own pool; media uploads of one post fan out on io_executor
+PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS', 4))
+PUBLISH_MAX_IMAGES = 4
+# A job left 'running' this long is assumed dead and may be taken over
+PUBLISH_JOB_STALE_SECONDS = int(os.environ.get('PUBLISH_JOB_STALE_SECONDS', 600))
+publish_executor = concurrent.futures.ThreadPoolExecutor(max_workers=PUBLISH_WORKERS)
+publish_job_coll_ref = lazy_collection('publish_jobs')
+
+def publish_idempotency_key(convo_id, website_url, post_data):
+    """One publish job per conversation, WordPress site and generated post, however often it is retried.
+
+    A regenerated post has a new generation_key and generated_at, so it can
+    be published again; posts stored without them are told apart by content.
+    """
+    generated_at = post_data.get('generated_at')
+    if post_data.get('generation_key') and generated_at:
+        version = f"{post_data['generation_key']}|{round(generated_at.timestamp() * 1e6)}"
+    else:
+        version = hashlib.sha256(f"{post_data.get('headline')}|{post_data.get('content')}".encode('utf-8')).hexdigest()
+    key = f"{convo_id}|{(website_url or '').rstrip('/')}|{version}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def claim_publish_job(job_id, convo_id, website_url):
+    """Create or take over the job document for a publish attempt.
+
+    Returns (claimed, job_data); `claimed` is False when another attempt
+    already succeeded or is still in progress.
+    """
+    job_ref = publish_job_coll_ref.document(job_id)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    fresh = queued_publish_job(convo_id, website_url, now)
+    try:
+        with track('firestore', 'create'):
+            job_ref.create({**fresh, 'created': now})
+        return True, fresh
+    except api_exceptions.AlreadyExists:
+        pass
+
+    with track('firestore', 'get'):
+        snapshot = job_ref.get()
+    job_data = snapshot.to_dict()
+    if publish_job_retryable(job_data, now):
+        try:
+            # Only one retry may win the takeover
+            with track('firestore', 'update'):
+                job_ref.update(fresh, option=db.write_option(last_update_time=snapshot.update_time))
+            return True, {**job_data, **fresh}
+        except api_exceptions.FailedPrecondition:
+            with track('firestore', 'get'):
+                return False, job_ref.get().to_dict()
+    return False, job_data
+
+def queued_publish_job(convo_id, website_url, now):
+    return {'status': 'queued', 'convo_id': convo_id, 'website': website_url, 'error': None, 'updated': now}
+
+def publish_job_retryable(job_data, now):
+    """A failed job, or one whose worker has gone quiet, may be claimed again."""
+    updated = job_data.get('updated')
+    stale = updated is not None and (now - updated).total_seconds() > PUBLISH_JOB_STALE_SECONDS
+    return job_data.get('status') == 'failed' or (job_data.get('status') in ('queued', 'running') and stale)
+
+def run_publish_job(job_id, headline, content, image_urls, website_url, user_name, password):
+    """Publish a claimed job and record the outcome on it; returns the post, or None on failure.
+
+    Runs unobserved on publish_executor, so errors are logged here and mark
+    the job failed, letting the next attempt claim it.
+    """
+    job_ref = publish_job_coll_ref.document(job_id)
+    post = None
+    try:
+        with track('firestore', 'update'):
+            job_ref.update(publish_job_update('running'))
+        post = post_creator(headline, content, image_urls, website_url, "publish", user_name, password)
+        with track('firestore', 'update'):
+            job_ref.update(publish_job_outcome(post))
+    except Exception as e:
+        logger.error("Publish job failed", job_id=job_id, error=str(e))
+        # Once the post exists a retry would publish it twice; leave the job to go stale
+        if post is None:
+            try:
+                with track('firestore', 'update'):
+                    job_ref.update(publish_job_update('failed', error=str(e)))
+            except Exception as e:
+                logger.error("Error marking publish job failed", job_id=job_id, error=str(e))
+    return post
+
+def publish_job_update(status, **fields):
+    return {'status': status, **fields, 'updated': datetime.datetime.now(datetime.timezone.utc)}
+
+def publish_job_outcome(post):
+    """The job update once post_creator has returned `post` (None on failure)."""
+    if post is None:
+        return publish_job_update('failed', error='Failed to create post.')
+    return publish_job_update('done', post_id=post.get('id'), link=post.get('link'))
+
+def publish_inputs(post_data):
+    """(headline, content, image_urls) of a stored post, or None when any of them is missing."""
+    headline = post_data.get('headline')
+    content = post_data.get('content')
+    image_urls = post_data.get('image_urls')
+    if not headline or not content or not image_urls:
+        return None
+    return headline, content, image_urls
+
 @app.route('/post_to_wordpress', methods=['POST'])
 def post_to_wordpress():
     convo_id = request.args.get('convo_id')  # Retrieve convo_id from query parameters
@@ -460,55 +2100,120 @@ def post_to_wordpress():
     post_data_ref = user_doc_ref.collection("post_data")
 
     # Fetch the existing document for convo_id
-    get_post_data = post_data_ref.document(convo_id).get()
+    with track('firestore', 'get'):
+        get_post_data = post_data_ref.document(convo_id).get()
 
     # Check if post data exists
     if get_post_data.exists:
         post_data = get_post_data.to_dict()
-        content = post_data.get('content')
-        headline = post_data.get('headline')
-        image_urls = post_data.get('image_urls')
-
-        if not headline or not content or not image_urls:
+        inputs = publish_inputs(post_data)
+        if inputs is None:
             return jsonify({"error": "Missing required data on the server"}), 400
 
-        # Call the function to create a post on WordPress
-        print("website_urls", website_url)
-        status = post_creator(
-            headline, 
-            content, 
-            image_urls, 
-            # "https://getaichatbots.com",  # WordPress URL
-            # "publish",  # Post status
-            # "dev",  # WordPress username
-            # "B8zm PPCN vGJj kTHx mpWb mNuO"   # WordPress password
-            website_url,
-            "publish",
-            user_name,
-            password    
-        )
-
-        if status == 'success':
-            return jsonify({"message": "Post created successfully."}), 201
-        else:
-            return jsonify({"error": "Failed to create post."}), 500
+        # Retries of the same post to the same site map to the same job
+        job_id = publish_idempotency_key(convo_id, website_url, post_data)
+        claimed, job_data = claim_publish_job(job_id, convo_id, website_url)
+        if not claimed:
+            # Another attempt holds the job: hand back the link once it's done, else where to poll
+            if job_data.get('status') == 'done':
+                return jsonify({"message": "Post already created.", "job_id": job_id, "link": job_data.get('link')}), 200
+            return jsonify({"message": "Post is already being published.", "job_id": job_id,
+                            "status_url": f"/GetPublishJobStatus?job_id={job_id}"}), 202
+
+        logger.info("Publishing to WordPress", convo_id=convo_id, website=website_url)
+        job_args = (job_id, *inputs, website_url, user_name, password)
+
+        # ?wait=true publishes inside the request and answers like the old
+        # synchronous endpoint (201 with the link, or 500)
+        if flag_enabled(request.args.get('wait', data.get('wait'))):
+            post = run_publish_job(*job_args)
+            if post is None:
+                return jsonify({"error": "Failed to create post."}), 500
+            return jsonify({"message": "Post created successfully.", "job_id": job_id, "link": post.get('link')}), 201
+
+        # Otherwise publish in the background; poll the status_url for the link
+        publish_executor.submit(run_publish_job, *job_args)
+        return jsonify({"message": "Post queued.", "job_id": job_id, "status_url": f"/GetPublishJobStatus?job_id={job_id}"}), 202
 
     else:
-        print(f"No document found for convo_id: {convo_id}")
+        logger.warning("No post data found", convo_id=convo_id)
         return jsonify({"error": f"No document found for convo_id: {convo_id}"}), 404
 
-    #Ensure the global variables are set properly
-def post_creator(title, content, image_urls, wpBaseURL, status, user_name, password):
-    WP_url = f"{wpBaseURL}/wp-json/wp/v2/posts"
-    auth = HTTPBasicAuth(user_name, password)
+@app.route('/GetPublishJobStatus', methods=['GET'])
+def get_publish_job_status():
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "job_id is required"}), 400
 
-    headers = {
+    with track('firestore', 'get'):
+        job_doc = publish_job_coll_ref.document(job_id).get()
+    if not job_doc.exists:
+        return jsonify({"error": f"No job found for job_id: {job_id}"}), 404
+
+    job_data = job_doc.to_dict()
+    return jsonify({
+        "job_id": job_id,
+        "status": job_data.get("status"),
+        "post_id": job_data.get("post_id"),
+        "link": job_data.get("link"),
+        "error": job_data.get("error")
+    })
+
+def read_image_bytes(image_url):
+    """Read an image from our bucket directly, or over HTTP for any other URL."""
+    bucket_prefix = f"https://storage.googleapis.com/{bucket_name}/"
+    if image_url.startswith(bucket_prefix):
+        with track('gcs', 'download'):
+            return storage_client.bucket(bucket_name).blob(image_url[len(bucket_prefix):]).download_as_bytes()
+    response = http_request('GET', image_url)
+    response.raise_for_status()
+    return response.content
+
+def wordpress_media_headers(image_url):
+    file_name = os.path.basename(urlparse(image_url).path) or 'image.jpg'
+    content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    return {
         "Accept": "application/json",
-        "Content-Type": "application/json"
+        "Content-Type": content_type,
+        "Content-Disposition": f'attachment; filename="{file_name}"'
     }
 
-    # Insert images into content based on the number of URLs
-    image_html = ''.join([f'<p><img src="{url}" alt="Image {i+1}" /></p>\n' for i, url in enumerate(image_urls[:4])])
+def upload_wordpress_media(image_url, wpBaseURL, auth):
+    """Upload one image to the WordPress media library and return the media object."""
+    response = http_request(
+        "POST",
+        f"{wpBaseURL}/wp-json/wp/v2/media",
+        dependency='wordpress',
+        data=read_image_bytes(image_url),
+        headers=wordpress_media_headers(image_url),
+        auth=auth
+    )
+    return uploaded_media(response)
+
+def uploaded_media(response):
+    """The media object from a /wp/v2/media response (requests or httpx)."""
+    if response.status_code != 201:
+        raise Exception(f"Media upload failed: {response.status_code} - {response.text}")
+    return response.json()
+
+WORDPRESS_JSON_HEADERS = {
+    "Accept": "application/json",
+    "Content-Type": "application/json"
+}
+
+def created_post(response):
+    """The post object from a /wp/v2/posts response (requests or httpx), or None."""
+    if response.status_code == 201:
+        return response.json()
+    logger.error("Failed to create post", status=response.status_code, body=response.text)
+    return None
+
+def wordpress_post_payload(title, content, media, status):
+    # Insert images into content based on the number of uploaded media
+    image_html = ''.join([
+        f'<p><img src="{item.get("source_url")}" alt="Image {i+1}" class="wp-image-{item.get("id")}" /></p>\n'
+        for i, item in enumerate(media)
+    ])
     content_with_images = image_html + content
 
     # Prepare the payload for the POST request
@@ -517,94 +2222,339 @@ def post_creator(title, content, image_urls, wpBaseURL, status, user_name, passw
         "title": title,
         "content": content_with_images
     }
+    if media:
+        payload["featured_media"] = media[0].get("id")
+    return payload
+
+def post_creator(title, content, image_urls, wpBaseURL, status, user_name, password):
+    """Create a WordPress post; returns the created post object, or None on failure.
+
+    Up to PUBLISH_MAX_IMAGES images are uploaded to the media library in
+    parallel, the first becomes the featured image and all of them are
+    embedded from the media library instead of hotlinking GCS.
+    """
+    WP_url = f"{wpBaseURL}/wp-json/wp/v2/posts"
+    auth = HTTPBasicAuth(user_name, password)
 
     try:
-        response = requests.post(
+        media_futures = [
+            io_executor.submit(contextvars.copy_context().run, upload_wordpress_media, url, wpBaseURL, auth)
+            for url in image_urls[:PUBLISH_MAX_IMAGES]
+        ]
+        media = [future.result() for future in media_futures]
+        payload = wordpress_post_payload(title, content, media, status)
+
+        response = http_request(
+            "POST",
             WP_url,
+            dependency='wordpress',
             json=payload,
-            headers=headers,
+            headers=WORDPRESS_JSON_HEADERS,
             auth=auth
         )
-
-        if response.status_code == 201:
-            return 'success'
-        else:
-            print(f"Failed to create post: {response.status_code} - {response.text}")
-            return 'error'
+        return created_post(response)
 
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return 'error'  
+        logger.error("WordPress publish error", error=str(e))
+        return None
 ######## Website URL Scraping ########
+# Only the <head> is used, so the fetch stops as soon as it has been received
+SCRAPE_MAX_BYTES = int(os.environ.get('SCRAPE_MAX_BYTES', 512 * 1024))
+SCRAPE_TIME_BUDGET = float(os.environ.get('SCRAPE_TIME_BUDGET', 10))
+SCRAPE_CHUNK_SIZE = 16 * 1024
+HEAD_END = re.compile(rb'</head\s*>', re.IGNORECASE)
+
+def fetch_head_html(website_url):
+    """Stream the page until `</head>` arrives, SCRAPE_MAX_BYTES are read or
+    SCRAPE_TIME_BUDGET seconds have passed, and return the bytes read."""
+    deadline = time.monotonic() + SCRAPE_TIME_BUDGET
+    # No retries: a retry would break the time budget
+    response = http_request('GET', website_url, retry=False, stream=True, dependency='scrape',
+                            timeout=(HTTP_CONNECT_TIMEOUT, min(HTTP_READ_TIMEOUT, SCRAPE_TIME_BUDGET)))
+    html = bytearray()
+    with response:
+        response.raise_for_status()  # Check if the request was successful
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # A server sending a byte at a time must not keep each read alive:
+            # every read waits at most for what is left of the budget
+            sock = getattr(response.raw.connection, 'sock', None)
+            if sock is not None:
+                sock.settimeout(remaining)
+            try:
+                chunk = response.raw.read1(SCRAPE_CHUNK_SIZE, decode_content=True)
+            except (socket.timeout, ReadTimeoutError):
+                if not html:
+                    raise requests.exceptions.ReadTimeout(f"No response from {website_url} within the scrape time budget")
+                break
+            if not chunk:
+                break
+            head = scan_head(html, chunk, deadline)
+            if head is not None:
+                return head
+    return bytes(html[:SCRAPE_MAX_BYTES])
+
+def scan_head(html, chunk, deadline):
+    """Append `chunk` to `html`; return what to keep once the fetch should stop, else None."""
+    # Search only the tail that could contain a new match
+    search_from = max(len(html) - 16, 0)
+    html.extend(chunk)
+    head_end = HEAD_END.search(html, search_from)
+    if head_end:
+        return bytes(html[:head_end.end()])
+    if len(html) >= SCRAPE_MAX_BYTES or time.monotonic() > deadline:
+        return bytes(html[:SCRAPE_MAX_BYTES])
+    return None
+
+# Lookups shared by every scrape; failures are never cached
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+GEO_CACHE_TTL = int(os.environ.get('GEO_CACHE_TTL', 24 * 3600))
+SUMMARY_CACHE_TTL = int(os.environ.get('SUMMARY_CACHE_TTL', 7 * 24 * 3600))
+dns_cache = TTLCache(1024, DNS_CACHE_TTL)
+geo_cache = TTLCache(1024, GEO_CACHE_TTL)
+summary_cache = TTLCache(512, SUMMARY_CACHE_TTL)
+summary_cache_coll_ref = lazy_collection('summary_cache')
+
+def html_parser():
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+def parse_head(html):
+    """Parse only the <head> element of an HTML fragment."""
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    soup = BeautifulSoup(html, html_parser(), parse_only=SoupStrainer('head'))
+    return soup.head
+
+def website_hostname(url):
+    """Host name of a URL given with or without a scheme, or None when it has none."""
+    url = url.strip()
+    return urlparse(url if "//" in url else f"//{url}").hostname
 
 def get_website_ip(url):
+    hostname = website_hostname(url)  # Extracting domain from URL
+    if not hostname:
+        return None
+    ip_address = dns_cache.get(hostname)
+    if ip_address is not None:
+        return ip_address
     try:
         # Get the IP address of the website
-        ip_address = socket.gethostbyname(url.split("//")[-1].split("/")[0])  # Extracting domain from URL
+        ip_address = socket.gethostbyname(hostname)
+        dns_cache.set(hostname, ip_address)
         return ip_address
     except Exception as e:
-        print(f"Error getting IP address: {str(e)}")
+        logger.warning("Error getting IP address", error=str(e))
         return None
 
 def get_location_from_ip(ip):
+    geo_data = geo_cache.get(ip)
+    if geo_data is not None:
+        return geo_data
     try:
         # Use an external API to get location details from IP
-        response = requests.get(f'http://ip-api.com/json/{ip}')
-        return response.json()
+        response = http_request('GET', f'{GEOIP_URL}/{ip}', dependency='ip_api')
+        return remember_geo(ip, response.json())
     except Exception as e:
-        print(f"Error getting location from IP: {str(e)}")
+        logger.warning("Error getting location from IP", error=str(e))
         return {}
 
-def get_openai_summary(content):
+def remember_geo(ip, geo_data):
+    """Cache successful lookups only, so a failed one is retried next time."""
+    if geo_data.get('status') == 'success':
+        geo_cache.set(ip, geo_data)
+    return geo_data
+
+SUMMARY_MODEL = "gpt-4o"
+SUMMARY_TOKEN_BUDGET = int(os.environ.get('SUMMARY_TOKEN_BUDGET', 1500))
+# JSON-LD properties worth showing the model; everything else is dropped
+JSONLD_FIELDS = ('@type', 'name', 'alternateName', 'description', 'slogan', 'address', 'areaServed',
+                 'telephone', 'priceRange', 'openingHours', 'aggregateRating', 'award', 'founder', 'brand')
+token_encoding = None
+
+def count_tokens(text):
+    """Count gpt-4o tokens, estimating 4 characters per token without tiktoken."""
+    global token_encoding
+    if token_encoding is None:
+        try:
+            import tiktoken
+            token_encoding = tiktoken.encoding_for_model('gpt-4o')
+        except Exception:
+            token_encoding = False
+    if token_encoding:
+        return len(token_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, budget):
+    if count_tokens(text) <= budget:
+        return text
+    if token_encoding:
+        return token_encoding.decode(token_encoding.encode(text)[:budget])
+    return text[:budget * 4]
+
+def jsonld_items(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from jsonld_items(item)
+    elif isinstance(data, dict):
+        if '@graph' in data:
+            yield from jsonld_items(data['@graph'])
+        else:
+            yield data
+
+def compact_head_content(head):
+    """Reduce a parsed <head> to the text that describes the business.
+
+    Keeps the title, meta description/keywords, OpenGraph text tags and the
+    useful JSON-LD fields; scripts, styles and tracking snippets are dropped.
+    """
+    if head is None:
+        return ''
+    lines = []
+    title = head.find('title')
+    if title and title.get_text(strip=True):
+        lines.append(f"title: {title.get_text(strip=True)}")
+
+    for meta in head.find_all('meta'):
+        name = (meta.get('name') or meta.get('property') or '').lower()
+        content = (meta.get('content') or '').strip()
+        if not content:
+            continue
+        if name in ('description', 'keywords', 'author') or (
+                name.startswith('og:') and not name.startswith(('og:image', 'og:video', 'og:url'))):
+            lines.append(f"{name}: {content}")
+
+    for script in head.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string or '')
+        except ValueError:
+            continue
+        for item in jsonld_items(data):
+            fields = {key: item[key] for key in JSONLD_FIELDS if item.get(key)}
+            if fields:
+                lines.append(f"json-ld: {json.dumps(fields, separators=(',', ':'), ensure_ascii=False)}")
+
+    # Drop exact repeats (og:description often equals description)
+    return '\n'.join(dict.fromkeys(lines))
+
+def summary_messages(content):
     # Create a prompt to summarize the data
     prompt = f"""Generate a JSON summary from the following text {content} :
     The summary should be in the format: 
     {{"niche": "Industry/Niche", "seo_keywords": [], "pricing": {{"basic": "Basic Price","premium": "Premium Price"}}, "bio": "Short biography of key personnel", "reviews": {{"average_rating": "Rating","top_review": "Top review"}}, "additional_insights": {{"awards": ["Award 1","Award 2"], "notable_blog_post": "Title of notable blog post"}}}}."""
+    return [{"role": "user", "content": prompt}]
+
+def summary_request(content):
+    # JSON mode guarantees a parseable object, no code fences to strip
+    return {
+        'model': SUMMARY_MODEL,
+        'messages': summary_messages(content),
+        'response_format': {"type": "json_object"}
+    }
 
+def parse_summary(response):
+    record_openai_usage(SUMMARY_MODEL, response.usage)
+    return json.loads(response.choices[0].message.content)
+
+def get_openai_summary(content):
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        summary = response.choices[0].message.content
-        clean_summary = re.sub(r'```(json)?', '', summary).strip()
-        return json.loads(clean_summary)  # Return the generated JSON object
+        with track('openai', 'chat'):
+            response = client.chat.completions.create(**summary_request(content))
+        return parse_summary(response)  # Return the generated JSON object
     except Exception as e:
-        print(f"Error getting summary from OpenAI: {str(e)}")
+        logger.error("Error getting summary from OpenAI", error=str(e))
         return {}
 
-def scrapeWebsiteData(website_url):
-    try:
-        # Send a GET request to the website
-        response = requests.get(website_url)
-        response.raise_for_status()  # Check if the request was successful
+def summary_input(head_content):
+    """Compact a parsed <head> into the summary prompt content and its cache digest."""
+    compacted = compact_head_content(head_content)
+    tokens_before = count_tokens(str(head_content))
+    content = truncate_to_tokens(compacted, SUMMARY_TOKEN_BUDGET)
+    logger.info("Summary prompt tokens", raw_tokens=tokens_before, compacted_tokens=count_tokens(content))
+    return content, hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def stored_summary(cached_doc):
+    """The summary in a summary_cache snapshot, or None when missing or expired."""
+    if cached_doc.exists:
+        cached = cached_doc.to_dict()
+        expires_at = cached.get('expires_at')
+        if expires_at and expires_at > datetime.datetime.now(datetime.timezone.utc):
+            return cached['summary']
+    return None
+
+def summary_cache_document(summary):
+    return {
+        'summary': summary,
+        'expires_at': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=SUMMARY_CACHE_TTL)
+    }
 
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.content, 'html.parser')
-        head_content = soup.head
+def get_cached_openai_summary(head_content):
+    """Summarize a parsed <head>, reusing the summary of identical compacted content."""
+    content, digest = summary_input(head_content)
+    summary = summary_cache.get(digest)
+    if summary is not None:
+        return summary
+
+    with track('firestore', 'get'):
+        summary = stored_summary(summary_cache_coll_ref.document(digest).get())
+    if summary is not None:
+        summary_cache.set(digest, summary)
+        return summary
+
+    summary = get_openai_summary(content)
+    if summary:
+        summary_cache.set(digest, summary)
+        with track('firestore', 'set'):
+            summary_cache_coll_ref.document(digest).set(summary_cache_document(summary))
+    return summary
+
+# Pipeline stages used by scrapeWebsiteData; replace entries (or pass
+# `stages=`) to run the pipeline against local stubs
+scrape_stages = {
+    'fetch': fetch_head_html,
+    'parse': parse_head,
+    'resolve': get_website_ip,
+    'geolocate': get_location_from_ip,
+    'summarize': get_cached_openai_summary
+}
+
+def location_from_geo(geo_data):
+    location = {
+        "country": "Unknown",  
+        "city": "Unknown",
+        "postal_code": "Unknown"
+    }
+    if geo_data and geo_data.get('status') == 'success':
+        location.update({
+            "country": geo_data.get('country', 'Unknown'),
+            "city": geo_data.get('city', 'Unknown'),
+            "postal_code": geo_data.get('zip', 'Unknown')  # Some services may use 'zip' instead of 'postal'
+        })
+    return location
 
-        # Extract location details using the website's IP
-        location = {
-            "country": "Unknown",  
-            "city": "Unknown",
-            "postal_code": "Unknown"
-        }
+def lookup_location(website_url, stages):
+    # Extract location details using the website's IP
+    ip_address = stages['resolve'](website_url)
+    return location_from_geo(stages['geolocate'](ip_address) if ip_address else None)
 
-        # Get the website's IP address
-        ip_address = get_website_ip(website_url)
-        if ip_address:
-            geo_data = get_location_from_ip(ip_address)
-            if geo_data.get('status') == 'success':
-                location.update({
-                    "country": geo_data.get('country', 'Unknown'),
-                    "city": geo_data.get('city', 'Unknown'),
-                    "postal_code": geo_data.get('zip', 'Unknown')  # Some services may use 'zip' instead of 'postal'
-                })
+def scrapeWebsiteData(website_url, stages=None):
+    stages = {**scrape_stages, **(stages or {})}
+    try:
+        # DNS and geo-IP don't need the page, so they run alongside the
+        # fetch and the summary
+        location_future = io_executor.submit(contextvars.copy_context().run, lookup_location, website_url, stages)
 
-        # Extract niche/industry
+        # Fetch just the <head> of the page and parse that fragment
+        head_content = stages['parse'](stages['fetch'](website_url))
 
         # Get summary from OpenAI
-        summary = get_openai_summary(head_content)
+        summary = stages['summarize'](head_content)
+        location = location_future.result()
 
         # Combine all data into structured output
         output = {
@@ -629,10 +2579,69 @@ def scrape():
 
     result = scrapeWebsiteData(website_url)
     post_data_ref = user_coll_ref.document(convo_id).collection("website-metadata").document()  # Create a new document in the subcollection
-    post_data_ref.set({
-            "details":result
-        })
+    with track('firestore', 'set'):
+        post_data_ref.set({
+                "details":result
+            })
     return jsonify(result)
 
+SCRAPE_BULK_CONCURRENCY = int(os.environ.get('SCRAPE_BULK_CONCURRENCY', 8))
+SCRAPE_BULK_MAX_CONCURRENCY = int(os.environ.get('SCRAPE_BULK_MAX_CONCURRENCY', 32))
+SCRAPE_BULK_WRITE_BATCH = 20
+
+@app.route('/scrape/bulk', methods=['POST'])
+def scrape_bulk():
+    """Scrape many websites, streaming one NDJSON line per site as it finishes.
+
+    Body: {"sites": [{"website_url": ..., "id": ...}, ...], "concurrency": n}
+    (a bare list of sites is accepted too). Each result is also stored in the
+    site's `website-metadata` subcollection using batched writes.
+    """
+    data = request.get_json()
+    sites = data if isinstance(data, list) else (data or {}).get('sites', [])
+    concurrency = SCRAPE_BULK_CONCURRENCY
+    if isinstance(data, dict) and data.get('concurrency') is not None:
+        try:
+            concurrency = max(1, min(int(data['concurrency']), SCRAPE_BULK_MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            return jsonify({"error": "concurrency must be an integer"}), 400
+
+    sites = [site for site in sites if isinstance(site, dict)]
+    if not sites:
+        return jsonify({"error": "No websites provided"}), 400
+    if any(not site.get('website_url') or not site.get('id') for site in sites):
+        return jsonify({"error": "Every site needs a website_url and an id"}), 400
+
+    def results():
+        # A dedicated pool: scrapeWebsiteData itself fans out on io_executor
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        batch = db.batch()
+        pending_writes = 0
+        try:
+            futures = {executor.submit(scrapeWebsiteData, site['website_url']): site for site in sites}
+            for future in concurrent.futures.as_completed(futures):
+                site = futures[future]
+                result = future.result()
+                batch.set(user_coll_ref.document(site['id']).collection("website-metadata").document(), {
+                    "details": result
+                })
+                pending_writes += 1
+                if pending_writes >= SCRAPE_BULK_WRITE_BATCH:
+                    with track('firestore', 'commit'):
+                        batch.commit()
+                    batch = db.batch()
+                    pending_writes = 0
+                yield json.dumps({"id": site['id'], "website_url": site['website_url'], "details": result}) + "\n"
+        finally:
+            if pending_writes:
+                with track('firestore', 'commit'):
+                    batch.commit()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
+    if sys.argv[1:] == ['label-worker']:
+        run_label_worker()
+        sys.exit(0)
     app.run(host='0.0.0.0', port=3000, debug=True)
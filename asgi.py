@@ -0,0 +1,646 @@
+"""Async serving mode.
+
+The routes that spend their time waiting on gpt-4o, Vision, Firestore and
+GCS (/GetPOSTDATA, /Save_Image_in_Bucket, /scrape and /post_to_wordpress)
+run here as coroutines on Quart, using the async Firestore, OpenAI and
+Vision clients and httpx, so one process can keep hundreds of requests in
+flight. Every other path, and CORS preflights, are served by the Flask app
+in app.py. Request and response formats are the same in both modes.
+
+    hypercorn asgi:application --bind 0.0.0.0:3000
+
+Google Cloud Storage has no async client, so GCS calls and Pillow run on
+ASYNC_BLOCKING_WORKERS threads.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import datetime
+import functools
+import json
+import os
+import socket
+import time
+from urllib.parse import urlparse
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, jsonify, request
+
+import app as core
+from app import api_exceptions, logger, track
+
+async_app = Quart(__name__, static_folder=None)
+# Flask has no body size limit or response deadline; don't add any here
+async_app.config.update(MAX_CONTENT_LENGTH=core.app.config.get('MAX_CONTENT_LENGTH'), RESPONSE_TIMEOUT=None, BODY_TIMEOUT=None)
+
+ASYNC_HTTP_MAX_PER_HOST = int(os.environ.get('ASYNC_HTTP_MAX_PER_HOST', 100))
+ASYNC_BLOCKING_WORKERS = int(os.environ.get('ASYNC_BLOCKING_WORKERS', 64))
+# Separate from core.io_executor: the blocking helpers fan out onto that pool themselves
+blocking_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS)
+
+######## Async clients ########
+# Built on first use, which happens on the server's event loop they bind to
+
+def create_async_firestore_client():
+    from firebase_admin import firestore_async
+    return firestore_async.client(app=core.clients.get('firebase'))
+
+def create_async_openai_client():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(
+        api_key=os.environ.get('OPENAI_API_KEY'),
+        base_url=core.OPENAI_BASE_URL,
+        timeout=core.OPENAI_READ_TIMEOUT,
+        max_retries=core.HTTP_MAX_RETRIES
+    )
+
+def create_async_vision_client():
+    from google.cloud import vision
+    return vision.ImageAnnotatorAsyncClient(credentials=core.clients.get('google_credentials'))
+
+def create_async_http_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(core.HTTP_READ_TIMEOUT, connect=core.HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=ASYNC_HTTP_MAX_PER_HOST),
+        follow_redirects=True
+    )
+
+adb = core.clients.register('firestore_async', create_async_firestore_client)
+openai_client = core.clients.register('openai_async', create_async_openai_client)
+vision_client = core.clients.register('vision_async', create_async_vision_client)
+http_client = core.clients.register('http_async', create_async_http_client)
+
+async def run_blocking(fn, *args):
+    # Run in a copy of the request's context so track() still reaches its Server-Timing
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, call)
+
+async def get_all(refs):
+    with track('firestore', 'get_all'):
+        return [doc async for doc in adb.get_all(refs)]
+
+######## Outbound HTTP ########
+host_semaphores = {}
+
+def host_semaphore(url):
+    host = urlparse(url).netloc
+    if host not in host_semaphores:
+        host_semaphores[host] = asyncio.Semaphore(ASYNC_HTTP_MAX_PER_HOST)
+    return host_semaphores[host]
+
+async def http_request(method, url, retry=None, timeout=None, dependency='http', **kwargs):
+    """Async counterpart of core.http_request: same retry rules, per-host cap and timing."""
+    method = method.upper()
+    attempts = core.request_attempts(method, retry)
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+
+    for attempt in range(attempts):
+        try:
+            async with host_semaphore(url):
+                with track(dependency, method.lower()):
+                    response = await http_client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if not core.should_retry(attempt, attempts):
+                raise
+        else:
+            if not core.should_retry(attempt, attempts, response.status_code):
+                return response
+        await asyncio.sleep(core.retry_delay(attempt))
+
+######## Request hooks ########
+background_tasks = set()
+
+def spawn(coroutine):
+    """Run a coroutine past the end of the request that started it."""
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+@async_app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+    core.start_server_timing()
+
+@async_app.after_request
+async def finish_request(response):
+    # Same CORS answer flask_cors gives for origins="*"
+    origin = request.headers.get('Origin')
+    if origin:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers.add('Vary', 'Origin')
+
+    if (response.status_code == 200 and response.mimetype == 'application/json'
+            and 'Content-Encoding' not in response.headers):
+        response.vary.add('Accept-Encoding')
+        compressed = core.compress_body(await response.get_data(), request.accept_encodings)
+        if compressed is not None:
+            response.set_data(compressed[0])
+            response.headers['Content-Encoding'] = compressed[1]
+
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    core.ROUTE_LATENCY.labels(route, request.method, response.status_code).observe(elapsed)
+    response.headers['Server-Timing'] = core.server_timing_header(elapsed)
+    logger.info("Request handled", method=request.method, route=route, mode='async',
+                status=response.status_code, duration_ms=round(elapsed * 1000, 1))
+    return response
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+######## Image upload ########
+
+def upload_quota_ref(convo_id):
+    return adb.collection('users').document(convo_id).collection('quota').document('uploads')
+
+@core.lazy_decorator(core.firestore, 'async_transactional')
+async def reserve_upload_slots_txn(transaction, quota_ref, count):
+    claim = core.claim_upload_slots(await quota_ref.get(transaction=transaction), count)
+    if claim is None:
+        return None
+    first_slot, quota_update = claim
+    transaction.set(quota_ref, quota_update, merge=True)
+    return first_slot
+
+async def reserve_upload_slots(convo_id, count=1):
+    with track('firestore', 'transaction'):
+        return await reserve_upload_slots_txn(adb.transaction(), upload_quota_ref(convo_id), count)
+
+async def release_upload_slots(convo_id, count=1):
+    with track('firestore', 'update'):
+        await upload_quota_ref(convo_id).update({'count': core.firestore.Increment(-count)})
+
+async def upload_failed(convo_id, error, count=1):
+    """core.upload_failed for the async routes."""
+    logger.warning("Upload failed", convo_id=convo_id, error=str(error))
+    try:
+        await release_upload_slots(convo_id, count)
+    except Exception as e:
+        logger.error("Error releasing upload slots", convo_id=convo_id, count=count, error=str(e))
+    return jsonify({"error": f"Upload failed: {str(error)}"}), 500
+
+async def save_image_labels(convo_id, labels_by_counter, images=None):
+    batch = adb.batch()
+    for doc_ref, update in core.image_labels_writes(adb.collection('users').document(convo_id), convo_id,
+                                                    labels_by_counter, images):
+        batch.set(doc_ref, update, merge=True)
+    with track('firestore', 'commit'):
+        await batch.commit()
+    core.schedule_draft_generation(convo_id)
+
+async def get_cached_labels(digests):
+    found = core.memory_cached_labels(digests)
+    remaining = [digest for digest in digests if digest not in found]
+    if remaining:
+        docs = await get_all([adb.collection('label_cache').document(digest) for digest in remaining])
+        found.update(core.collect_cached_labels(docs, remaining))
+    return found
+
+async def store_cached_labels(labels_by_digest):
+    batch = adb.batch()
+    for digest, document in core.label_cache_documents(labels_by_digest).items():
+        batch.set(adb.collection('label_cache').document(digest), document)
+    try:
+        with track('firestore', 'commit'):
+            await batch.commit()
+    except Exception as e:
+        logger.warning("Error writing label cache", error=str(e))
+
+async def detect_labels_batch(images_bytes):
+    """Async counterpart of core.detect_labels_batch."""
+    digests = core.image_digests(images_bytes)
+    labels_by_digest = await get_cached_labels(list(dict.fromkeys(digests)))
+
+    detected = {}
+    for chunk, requests_batch in core.label_detection_batches(core.uncached_images(digests, images_bytes, labels_by_digest)):
+        with track('vision', 'batch_annotate'):
+            response = await vision_client.batch_annotate_images(requests=requests_batch)
+        detected.update(core.labels_from_batch(chunk, response))
+
+    if detected:
+        await store_cached_labels(detected)
+        labels_by_digest.update(detected)
+    return [labels_by_digest[digest] for digest in digests]
+
+@async_app.route('/Save_Image_in_Bucket', methods=['POST'])
+async def upload_image():
+    form = await request.form
+    files = await request.files
+    convo_id = form.get('id')
+    logger.debug("Upload received", convo_id=convo_id)
+    if not convo_id:
+        return jsonify({"error": "id is required"}), 400
+
+    if 'file' not in files:
+        return jsonify({'error': 'No file part'}), 400
+    file = files.get('file')
+
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+
+    upload_slot = await reserve_upload_slots(convo_id)
+    if upload_slot is None:
+        return jsonify(core.upload_limit_error()), 400
+
+    filename = file.filename
+    logger.info("Uploaded file", convo_id=convo_id, filename=filename)
+    folder_path = f"{convo_id}/"
+
+    try:
+        image_bytes = file.read()
+        normalized = await run_blocking(core.normalize_image, image_bytes)
+        urls = await run_blocking(core.upload_image_renditions, folder_path, filename, image_bytes, file.mimetype, normalized)
+
+        file_url = urls['original']
+        upload_counter = upload_slot + 1
+
+        manifest_images = {filename: core.manifest_image(upload_slot, urls)}
+        if core.flag_enabled(request.args.get('async', form.get('async'))):
+            user_doc_ref = adb.collection('users').document(convo_id)
+            with track('firestore', 'set'):
+                await core.manifest_ref(user_doc_ref, convo_id).set(core.manifest_update(manifest_images), merge=True)
+            job_id = await run_blocking(core.enqueue_label_job, convo_id, f"{folder_path}{filename}", file_url,
+                                        upload_slot, normalized['vision'])
+            return jsonify({
+                "file_name": filename,
+                "file_url": file_url,
+                "web_url": urls.get('web'),
+                "thumbnail_url": urls.get('thumb'),
+                "job_id": job_id,
+                "status_url": f"/GetLabelJobStatus?job_id={job_id}",
+                "upload_counter": upload_counter
+            }), 202
+
+        labels_array = (await detect_labels_batch([normalized['vision']]))[0]
+        await save_image_labels(convo_id, {upload_slot: labels_array}, manifest_images)
+    except Exception as e:
+        return await upload_failed(convo_id, e)
+
+    logger.info("File uploaded successfully", convo_id=convo_id, file_url=file_url,
+                last_image_label=labels_array, upload_counter=upload_counter)
+    return jsonify({
+        "file_name": filename,
+        "file_url": file_url,
+        "web_url": urls.get('web'),
+        "thumbnail_url": urls.get('thumb'),
+        "last_image_label": labels_array,
+        "upload_counter": upload_counter
+    }), 200
+
+######## Post generation ########
+inflight_generations = {}
+
+async def single_flight(key, fn):
+    """Await one `fn()` per key; concurrent callers share it, even if the first one disconnects."""
+    task = inflight_generations.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fn())
+        inflight_generations[key] = task
+        task.add_done_callback(lambda _: inflight_generations.pop(key, None))
+    return await asyncio.shield(task)
+
+async def load_post_inputs(user_doc_ref, convo_id):
+    refs = core.post_input_refs(user_doc_ref, convo_id)
+    docs = {doc.reference.path: doc for doc in await get_all(refs)}
+    user_doc, manifest_doc, image_labels_doc, post_data_doc = (docs.get(ref.path) for ref in refs)
+    return (*core.parse_post_inputs(user_doc, manifest_doc, image_labels_doc), post_data_doc)
+
+async def generate_post_content(model, messages, cache_key, regenerate=False, stored=None):
+    """Async counterpart of core.generate_post_content; `stored` is the post_data snapshot."""
+    if not regenerate:
+        cached = core.lookup_post_generation(cache_key, stored=stored)
+        if cached is not None:
+            return cached
+
+    async def generate():
+        with track('openai', 'chat'):
+            response = await openai_client.chat.completions.create(model=model, messages=messages)
+        core.record_openai_usage(model, response.usage)
+        result = (response.choices[0].message.content, datetime.datetime.now(datetime.timezone.utc))
+        core.generation_cache.set(cache_key, result)
+        return result
+
+    return await single_flight(cache_key, generate)
+
+@async_app.route('/GetPOSTDATA', methods=['GET'])
+async def get_post_data():
+    convo_id = request.args.get('convo_id')
+    if convo_id:
+        logger.debug("Generating post", convo_id=convo_id)
+    else:
+        logger.warning("convo id not created")
+    timings = {}
+    started = time.perf_counter()
+    try:
+        user_doc_ref = adb.collection('users').document(convo_id)
+        business_info, all_labels, labels_exist, image_urls, post_data_doc = await load_post_inputs(user_doc_ref, convo_id)
+        timings['firestore_read_ms'] = (time.perf_counter() - started) * 1000
+        if not labels_exist or not business_info:
+            return jsonify({"error": "Both labelsData and businessInfo are required."}), 400
+
+        regenerate = core.flag_enabled(request.args.get('regenerate'))
+        cache_key = core.generation_cache_key("gpt-4o", business_info, all_labels)
+        etag = None if regenerate else core.stored_post_etag(post_data_doc, cache_key, image_urls)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        messages = core.build_post_messages(business_info, all_labels)
+        post_data_ref = user_doc_ref.collection("post_data").document(convo_id)
+
+        async def list_images():
+            if image_urls is not None:
+                return image_urls
+            list_started = time.perf_counter()
+            listed = await run_blocking(core.get_image_urls, core.bucket_name, convo_id)
+            timings['gcs_list_ms'] = (time.perf_counter() - list_started) * 1000
+            return listed
+
+        async def generate():
+            llm_started = time.perf_counter()
+            result = await generate_post_content("gpt-4o", messages, cache_key, regenerate=regenerate, stored=post_data_doc)
+            timings['openai_ms'] = (time.perf_counter() - llm_started) * 1000
+            return result
+
+        (message_content, generated_at), urls = await asyncio.gather(generate(), list_images())
+
+        write_started = time.perf_counter()
+        response_body = core.build_post_data(message_content, urls)
+        if not core.stored_post_current(post_data_doc, cache_key, generated_at, urls):
+            source = core.stored_generation_source(post_data_doc, cache_key, generated_at)
+            with track('firestore', 'set'):
+                await post_data_ref.set(core.post_data_document(response_body, message_content, cache_key, generated_at, source))
+        timings['firestore_write_ms'] = (time.perf_counter() - write_started) * 1000
+
+        if core.app.debug:
+            timings['total_ms'] = (time.perf_counter() - started) * 1000
+            response_body = {**response_body, "timings": {stage: round(ms, 1) for stage, ms in timings.items()}}
+        response = jsonify(response_body)
+        response.set_etag(core.post_etag(cache_key, generated_at, urls), weak=True)
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+######## WordPress ########
+
+async def claim_publish_job(job_id, convo_id, website_url):
+    job_ref = adb.collection('publish_jobs').document(job_id)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    fresh = core.queued_publish_job(convo_id, website_url, now)
+    try:
+        with track('firestore', 'create'):
+            await job_ref.create({**fresh, 'created': now})
+        return True, fresh
+    except api_exceptions.AlreadyExists:
+        pass
+
+    with track('firestore', 'get'):
+        snapshot = await job_ref.get()
+    job_data = snapshot.to_dict()
+    if core.publish_job_retryable(job_data, now):
+        try:
+            with track('firestore', 'update'):
+                await job_ref.update(fresh, option=adb.write_option(last_update_time=snapshot.update_time))
+            return True, {**job_data, **fresh}
+        except api_exceptions.FailedPrecondition:
+            with track('firestore', 'get'):
+                return False, (await job_ref.get()).to_dict()
+    return False, job_data
+
+async def read_image_bytes(image_url):
+    if image_url.startswith(f"https://storage.googleapis.com/{core.bucket_name}/"):
+        return await run_blocking(core.read_image_bytes, image_url)
+    response = await http_request('GET', image_url)
+    response.raise_for_status()
+    return response.content
+
+async def upload_wordpress_media(image_url, wp_base_url, auth):
+    response = await http_request(
+        "POST",
+        f"{wp_base_url}/wp-json/wp/v2/media",
+        dependency='wordpress',
+        content=await read_image_bytes(image_url),
+        headers=core.wordpress_media_headers(image_url),
+        auth=auth
+    )
+    return core.uploaded_media(response)
+
+async def post_creator(title, content, image_urls, wp_base_url, status, user_name, password):
+    """Async counterpart of core.post_creator; returns the created post or None."""
+    try:
+        auth = httpx.BasicAuth(user_name, password)
+        media = await asyncio.gather(*[
+            upload_wordpress_media(url, wp_base_url, auth)
+            for url in image_urls[:core.PUBLISH_MAX_IMAGES]
+        ])
+        response = await http_request(
+            "POST",
+            f"{wp_base_url}/wp-json/wp/v2/posts",
+            dependency='wordpress',
+            json=core.wordpress_post_payload(title, content, list(media), status),
+            headers=core.WORDPRESS_JSON_HEADERS,
+            auth=auth
+        )
+        return core.created_post(response)
+    except Exception as e:
+        logger.error("WordPress publish error", error=str(e))
+        return None
+
+async def run_publish_job(job_id, headline, content, image_urls, website_url, user_name, password):
+    """Async counterpart of core.run_publish_job; spawned tasks are never awaited, so it never raises."""
+    job_ref = adb.collection('publish_jobs').document(job_id)
+    post = None
+    try:
+        with track('firestore', 'update'):
+            await job_ref.update(core.publish_job_update('running'))
+        post = await post_creator(headline, content, image_urls, website_url, "publish", user_name, password)
+        with track('firestore', 'update'):
+            await job_ref.update(core.publish_job_outcome(post))
+    except Exception as e:
+        logger.error("Publish job failed", job_id=job_id, error=str(e))
+        if post is None:
+            try:
+                with track('firestore', 'update'):
+                    await job_ref.update(core.publish_job_update('failed', error=str(e)))
+            except Exception as e:
+                logger.error("Error marking publish job failed", job_id=job_id, error=str(e))
+    return post
+
+@async_app.route('/post_to_wordpress', methods=['POST'])
+async def post_to_wordpress():
+    convo_id = request.args.get('convo_id')
+    data = await request.get_json()
+    user_name = data.get('userName')
+    password = data.get('passWord')
+    website_url = data.get('website')
+    if not convo_id:
+        return jsonify({"error": "convo_id is required"}), 400
+
+    with track('firestore', 'get'):
+        get_post_data = await adb.collection('users').document(convo_id).collection("post_data").document(convo_id).get()
+    if not get_post_data.exists:
+        logger.warning("No post data found", convo_id=convo_id)
+        return jsonify({"error": f"No document found for convo_id: {convo_id}"}), 404
+
+    post_data = get_post_data.to_dict()
+    inputs = core.publish_inputs(post_data)
+    if inputs is None:
+        return jsonify({"error": "Missing required data on the server"}), 400
+
+    job_id = core.publish_idempotency_key(convo_id, website_url, post_data)
+    claimed, job_data = await claim_publish_job(job_id, convo_id, website_url)
+    if not claimed:
+        if job_data.get('status') == 'done':
+            return jsonify({"message": "Post already created.", "job_id": job_id, "link": job_data.get('link')}), 200
+        return jsonify({"message": "Post is already being published.", "job_id": job_id,
+                        "status_url": f"/GetPublishJobStatus?job_id={job_id}"}), 202
+
+    logger.info("Publishing to WordPress", convo_id=convo_id, website=website_url)
+    job_args = (job_id, *inputs, website_url, user_name, password)
+
+    if core.flag_enabled(request.args.get('wait', data.get('wait'))):
+        post = await run_publish_job(*job_args)
+        if post is None:
+            return jsonify({"error": "Failed to create post."}), 500
+        return jsonify({"message": "Post created successfully.", "job_id": job_id, "link": post.get('link')}), 201
+
+    spawn(run_publish_job(*job_args))
+    return jsonify({"message": "Post queued.", "job_id": job_id, "status_url": f"/GetPublishJobStatus?job_id={job_id}"}), 202
+
+######## Scraping ########
+
+async def fetch_head_html(website_url):
+    """Async counterpart of core.fetch_head_html."""
+    deadline = time.monotonic() + core.SCRAPE_TIME_BUDGET
+    timeout = httpx.Timeout(min(core.HTTP_READ_TIMEOUT, core.SCRAPE_TIME_BUDGET), connect=core.HTTP_CONNECT_TIMEOUT)
+    html = bytearray()
+
+    async def read_head():
+        async with http_client.stream('GET', website_url, timeout=timeout) as response:
+            response.raise_for_status()
+            # Unsized chunks: each one is kept as soon as it arrives
+            async for chunk in response.aiter_bytes():
+                head = core.scan_head(html, chunk, deadline)
+                if head is not None:
+                    return head
+        return bytes(html[:core.SCRAPE_MAX_BYTES])
+
+    async with host_semaphore(website_url):
+        with track('scrape', 'get'):
+            # The budget covers the whole fetch, however slowly the bytes arrive
+            try:
+                return await asyncio.wait_for(read_head(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if not html:
+                    raise httpx.ReadTimeout(f"No response from {website_url} within the scrape time budget")
+                return bytes(html[:core.SCRAPE_MAX_BYTES])
+
+async def get_website_ip(url):
+    hostname = core.website_hostname(url)
+    if not hostname:
+        # getaddrinfo(None) would resolve the loopback address
+        return None
+    ip_address = core.dns_cache.get(hostname)
+    if ip_address is not None:
+        return ip_address
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(hostname, None, family=socket.AF_INET)
+        ip_address = addresses[0][4][0]
+        core.dns_cache.set(hostname, ip_address)
+        return ip_address
+    except Exception as e:
+        logger.warning("Error getting IP address", error=str(e))
+        return None
+
+async def get_location_from_ip(ip):
+    geo_data = core.geo_cache.get(ip)
+    if geo_data is not None:
+        return geo_data
+    try:
+        response = await http_request('GET', f'{core.GEOIP_URL}/{ip}', dependency='ip_api')
+        return core.remember_geo(ip, response.json())
+    except Exception as e:
+        logger.warning("Error getting location from IP", error=str(e))
+        return {}
+
+async def lookup_location(website_url):
+    ip_address = await get_website_ip(website_url)
+    return core.location_from_geo(await get_location_from_ip(ip_address) if ip_address else None)
+
+async def get_openai_summary(content):
+    try:
+        with track('openai', 'chat'):
+            response = await openai_client.chat.completions.create(**core.summary_request(content))
+        return core.parse_summary(response)
+    except Exception as e:
+        logger.error("Error getting summary from OpenAI", error=str(e))
+        return {}
+
+async def get_cached_openai_summary(head_content):
+    content, digest = await run_blocking(core.summary_input, head_content)
+    summary = core.summary_cache.get(digest)
+    if summary is not None:
+        return summary
+
+    summary_ref = adb.collection('summary_cache').document(digest)
+    with track('firestore', 'get'):
+        summary = core.stored_summary(await summary_ref.get())
+    if summary is not None:
+        core.summary_cache.set(digest, summary)
+        return summary
+
+    summary = await get_openai_summary(content)
+    if summary:
+        core.summary_cache.set(digest, summary)
+        with track('firestore', 'set'):
+            await summary_ref.set(core.summary_cache_document(summary))
+    return summary
+
+async def scrape_website_data(website_url):
+    """Async counterpart of core.scrapeWebsiteData, with the same output and error strings."""
+    location_task = asyncio.ensure_future(lookup_location(website_url))
+    try:
+        head_content = await run_blocking(core.parse_head, await fetch_head_html(website_url))
+        summary = await get_cached_openai_summary(head_content)
+        output = {
+            "location": await location_task,
+            "summary": summary
+        }
+        return json.dumps(output, indent=4)
+    except httpx.HTTPError as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        return f"Error while scraping: {str(e)}"
+    finally:
+        location_task.cancel()
+
+@async_app.route('/scrape', methods=['POST'])
+async def scrape():
+    data = await request.get_json()
+    website_url = data.get('website_url')
+    convo_id = data.get("id")
+    if not website_url:
+        return jsonify({"error": "No website URL provided"}), 400
+
+    result = await scrape_website_data(website_url)
+    with track('firestore', 'set'):
+        await adb.collection('users').document(convo_id).collection("website-metadata").document().set({
+            "details": result
+        })
+    return jsonify(result)
+
+######## Dispatch ########
+ASYNC_ROUTES = frozenset(rule.rule for rule in async_app.url_map.iter_rules())
+flask_app = WsgiToAsgi(core.app)
+
+async def application(scope, receive, send):
+    """Serve the async routes on Quart and everything else through the Flask app."""
+    if scope['type'] != 'http' or (scope['path'] in ASYNC_ROUTES and scope['method'] != 'OPTIONS'):
+        await async_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
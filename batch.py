@@ -0,0 +1,402 @@
+"""Offline post generation for conversations waiting on a post.
+
+    python batch.py run                   # scan, submit, wait for the batch, write back
+    python batch.py run --no-wait         # submit or check on the batch, then exit
+    python batch.py run --backend local   # answer requests in-process (tests, fakes)
+    python batch.py status
+
+A conversation is pending when it has labels and business info but its
+post_data holds no generation (served or draft) for its current inputs,
+however old the stored one is. Each pending
+conversation gets the prompt /GetPOSTDATA would send, and the prompts go out
+as one OpenAI Batch API job (JSONL, 24h completion window). Answers are
+split into post fields the same way as online and stored as post_data in
+batched Firestore writes, so /GetPOSTDATA serves them without calling the
+model. Batch-written posts don't expire after GENERATION_CACHE_TTL like
+online ones; they stay current until the conversation's inputs change.
+
+Each batch lives in BATCH_WORK_DIR/<batch_id>/:
+
+    input.jsonl    Batch API requests, custom_id = conversation id
+    inputs.jsonl   the generation key and image URLs of each request
+    state.json     built -> submitted -> downloaded -> done (or failed),
+                   plus the uploaded input file id once there is one
+    output.jsonl   the downloaded answers
+    written.txt    conversations whose post_data has been committed
+
+Every step records its progress before moving on. Rerunning `run` after a
+crash picks up the unfinished batch where it stopped instead of scanning
+again. The local backend is a file-based stand-in for the Batch API. It
+answers each request through call_openai_api, so OPENAI_BASE_URL can point
+at fakes.openai.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import secrets
+import shutil
+import sys
+import time
+
+import app as core
+from app import logger, track
+
+# Must match the online path, or the generation keys won't line up
+MODEL = "gpt-4o"
+BATCH_WORK_DIR = os.environ.get('BATCH_WORK_DIR', 'batches')
+# Batch API limits are 50,000 requests and 200 MB per input file
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 50000))
+BATCH_SCAN_CHUNK = 100
+BATCH_WRITE_SIZE = 400
+# How many of the newest remote batches to search when resuming a submit
+BATCH_LOOKUP_LIMIT = 1000
+TERMINAL_STATUSES = ('completed', 'expired', 'cancelled', 'failed')
+
+######## Backends ########
+
+class OpenAIBatchBackend:
+    """The OpenAI Batch API, through the app's OpenAI client."""
+
+    def upload(self, batch_id, input_path):
+        with open(input_path, 'rb') as input_file:
+            return core.client.files.create(file=input_file, purpose='batch').id
+
+    def create(self, batch_id, input_file_id):
+        batch = core.client.batches.create(
+            input_file_id=input_file_id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata={'batch_id': batch_id}
+        )
+        return batch.id
+
+    def find(self, batch_id):
+        """The remote id of a batch already created for `batch_id`, or None."""
+        # Newest first; a batch lost to a crash is among the most recent ones
+        for batch in itertools.islice(core.client.batches.list(limit=100), BATCH_LOOKUP_LIMIT):
+            if (batch.metadata or {}).get('batch_id') == batch_id:
+                return batch.id
+        return None
+
+    def poll(self, remote_id):
+        """Return (status, output_file_id, error_file_id)."""
+        batch = core.client.batches.retrieve(remote_id)
+        return batch.status, batch.output_file_id, batch.error_file_id
+
+    def download(self, file_id, path):
+        core.client.files.content(file_id).write_to_file(path)
+
+
+class LocalBatchBackend:
+    """Runs a batch in this process and keeps its files under `root`, like the Batch API would."""
+
+    def __init__(self, root, workers=8):
+        self.root = root
+        self.workers = workers
+
+    def upload(self, batch_id, input_path):
+        file_id = os.path.join('files', f"{batch_id}.jsonl")
+        os.makedirs(os.path.join(self.root, 'files'), exist_ok=True)
+        shutil.copyfile(input_path, os.path.join(self.root, file_id))
+        return file_id
+
+    def create(self, batch_id, input_file_id):
+        remote_id = f"local-{batch_id}"
+        os.makedirs(os.path.join(self.root, remote_id), exist_ok=True)
+        shutil.copyfile(os.path.join(self.root, input_file_id), os.path.join(self.root, remote_id, 'input.jsonl'))
+        return remote_id
+
+    def find(self, batch_id):
+        remote_id = f"local-{batch_id}"
+        if os.path.exists(os.path.join(self.root, remote_id, 'input.jsonl')):
+            return remote_id
+        return None
+
+    def poll(self, remote_id):
+        directory = os.path.join(self.root, remote_id)
+        output_path = os.path.join(directory, 'output.jsonl')
+        if not os.path.exists(output_path):
+            with open(os.path.join(directory, 'input.jsonl')) as input_file:
+                requests_batch = [json.loads(line) for line in input_file if line.strip()]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.answer, requests_batch))
+            write_jsonl(output_path + '.tmp', results)
+            os.replace(output_path + '.tmp', output_path)
+        return 'completed', os.path.join(remote_id, 'output.jsonl'), None
+
+    def download(self, file_id, path):
+        shutil.copyfile(os.path.join(self.root, file_id), path)
+
+    def answer(self, batch_request):
+        """One output line in the Batch API's format."""
+        result = {'id': f"batch_req_{secrets.token_hex(8)}", 'custom_id': batch_request['custom_id']}
+        try:
+            body = core.call_openai_api(**batch_request['body'])
+            return {**result, 'response': {'status_code': 200, 'body': body}, 'error': None}
+        except Exception as e:
+            return {**result, 'response': None, 'error': {'message': str(e)}}
+
+
+def create_backend(name, work_dir):
+    if name == 'local':
+        return LocalBatchBackend(os.path.join(work_dir, 'local'))
+    return OpenAIBatchBackend()
+
+######## Batch files ########
+
+def write_jsonl(path, items):
+    with open(path, 'w') as output:
+        for item in items:
+            output.write(json.dumps(item) + '\n')
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as input_file:
+        return [json.loads(line) for line in input_file if line.strip()]
+
+def batch_path(work_dir, batch_id, name):
+    return os.path.join(work_dir, batch_id, name)
+
+def load_state(work_dir, batch_id):
+    with open(batch_path(work_dir, batch_id, 'state.json')) as state_file:
+        return json.load(state_file)
+
+def save_state(work_dir, state):
+    """Replace state.json atomically so a crash leaves the previous state intact."""
+    path = batch_path(work_dir, state['batch_id'], 'state.json')
+    state['updated'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+def list_batches(work_dir):
+    if not os.path.isdir(work_dir):
+        return []
+    batch_ids = sorted(
+        name for name in os.listdir(work_dir)
+        if os.path.exists(batch_path(work_dir, name, 'state.json'))
+    )
+    return [load_state(work_dir, batch_id) for batch_id in batch_ids]
+
+def unfinished_batch(work_dir):
+    for state in list_batches(work_dir):
+        if state['status'] not in ('done', 'failed'):
+            return state
+    return None
+
+######## Scan ########
+
+def labeled_conversations():
+    """Conversation ids that have a users/{id}/labels document."""
+    for labels_doc in core.db.collection_group('labels').stream():
+        parts = labels_doc.reference.path.split('/')
+        if len(parts) == 4 and parts[0] == 'users':
+            yield parts[1]
+
+def pending_conversations(limit):
+    """Yield {convo_id, cache_key, image_urls, messages} for conversations without a current post."""
+    found = 0
+    convo_ids = labeled_conversations()
+    while found < limit:
+        chunk = [convo_id for _, convo_id in zip(range(BATCH_SCAN_CHUNK), convo_ids)]
+        if not chunk:
+            return
+        refs_by_convo = {
+            convo_id: core.post_input_refs(core.user_coll_ref.document(convo_id), convo_id)
+            for convo_id in chunk
+        }
+        with track('firestore', 'get_all'):
+            docs = {
+                doc.reference.path: doc
+                for doc in core.db.get_all([ref for refs in refs_by_convo.values() for ref in refs])
+            }
+        for convo_id, refs in refs_by_convo.items():
+            user_doc, manifest_doc, image_labels_doc, post_data_doc = (docs.get(ref.path) for ref in refs)
+            business_info, all_labels, labels_exist, image_urls = core.parse_post_inputs(
+                user_doc, manifest_doc, image_labels_doc
+            )
+            if not labels_exist or not business_info:
+                continue
+            cache_key = core.generation_cache_key(MODEL, business_info, all_labels)
+            if has_generation(post_data_doc, cache_key):
+                continue
+            if image_urls is None:
+                image_urls = core.get_image_urls(core.bucket_name, convo_id)
+            yield {
+                'convo_id': convo_id,
+                'cache_key': cache_key,
+                'image_urls': image_urls,
+                'messages': core.build_post_messages(business_info, all_labels)
+            }
+            found += 1
+            if found >= limit:
+                return
+
+def has_generation(post_data_doc, cache_key):
+    """Whether post_data holds a generation for `cache_key`, as the served post or the draft, of any age."""
+    if post_data_doc is None or not post_data_doc.exists:
+        return False
+    stored_data = post_data_doc.to_dict()
+    return any(
+        record.get('generation_key') == cache_key and record.get('raw_content')
+        for record in (stored_data, stored_data.get('draft') or {})
+    )
+
+def build_batch(work_dir, limit):
+    """Write the input files for a new batch; returns its state, or None when nothing is pending."""
+    pending = list(pending_conversations(limit))
+    if not pending:
+        return None
+    batch_id = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S') + f"-{secrets.token_hex(3)}"
+    os.makedirs(os.path.join(work_dir, batch_id))
+    write_jsonl(batch_path(work_dir, batch_id, 'input.jsonl'), (
+        {
+            'custom_id': item['convo_id'],
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {'model': MODEL, 'messages': item['messages']}
+        }
+        for item in pending
+    ))
+    write_jsonl(batch_path(work_dir, batch_id, 'inputs.jsonl'), (
+        {'convo_id': item['convo_id'], 'cache_key': item['cache_key'], 'image_urls': item['image_urls']}
+        for item in pending
+    ))
+    state = {'batch_id': batch_id, 'status': 'built', 'requests': len(pending)}
+    save_state(work_dir, state)
+    logger.info("Batch built", batch_id=batch_id, requests=len(pending))
+    return state
+
+######## Write back ########
+
+def parse_result(result):
+    """Return (convo_id, message_content, error) for one Batch API output line."""
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        error = result.get('error') or (response.get('body') or {}).get('error') or response
+        return result['custom_id'], None, error
+    body = response['body']
+    core.record_openai_usage(body.get('model', MODEL), body.get('usage'))
+    return result['custom_id'], body['choices'][0]['message']['content'], None
+
+def write_back(work_dir, state):
+    """Store the downloaded answers as post_data, BATCH_WRITE_SIZE conversations per commit."""
+    batch_id = state['batch_id']
+    inputs = {item['convo_id']: item for item in read_jsonl(batch_path(work_dir, batch_id, 'inputs.jsonl'))}
+    written_path = batch_path(work_dir, batch_id, 'written.txt')
+    written = set()
+    if os.path.exists(written_path):
+        with open(written_path) as written_file:
+            written = set(written_file.read().split())
+
+    generated_at = datetime.datetime.now(datetime.timezone.utc)
+    ready, failed = [], 0
+    results = read_jsonl(batch_path(work_dir, batch_id, 'output.jsonl')) + read_jsonl(batch_path(work_dir, batch_id, 'errors.jsonl'))
+    for result in results:
+        convo_id, message_content, error = parse_result(result)
+        if error is not None:
+            failed += 1
+            logger.warning("Batch request failed", batch_id=batch_id, convo_id=convo_id, error=str(error))
+        elif convo_id in inputs and convo_id not in written:
+            ready.append((inputs[convo_id], message_content))
+
+    with open(written_path, 'a') as written_file:
+        for start in range(0, len(ready), BATCH_WRITE_SIZE):
+            chunk = ready[start:start + BATCH_WRITE_SIZE]
+            batch = core.db.batch()
+            for item, message_content in chunk:
+                post_data = core.build_post_data(message_content, item['image_urls'])
+                post_data_ref = core.user_coll_ref.document(item['convo_id']).collection('post_data').document(item['convo_id'])
+                batch.set(post_data_ref, core.post_data_document(post_data, message_content, item['cache_key'], generated_at, 'batch'))
+            with track('firestore', 'commit'):
+                batch.commit()
+            # Only after the commit, so a crash repeats at most one (idempotent) chunk
+            written_file.write(''.join(f"{item['convo_id']}\n" for item, _ in chunk))
+            written_file.flush()
+            os.fsync(written_file.fileno())
+
+    state.update(status='done', written=len(written) + len(ready), failed=failed)
+    save_state(work_dir, state)
+    logger.info("Batch written", batch_id=batch_id, written=state['written'], failed=failed)
+
+######## Driver ########
+
+def advance(work_dir, backend, state, wait, poll_interval):
+    """Move a batch through its remaining steps; with wait=False, return once it is running remotely."""
+    batch_id = state['batch_id']
+    if state['status'] == 'built':
+        # The input file id is recorded before the batch is created, and a
+        # rerun that finds one first looks for the batch a crash may have
+        # created, so a batch is never submitted (and paid for) twice
+        remote_id = backend.find(batch_id) if state.get('input_file_id') else None
+        if remote_id is None:
+            if not state.get('input_file_id'):
+                state['input_file_id'] = backend.upload(batch_id, batch_path(work_dir, batch_id, 'input.jsonl'))
+                save_state(work_dir, state)
+            remote_id = backend.create(batch_id, state['input_file_id'])
+        state.update(status='submitted', remote_id=remote_id)
+        save_state(work_dir, state)
+        logger.info("Batch submitted", batch_id=batch_id, remote_id=remote_id)
+
+    while state['status'] == 'submitted':
+        remote_status, output_file_id, error_file_id = backend.poll(state['remote_id'])
+        if remote_status not in TERMINAL_STATUSES:
+            logger.info("Batch running", batch_id=batch_id, remote_status=remote_status)
+            if not wait:
+                return state
+            time.sleep(poll_interval)
+            continue
+        if error_file_id:
+            backend.download(error_file_id, batch_path(work_dir, batch_id, 'errors.jsonl'))
+        # Expired and cancelled batches still return what they finished
+        if output_file_id:
+            backend.download(output_file_id, batch_path(work_dir, batch_id, 'output.jsonl'))
+            state.update(status='downloaded', remote_status=remote_status)
+        else:
+            state.update(status='failed', remote_status=remote_status)
+        save_state(work_dir, state)
+
+    if state['status'] == 'downloaded':
+        write_back(work_dir, state)
+    return state
+
+def run(args):
+    backend = create_backend(args.backend, args.work_dir)
+    state = unfinished_batch(args.work_dir)
+    if state is not None:
+        logger.info("Resuming batch", batch_id=state['batch_id'], status=state['status'])
+    else:
+        os.makedirs(args.work_dir, exist_ok=True)
+        state = build_batch(args.work_dir, args.limit)
+        if state is None:
+            logger.info("No conversations waiting on a post")
+            return None
+    return advance(args.work_dir, backend, state, not args.no_wait, args.poll_interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    run_parser = subcommands.add_parser('run', help='resume the unfinished batch, or scan and submit a new one')
+    run_parser.add_argument('--backend', choices=('openai', 'local'), default='openai')
+    run_parser.add_argument('--limit', type=int, default=BATCH_MAX_REQUESTS, help='most conversations per batch')
+    run_parser.add_argument('--no-wait', action='store_true', help="don't wait for a submitted batch to finish")
+    run_parser.add_argument('--poll-interval', type=float, default=60.0, help='seconds between status checks')
+    status_parser = subcommands.add_parser('status', help='list batches and their progress')
+    for subparser in (run_parser, status_parser):
+        subparser.add_argument('--work-dir', default=BATCH_WORK_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        for state in list_batches(args.work_dir):
+            print(json.dumps(state))
+        return 0
+    state = run(args)
+    return 1 if state is not None and state['status'] == 'failed' else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
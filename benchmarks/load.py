@@ -0,0 +1,389 @@
+"""Load test: drive the Botpress flows against the app with every service faked.
+
+GCS, WordPress, OpenAI and the scraped websites (plus ip-api.com) run as
+local HTTP fakes in this process; Firestore and Vision are in-memory fakes
+installed inside each app worker. Every worker is a separate process serving
+the app from a fixed thread pool, and since each owns its own Firestore,
+virtual users are pinned to one worker. Run from the repository root:
+
+    python -m benchmarks.load
+    python -m benchmarks.load --workers 1,4 --threads 8,32 --users 32 --duration 30
+    python -m benchmarks.load --latency openai=2.0,vision=0.3 --error-rate gcs=0.02
+    python -m benchmarks.load --mode sync,async --workers 1 --threads 16 --users 200
+
+Each virtual user repeats one conversation: save the user, scrape their
+site, upload images, generate the post and publish it to WordPress.
+Throughput and p50/p95/p99 latency are reported per route and per
+(mode, workers, threads) configuration. In async mode the workers serve
+asgi.application with Hypercorn and `--threads` sizes the pool left for
+blocking GCS and Pillow calls.
+"""
+import argparse
+import collections
+import concurrent.futures
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+from fakes import gcs, openai, web, wordpress
+from fakes.faults import Faults
+
+MODES = ('sync', 'async')
+SERVICES = ('firestore', 'gcs', 'vision', 'openai', 'wordpress', 'web')
+# Rough production medians, in seconds
+DEFAULT_LATENCY = {'firestore': 0.015, 'gcs': 0.04, 'vision': 0.25, 'openai': 1.5, 'wordpress': 0.2, 'web': 0.1}
+WP_USER = 'bench'
+WP_PASSWORD = 'bench-password'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_services(spec, defaults=None):
+    """'openai=2,vision=0.3' -> {'openai': 2.0, 'vision': 0.3, ...defaults}"""
+    values = dict(defaults or dict.fromkeys(SERVICES, 0.0))
+    for item in filter(None, (spec or '').split(',')):
+        name, _, value = item.partition('=')
+        if name not in SERVICES:
+            raise argparse.ArgumentTypeError(f"unknown service {name!r}; expected one of {', '.join(SERVICES)}")
+        values[name] = float(value)
+    return values
+
+
+def parse_ints(spec):
+    return [int(value) for value in spec.split(',')]
+
+
+def parse_modes(spec):
+    modes = spec.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(f"unknown mode {mode!r}; expected one of {', '.join(MODES)}")
+    return modes
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+######## App worker ########
+
+class QuietHandler(WSGIRequestHandler):
+    # One request per connection, so a pool thread is never parked on an idle keep-alive
+    protocol_version = 'HTTP/1.0'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server that handles requests on a fixed-size thread pool."""
+    multithread = True
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietHandler)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.handle_in_pool, request, client_address)
+
+    def handle_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def run_worker(args):
+    """Serve the app with in-process Firestore and Vision fakes; print the port once ready."""
+    from fakes.firestore import AsyncFakeFirestore, FakeFirestore
+    from fakes.vision import FakeVisionAsyncClient, FakeVisionClient
+
+    latency = json.loads(args.worker_latency)
+    error_rate = json.loads(args.worker_error_rate)
+    firestore_faults = Faults(latency['firestore'], error_rate['firestore'])
+    vision_faults = Faults(latency['vision'], error_rate['vision'])
+
+    import app as service
+    firestore = FakeFirestore(firestore_faults)
+    service.clients.override('firestore', firestore)
+    service.clients.override('vision', FakeVisionClient(vision_faults))
+
+    if args.mode == 'sync':
+        server = PooledWSGIServer('127.0.0.1', 0, service.app, args.threads)
+        print(f"READY {server.server_port}", flush=True)
+        server.serve_forever()
+        return
+
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    os.environ['ASYNC_BLOCKING_WORKERS'] = str(args.threads)
+    import asgi
+    service.clients.override('firestore_async', AsyncFakeFirestore(firestore))
+    service.clients.override('vision_async', FakeVisionAsyncClient(vision_faults))
+
+    # Bind here so the port is known before Hypercorn starts accepting
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1024)
+    config = Config()
+    config.bind = [f"fd://{listener.fileno()}"]
+    config.backlog = 1024
+    config.accesslog = None
+    print(f"READY {listener.getsockname()[1]}", flush=True)
+    asyncio.run(serve(asgi.application, config))
+
+
+def start_workers(mode, count, threads, fake_urls, latency, error_rate, verbose):
+    env = {
+        **os.environ,
+        'STORAGE_EMULATOR_HOST': fake_urls['gcs'],
+        'OPENAI_BASE_URL': f"{fake_urls['openai']}/v1",
+        'OPENAI_API_KEY': 'fake-key',
+        'GEOIP_URL': f"{fake_urls['web']}/json",
+        'LABEL_QUEUE_BACKEND': 'local',
+        'USER_CACHE_LISTEN': 'false',
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'INFO' if verbose else 'CRITICAL')
+    }
+    processes = []
+    for _ in range(count):
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.load', 'worker', '--mode', mode, '--threads', str(threads),
+             '--worker-latency', json.dumps(latency), '--worker-error-rate', json.dumps(error_rate)],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL, text=True
+        ))
+    urls = []
+    for process in processes:
+        line = process.stdout.readline()
+        if not line.startswith('READY '):
+            stop_workers(processes)
+            raise RuntimeError('worker failed to start; rerun with --verbose to see why')
+        urls.append(f"http://127.0.0.1:{line.split()[1]}")
+    return processes, urls
+
+
+def stop_workers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+######## Fakes and inputs ########
+
+def serve_in_thread(wsgi_app):
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def start_fakes(latency, error_rate):
+    apps = {
+        'gcs': gcs.create_app(latency['gcs'], error_rate['gcs']),
+        'wordpress': wordpress.create_app(WP_USER, WP_PASSWORD, latency['wordpress'], error_rate['wordpress']),
+        'openai': openai.create_app(latency['openai'], error_rate['openai']),
+        'web': web.create_app(latency['web'], error_rate['web'])
+    }
+    servers, urls = {}, {}
+    for name, wsgi_app in apps.items():
+        servers[name], urls[name] = serve_in_thread(wsgi_app)
+    return servers, urls
+
+
+def make_images(count, size, seed=0):
+    """Distinct JPEGs of roughly camera-upload complexity."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.new('RGB', (size, size * 3 // 4), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(60):
+            x, y = rng.randrange(size), rng.randrange(size * 3 // 4)
+            draw.ellipse((x, y, x + rng.randrange(20, size // 4), y + rng.randrange(20, size // 4)),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        out = io.BytesIO()
+        image.save(out, 'JPEG', quality=90)
+        images.append(out.getvalue())
+    return images
+
+
+######## Load driver ########
+
+class Recorder:
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.samples = collections.defaultdict(list)  # route -> [(seconds, ok)]
+        self.flows = 0
+        self.lock = threading.Lock()
+
+    def record(self, route, started, seconds, ok):
+        if started < self.measure_from:
+            return
+        with self.lock:
+            self.samples[route].append((seconds, ok))
+
+    def flow_done(self, started):
+        if started >= self.measure_from:
+            with self.lock:
+                self.flows += 1
+
+
+def call(session, recorder, route, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=300, **kwargs)
+        response.content
+        ok = response.status_code < 400
+    except requests.RequestException:
+        response, ok = None, False
+    recorder.record(route, started, time.perf_counter() - started, ok)
+    return response
+
+
+def run_conversation(session, recorder, base_url, fake_urls, images, images_per_flow, rng):
+    convo_id = f"bench-{uuid.uuid4().hex[:12]}"
+    site = f"{fake_urls['web']}/site/{rng.choice(['rise-and-bake', 'corner-crumb', 'golden-crust'])}"
+    started = time.perf_counter()
+
+    call(session, recorder, '/Save_UserData_in_Firestore', 'POST', f"{base_url}/Save_UserData_in_Firestore", json={
+        'session': convo_id, 'person': 'Bench User', 'url': site, 'businessInfo': 'Rise and Bake'
+    })
+    call(session, recorder, '/scrape', 'POST', f"{base_url}/scrape", json={'website_url': site, 'id': convo_id})
+    for n in range(images_per_flow):
+        call(session, recorder, '/Save_Image_in_Bucket', 'POST', f"{base_url}/Save_Image_in_Bucket",
+             data={'id': convo_id}, files={'file': (f"photo{n}.jpg", rng.choice(images), 'image/jpeg')})
+    call(session, recorder, '/GetPOSTDATA', 'GET', f"{base_url}/GetPOSTDATA", params={'convo_id': convo_id})
+    call(session, recorder, '/post_to_wordpress', 'POST', f"{base_url}/post_to_wordpress",
+         params={'convo_id': convo_id},
+         json={'userName': WP_USER, 'passWord': WP_PASSWORD, 'website': fake_urls['wordpress']})
+    recorder.flow_done(started)
+
+
+def run_config(mode, workers, threads, args, fake_urls, images):
+    processes, worker_urls = start_workers(mode, workers, threads, fake_urls, args.latency, args.error_rate, args.verbose)
+    try:
+        began = time.perf_counter()
+        recorder = Recorder(began + args.warmup)
+        deadline = began + args.warmup + args.duration
+
+        def virtual_user(index):
+            rng = random.Random(index)
+            base_url = worker_urls[index % workers]
+            with requests.Session() as session:
+                while time.perf_counter() < deadline:
+                    run_conversation(session, recorder, base_url, fake_urls, images, args.images, rng)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.users) as executor:
+            list(executor.map(virtual_user, range(args.users)))
+        # Conversations still running at the deadline are counted in full
+        elapsed = max(time.perf_counter() - recorder.measure_from, 1e-9)
+    finally:
+        stop_workers(processes)
+    return summarize(mode, workers, threads, recorder, elapsed)
+
+
+def summarize(mode, workers, threads, recorder, elapsed):
+    routes = {}
+    total = 0
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = sorted(seconds for seconds, _ in samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        total += len(samples)
+        routes[route] = {
+            'requests': len(samples),
+            'errors': errors,
+            'throughput': len(samples) / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000
+        }
+    return {
+        'mode': mode,
+        'workers': workers,
+        'threads': threads,
+        'seconds': elapsed,
+        'requests': total,
+        'throughput': total / elapsed,
+        'conversations_per_second': recorder.flows / elapsed,
+        'routes': routes
+    }
+
+
+def print_report(result):
+    print(f"\nmode={result['mode']} workers={result['workers']} threads={result['threads']}: "
+          f"{result['throughput']:.1f} req/s, {result['conversations_per_second']:.2f} conversations/s "
+          f"over {result['seconds']:.1f}s")
+    print(f"  {'route':<30} {'requests':>8} {'errors':>7} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, stats in result['routes'].items():
+        print(f"  {route:<30} {stats['requests']:>8} {stats['errors']:>7} {stats['throughput']:>7.1f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command')
+    worker = subparsers.add_parser('worker', help=argparse.SUPPRESS)
+    worker.add_argument('--mode', choices=MODES, default='sync')
+    worker.add_argument('--threads', type=int, required=True)
+    worker.add_argument('--worker-latency', required=True)
+    worker.add_argument('--worker-error-rate', required=True)
+
+    parser.add_argument('--mode', type=parse_modes, default=['sync'], help='comma-separated: sync (Flask), async (asgi.py)')
+    parser.add_argument('--workers', type=parse_ints, default=[1, 2], help='comma-separated worker counts')
+    parser.add_argument('--threads', type=parse_ints, default=[8, 32], help='comma-separated threads per worker')
+    parser.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per configuration')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before each measurement')
+    parser.add_argument('--images', type=int, default=3, help='uploads per conversation (at most 5)')
+    parser.add_argument('--image-pool', type=int, default=16, help='distinct images to upload')
+    parser.add_argument('--image-size', type=int, default=1600, help='upload width in pixels')
+    parser.add_argument('--latency', type=lambda spec: parse_services(spec, DEFAULT_LATENCY), default=dict(DEFAULT_LATENCY),
+                        help='per-service latency in seconds, e.g. openai=2,firestore=0.01')
+    parser.add_argument('--error-rate', type=parse_services, default=dict.fromkeys(SERVICES, 0.0),
+                        help='per-service failure fraction, e.g. gcs=0.05')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show worker logs')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args)
+        return
+
+    servers, fake_urls = start_fakes(args.latency, args.error_rate)
+    images = make_images(args.image_pool, args.image_size)
+    print(f"latency: {args.latency}\nerror rate: {args.error_rate}")
+    results = []
+    try:
+        for mode, workers, threads in itertools.product(args.mode, args.workers, args.threads):
+            result = run_config(mode, workers, threads, args, fake_urls, images)
+            print_report(result)
+            results.append(result)
+    finally:
+        for server in servers.values():
+            server.shutdown()
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
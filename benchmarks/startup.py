@@ -0,0 +1,77 @@
+"""Cold-start benchmark: import time and time-to-first-request per route.
+
+Every route is measured in a fresh interpreter, so each number includes
+whatever client construction that route triggers on first use. Run from the
+repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --route /GetWebsiteAddress --repeat 5
+
+Point the app at local fakes (STORAGE_EMULATOR_HOST, ...) to measure without
+touching production services.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# (method, path, JSON body) for one representative request per route
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/GetWebsiteAddress?id=bench-convo', None),
+    ('POST', '/Check_Existing_User', {'userID': 'bench-convo'}),
+    ('GET', '/GetPOSTDATA?convo_id=bench-convo', None),
+    ('GET', '/GetLabelCacheStats', None),
+    ('POST', '/scrape', {'website_url': 'http://localhost:9/', 'id': 'bench-convo'}),
+]
+
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+method, path, body = json.loads(sys.argv[1])
+with app.app.test_client() as test_client:
+    response = test_client.open(path, method=method, json=body)
+    response.get_data()
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (finished - imported) * 1000,
+    "status": response.status_code,
+    "clients": app.clients.initialized()
+}))
+'''
+
+
+def measure(route):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, json.dumps(route)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{route[1]} failed:\n{result.stderr}")
+    # The app prints while handling requests; the report is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--route', help='only measure routes whose path starts with this')
+    parser.add_argument('--repeat', type=int, default=3, help='cold starts per route (median is reported)')
+    args = parser.parse_args()
+
+    routes = [route for route in ROUTES if not args.route or route[1].startswith(args.route)]
+    print(f"{'route':<45} {'import ms':>10} {'first req ms':>13} {'status':>7}  clients")
+    for route in routes:
+        runs = [measure(route) for _ in range(args.repeat)]
+        print(f"{route[0] + ' ' + route[1]:<45} "
+              f"{statistics.median(run['import_ms'] for run in runs):>10.1f} "
+              f"{statistics.median(run['first_request_ms'] for run in runs):>13.1f} "
+              f"{runs[-1]['status']:>7}  {', '.join(runs[-1]['clients']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
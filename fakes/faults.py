@@ -0,0 +1,69 @@
+"""Injected latency and failures shared by the fakes.
+
+Every fake takes a `Faults` (or the `latency`/`error_rate` pair it is built
+from) and calls it once per simulated RPC, so a load test can slow down or
+break one dependency at a time.
+"""
+import asyncio
+import random
+import threading
+import time
+
+
+class Faults:
+    """Sleep `latency` seconds (± `jitter`) per call and fail `error_rate` of calls."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def roll(self):
+        """Return (delay, failed) for one call without sleeping."""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter) if self.latency else 0.0
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self.failures += 1
+        return max(delay, 0.0), failed
+
+    def hit(self):
+        """Apply the delay and return True when this call should fail."""
+        delay, failed = self.roll()
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    async def async_hit(self):
+        """hit() for fakes called from an event loop."""
+        delay, failed = self.roll()
+        if delay:
+            await asyncio.sleep(delay)
+        return failed
+
+    def check(self):
+        """Like hit(), but raise ServiceUnavailable instead of returning True."""
+        if self.hit():
+            raise injected_error()
+
+    async def async_check(self):
+        if await self.async_hit():
+            raise injected_error()
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'failures': self.failures}
+
+
+def injected_error():
+    from google.api_core.exceptions import ServiceUnavailable
+    return ServiceUnavailable('Injected fault')
+
+
+def as_faults(faults=None, latency=0.0, error_rate=0.0):
+    return faults if faults is not None else Faults(latency, error_rate)
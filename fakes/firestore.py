@@ -0,0 +1,702 @@
+"""In-memory stand-in for the Firestore client returned by firestore.client().
+
+Covers what the app uses: nested collection and document references,
+get/set/update/create/delete (merge, dotted field paths and the Increment,
+ArrayUnion, ArrayRemove, SERVER_TIMESTAMP and DELETE_FIELD sentinels),
+get_all, write batches, transactions run through @firestore.transactional,
+last_update_time preconditions and `where` queries with stream() and
+on_snapshot(). It lives in the app's process, so install it with
+
+    app.clients.override('firestore', FakeFirestore())
+
+before the first request. AsyncFakeFirestore wraps the same store in the
+AsyncClient API for the async serving mode.
+"""
+import asyncio
+import copy
+import datetime
+import itertools
+import secrets
+import string
+import threading
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from fakes.faults import as_faults
+
+AUTO_ID_ALPHABET = string.ascii_letters + string.digits
+
+
+def split_path(field_path):
+    return field_path.split('.')
+
+
+def get_field(data, field_path):
+    value = data
+    for part in split_path(field_path):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def apply_value(data, parts, value, now):
+    """Write `value` at `parts` inside `data`, resolving transform sentinels."""
+    parent = data
+    for part in parts[:-1]:
+        if not isinstance(parent.get(part), dict):
+            parent[part] = {}
+        parent = parent[part]
+    key = parts[-1]
+    current = parent.get(key)
+
+    if value is transforms.DELETE_FIELD:
+        parent.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        parent[key] = now
+    elif isinstance(value, transforms.Increment):
+        parent[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        merged = list(current) if isinstance(current, list) else []
+        merged.extend(item for item in value.values if item not in merged)
+        parent[key] = merged
+    elif isinstance(value, transforms.ArrayRemove):
+        parent[key] = [item for item in (current or []) if item not in value.values]
+    elif isinstance(value, dict):
+        parent[key] = {}
+        for child_key, child_value in value.items():
+            apply_value(parent[key], [child_key], child_value, now)
+    else:
+        parent[key] = copy.deepcopy(value)
+
+
+def merge_value(data, key, value, now):
+    """set(..., merge=True): nested maps merge key by key instead of replacing."""
+    if isinstance(value, dict) and isinstance(data.get(key), dict):
+        for child_key, child_value in value.items():
+            merge_value(data[key], child_key, child_value, now)
+    else:
+        apply_value(data, [key], value, now)
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class WriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        return copy.deepcopy(get_field(self._data, field_path))
+
+
+class DocumentChange:
+    def __init__(self, type, document):
+        self.type = type
+        self.document = document
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<FakeDocumentReference {self.path}>"
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        self._client.faults.check()
+        return self._client._snapshot(self.path)
+
+    def set(self, document_data, merge=False, **kwargs):
+        self._client.faults.check()
+        return self._client._commit([('set', self.path, document_data, merge)])[0]
+
+    def create(self, document_data, **kwargs):
+        self._client.faults.check()
+        return self._client._commit([('create', self.path, document_data, None)])[0]
+
+    def update(self, field_updates, option=None, **kwargs):
+        self._client.faults.check()
+        return self._client._commit([('update', self.path, field_updates, option)])[0]
+
+    def delete(self, option=None, **kwargs):
+        self._client.faults.check()
+        return self._client._commit([('delete', self.path, None, option)])[0].update_time
+
+
+class Query:
+    def __init__(self, client, parent_path, collection_id, filters=(), orders=(), limit_to=None, all_descendants=False):
+        self._client = client
+        self._parent_path = parent_path
+        self._collection_id = collection_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+        self._all_descendants = all_descendants
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders,
+            'limit_to': self._limit, 'all_descendants': self._all_descendants
+        }
+        state.update(changes)
+        return Query(self._client, self._parent_path, self._collection_id, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + (FieldFilter(field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit_to=count)
+
+    def _in_scope(self, path):
+        parent, _, _ = path.rpartition('/')
+        if self._all_descendants:
+            return parent.rsplit('/', 1)[-1] == self._collection_id
+        return parent == f"{self._parent_path}{self._collection_id}"
+
+    def _matches(self, data):
+        for condition in self._filters:
+            try:
+                field = get_field(data, condition.field_path)
+            except KeyError:
+                return False
+            if not compare(field, condition.op_string, condition.value):
+                return False
+        return True
+
+    def _run(self):
+        with self._client._lock:
+            results = [
+                self._client._snapshot(path)
+                for path, document in sorted(self._client._documents.items())
+                if self._in_scope(path) and self._matches(document['data'])
+            ]
+        for field_path, direction in reversed(self._orders):
+            results.sort(key=lambda snapshot: snapshot.get(field_path),
+                         reverse=str(direction).upper().startswith('DESC'))
+        return results[:self._limit] if self._limit is not None else results
+
+    def stream(self, transaction=None, **kwargs):
+        self._client.faults.check()
+        return iter(self._run())
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        parent_path, _, collection_id = path.rpartition('/')
+        super().__init__(client, f"{parent_path}/" if parent_path else '', collection_id)
+        self.path = path
+
+    @property
+    def id(self):
+        return self._collection_id
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = ''.join(secrets.choice(AUTO_ID_ALPHABET) for _ in range(20))
+        return DocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        return reference.create(document_data).update_time, reference
+
+    def list_documents(self, **kwargs):
+        with self._client._lock:
+            return [DocumentReference(self._client, path) for path in sorted(self._client._documents) if self._in_scope(path)]
+
+
+def compare(field, op, value):
+    try:
+        if op == '==':
+            return field == value
+        if op == '!=':
+            return field != value
+        if op == '<':
+            return field < value
+        if op == '<=':
+            return field <= value
+        if op == '>':
+            return field > value
+        if op == '>=':
+            return field >= value
+        if op == 'in':
+            return field in value
+        if op == 'not-in':
+            return field not in value
+        if op == 'array_contains':
+            return isinstance(field, list) and value in field
+        if op == 'array_contains_any':
+            return isinstance(field, list) and any(item in field for item in value)
+    except TypeError:
+        # Firestore never matches values of different types
+        return False
+    raise ValueError(f"Unsupported operator {op}")
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference.path, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference.path, document_data, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference.path, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference.path, None, option))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self, **kwargs):
+        self._client.faults.check()
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    """Implements the private hooks @firestore.transactional drives.
+
+    A transaction holds the client lock from _begin to _commit/_rollback, so
+    transactions are serialized instead of retried on contention.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._held = False
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client.faults.check()
+        self._client._lock.acquire()
+        self._held = True
+        self._id = next(self._ids)
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._client._lock.release()
+
+    def _commit(self):
+        try:
+            writes, self._writes = self._writes, []
+            return self._client._commit(writes)
+        finally:
+            self._clean_up()
+            self._release()
+
+    def _rollback(self):
+        self._clean_up()
+        self._release()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references, transaction=self)
+
+
+class Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self.query = query
+        self.callback = callback
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+
+class FakeFirestore:
+    """Thread-safe in-memory Firestore with optional injected faults."""
+
+    def __init__(self, faults=None, latency=0.0, error_rate=0.0):
+        self.faults = as_faults(faults, latency, error_rate)
+        self._documents = {}  # path -> {"data", "create_time", "update_time"}
+        self._watches = []
+        self._lock = threading.RLock()
+        self._last_time = datetime.datetime.fromtimestamp(0, datetime.timezone.utc)
+
+    def collection(self, *path):
+        return CollectionReference(self, '/'.join(path))
+
+    def collection_group(self, collection_id):
+        return Query(self, '', collection_id, all_descendants=True)
+
+    def document(self, *path):
+        return DocumentReference(self, '/'.join(path))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts, read_only)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return WriteOption(last_update_time, exists)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        self.faults.check()
+        with self._lock:
+            snapshots = [self._snapshot(reference.path) for reference in dict.fromkeys(references)]
+        return iter(snapshots)
+
+    def close(self):
+        pass
+
+    def _now(self):
+        # Strictly increasing, so update_time works as a precondition
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if now <= self._last_time:
+            now = self._last_time + datetime.timedelta(microseconds=1)
+        self._last_time = now
+        return now
+
+    def _snapshot(self, path):
+        with self._lock:
+            document = self._documents.get(path)
+            read_time = datetime.datetime.now(datetime.timezone.utc)
+            if document is None:
+                return DocumentSnapshot(DocumentReference(self, path), None, read_time=read_time)
+            return DocumentSnapshot(DocumentReference(self, path), copy.deepcopy(document['data']),
+                                    document['create_time'], document['update_time'], read_time)
+
+    def _commit(self, writes):
+        """Apply `writes` atomically and notify any matching listeners."""
+        with self._lock:
+            now = self._now()
+            staged = {}
+            for kind, path, data, option in writes:
+                existing = staged[path] if path in staged else self._documents.get(path)
+                staged[path] = self._apply(kind, path, existing, data, option, now)
+            changed = []
+            for path, document in staged.items():
+                previous = self._documents.get(path)
+                if document is None:
+                    if self._documents.pop(path, None) is not None:
+                        changed.append(('REMOVED', path, previous))
+                else:
+                    self._documents[path] = document
+                    changed.append(('ADDED' if previous is None else 'MODIFIED', path, document))
+            notifications = self._pending_notifications(changed, now)
+        for watch, docs, changes in notifications:
+            watch.callback(docs, changes, now)
+        return [WriteResult(now) for _ in writes]
+
+    def _apply(self, kind, path, existing, data, option, now):
+        if isinstance(option, WriteOption):
+            if option.last_update_time is not None and (existing is None or existing['update_time'] != option.last_update_time):
+                raise FailedPrecondition(f"{path} was updated since it was read")
+            if option.exists is not None and (existing is not None) != option.exists:
+                raise FailedPrecondition(f"{path} existence precondition failed")
+        if kind == 'delete':
+            return None
+        if kind == 'create' and existing is not None:
+            raise AlreadyExists(f"Document already exists: {path}")
+        if kind == 'update' and existing is None:
+            raise NotFound(f"No document to update: {path}")
+
+        document = {
+            'data': copy.deepcopy(existing['data']) if existing and (kind == 'update' or option) else {},
+            'create_time': existing['create_time'] if existing else now,
+            'update_time': now
+        }
+        for key, value in data.items():
+            if kind == 'update':
+                apply_value(document['data'], split_path(key), value, now)
+            elif kind == 'set' and option:
+                merge_value(document['data'], key, value, now)
+            else:
+                apply_value(document['data'], [key], value, now)
+        return document
+
+    def _watch(self, query, callback):
+        watch = Watch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+            initial = query._run()
+        callback(initial, [DocumentChange('ADDED', snapshot) for snapshot in initial], self._last_time)
+        return watch
+
+    def _pending_notifications(self, changed, now):
+        notifications = []
+        for watch in self._watches:
+            changes = []
+            for change_type, path, document in changed:
+                if not watch.query._in_scope(path):
+                    continue
+                if change_type != 'REMOVED' and not watch.query._matches(document['data']):
+                    continue
+                changes.append(DocumentChange(change_type, self._snapshot(path)))
+            if changes:
+                notifications.append((watch, watch.query._run(), changes))
+        return notifications
+
+
+######## Async facade ########
+# Same store, exposed with the firestore AsyncClient API for asgi.py
+
+class AsyncDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self._sync = DocumentReference(client._sync, path)
+
+    @property
+    def path(self):
+        return self._sync.path
+
+    @property
+    def id(self):
+        return self._sync.id
+
+    @property
+    def parent(self):
+        return AsyncCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, AsyncDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, name):
+        return AsyncCollectionReference(self._client, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None, transaction=None, **kwargs):
+        await self._client.faults.async_check()
+        return self._client._sync._snapshot(self.path)
+
+    async def _write(self, kind, data, option):
+        await self._client.faults.async_check()
+        return self._client._sync._commit([(kind, self.path, data, option)])[0]
+
+    async def set(self, document_data, merge=False, **kwargs):
+        return await self._write('set', document_data, merge)
+
+    async def create(self, document_data, **kwargs):
+        return await self._write('create', document_data, None)
+
+    async def update(self, field_updates, option=None, **kwargs):
+        return await self._write('update', field_updates, option)
+
+    async def delete(self, option=None, **kwargs):
+        return (await self._write('delete', None, option)).update_time
+
+
+class AsyncQuery:
+    def __init__(self, client, query):
+        self._client = client
+        self._query = query
+
+    def where(self, *args, **kwargs):
+        return AsyncQuery(self._client, self._query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return AsyncQuery(self._client, self._query.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return AsyncQuery(self._client, self._query.limit(count))
+
+    async def stream(self, transaction=None, **kwargs):
+        await self._client.faults.async_check()
+        for snapshot in self._query._run():
+            yield snapshot
+
+    async def get(self, transaction=None, **kwargs):
+        return [snapshot async for snapshot in self.stream(transaction)]
+
+
+class AsyncCollectionReference(AsyncQuery):
+    def __init__(self, client, path):
+        super().__init__(client, CollectionReference(client._sync, path))
+        self.path = path
+
+    @property
+    def id(self):
+        return self._query.id
+
+    def document(self, document_id=None):
+        return AsyncDocumentReference(self._client, self._query.document(document_id).path)
+
+    async def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        return (await reference.create(document_data)).update_time, reference
+
+
+class AsyncWriteBatch(WriteBatch):
+    async def commit(self, **kwargs):
+        await self._client.faults.async_check()
+        writes, self._writes = self._writes, []
+        return self._client._sync._commit(writes)
+
+
+class AsyncTransaction(AsyncWriteBatch):
+    """Implements the hooks @firestore.async_transactional drives.
+
+    Transactions hold an asyncio lock from _begin to _commit/_rollback, so
+    they are serialized instead of retried on contention.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._held = False
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    async def _begin(self, retry_id=None):
+        await self._client.faults.async_check()
+        await self._client._transaction_lock().acquire()
+        self._held = True
+        self._id = next(Transaction._ids)
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._client._transaction_lock().release()
+
+    async def _commit(self):
+        try:
+            writes, self._writes = self._writes, []
+            return self._client._sync._commit(writes)
+        finally:
+            self._clean_up()
+            self._release()
+
+    async def _rollback(self):
+        self._clean_up()
+        self._release()
+
+    async def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, AsyncDocumentReference):
+            return await ref_or_query.get(transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+
+class AsyncFakeFirestore:
+    """firestore AsyncClient over a FakeFirestore, sharing its documents.
+
+    Pass the sync fake to see the same data from both APIs:
+
+        app.clients.override('firestore_async', AsyncFakeFirestore(fake))
+    """
+
+    def __init__(self, sync=None, faults=None):
+        self._sync = sync if sync is not None else FakeFirestore(faults)
+        self.faults = faults if faults is not None else self._sync.faults
+        self._lock = None
+
+    def _transaction_lock(self):
+        # Created lazily so it binds to the serving event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def collection(self, *path):
+        return AsyncCollectionReference(self, '/'.join(path))
+
+    def collection_group(self, collection_id):
+        return AsyncQuery(self, self._sync.collection_group(collection_id))
+
+    def document(self, *path):
+        return AsyncDocumentReference(self, '/'.join(path))
+
+    def batch(self):
+        return AsyncWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return AsyncTransaction(self, max_attempts, read_only)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return WriteOption(last_update_time, exists)
+
+    async def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        await self.faults.async_check()
+        for reference in dict.fromkeys(references):
+            yield self._sync._snapshot(reference.path)
+
+    def close(self):
+        pass
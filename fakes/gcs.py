@@ -0,0 +1,189 @@
+"""Minimal in-memory Google Cloud Storage JSON API for local runs.
+
+Covers what google-cloud-storage needs for this app: multipart and
+resumable uploads, object metadata get/patch/delete, listing by prefix and
+media downloads. Start it with
+
+    python -m fakes.gcs --port 4443
+
+and run the app with STORAGE_EMULATOR_HOST=http://localhost:4443.
+"""
+import argparse
+import base64
+import datetime
+import hashlib
+import itertools
+import json
+import secrets
+import threading
+
+import google_crc32c
+from flask import Flask, Response, abort, jsonify, request
+
+from fakes.faults import Faults
+
+
+def parse_multipart_related(body, content_type):
+    """Split a multipart/related upload into (metadata, media bytes)."""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode('ascii')
+    parts = []
+    for part in body.split(b'--' + boundary)[1:]:
+        if part.startswith(b'--'):
+            break
+        headers, _, payload = part.lstrip(b'\r\n').partition(b'\r\n\r\n')
+        parts.append((headers.decode('latin-1').lower(), payload[:-2] if payload.endswith(b'\r\n') else payload))
+    metadata = json.loads(parts[0][1] or b'{}')
+    media_headers, media = parts[1]
+    for line in media_headers.splitlines():
+        if line.startswith('content-type:') and 'contentType' not in metadata:
+            metadata['contentType'] = line.split(':', 1)[1].strip()
+    return metadata, media
+
+
+def create_app(latency=0.0, error_rate=0.0):
+    app = Flask(__name__)
+    faults = Faults(latency, error_rate)
+    lock = threading.Lock()
+    generations = itertools.count(1)
+    objects = {}   # (bucket, name) -> {"resource": dict, "data": bytes}
+    sessions = {}  # upload_id -> {"bucket", "metadata", "data": bytearray}
+
+    def delay():
+        if faults.hit():
+            abort(Response('{"error": {"code": 503, "message": "Injected fault"}}', 503, mimetype='application/json'))
+
+    def store(bucket, metadata, data):
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat().replace('+00:00', 'Z')
+        name = metadata['name']
+        data = bytes(data)
+        resource = {
+            "kind": "storage#object",
+            "id": f"{bucket}/{name}",
+            "name": name,
+            "bucket": bucket,
+            "generation": str(next(generations)),
+            "metageneration": "1",
+            "contentType": metadata.get('contentType', 'application/octet-stream'),
+            "size": str(len(data)),
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode('ascii'),
+            "crc32c": base64.b64encode(google_crc32c.Checksum(data).digest()).decode('ascii'),
+            "metadata": metadata.get('metadata') or {},
+            "timeCreated": now,
+            "updated": now,
+            "mediaLink": f"{request.host_url}download/storage/v1/b/{bucket}/o/{name}?alt=media"
+        }
+        with lock:
+            objects[(bucket, name)] = {"resource": resource, "data": data}
+        return resource
+
+    def not_found():
+        return jsonify({"error": {"code": 404, "message": "No such object."}}), 404
+
+    @app.route('/upload/storage/v1/b/<bucket>/o', methods=['POST'])
+    def upload(bucket):
+        delay()
+        upload_type = request.args.get('uploadType')
+        if upload_type == 'multipart':
+            metadata, media = parse_multipart_related(request.get_data(), request.headers['Content-Type'])
+            metadata.setdefault('name', request.args.get('name'))
+            return jsonify(store(bucket, metadata, media))
+        if upload_type == 'media':
+            metadata = {'name': request.args['name'], 'contentType': request.content_type}
+            return jsonify(store(bucket, metadata, request.get_data()))
+        if upload_type == 'resumable':
+            metadata = request.get_json(silent=True) or {}
+            metadata.setdefault('name', request.args.get('name'))
+            if 'X-Upload-Content-Type' in request.headers:
+                metadata.setdefault('contentType', request.headers['X-Upload-Content-Type'])
+            upload_id = secrets.token_hex(8)
+            with lock:
+                sessions[upload_id] = {"bucket": bucket, "metadata": metadata, "data": bytearray()}
+            location = f"{request.host_url}upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            return Response(status=200, headers={'Location': location})
+        return jsonify({"error": {"code": 400, "message": f"Unsupported uploadType {upload_type}"}}), 400
+
+    @app.route('/upload/storage/v1/b/<bucket>/o', methods=['PUT'])
+    def upload_chunk(bucket):
+        delay()
+        session = sessions.get(request.args.get('upload_id'))
+        if session is None:
+            return jsonify({"error": {"code": 404, "message": "No such upload."}}), 404
+        # Content-Range: "bytes 0-262143/*", "bytes 262144-300000/300001" or "bytes */300001"
+        content_range = request.headers.get('Content-Range', 'bytes */*')[len('bytes '):]
+        span, _, total = content_range.partition('/')
+        chunk = request.get_data()
+        if span != '*':
+            start = int(span.split('-')[0])
+            if start != len(session['data']):
+                return jsonify({"error": {"code": 400, "message": "Non-contiguous chunk"}}), 400
+            session['data'].extend(chunk)
+        if total != '*' and int(total) == len(session['data']):
+            with lock:
+                sessions.pop(request.args['upload_id'], None)
+            return jsonify(store(session['bucket'], session['metadata'], session['data']))
+        headers = {'Range': f"bytes=0-{len(session['data']) - 1}"} if session['data'] else {}
+        return Response(status=308, headers=headers)
+
+    @app.route('/storage/v1/b/<bucket>/o', methods=['GET'])
+    def list_objects(bucket):
+        delay()
+        prefix = request.args.get('prefix', '')
+        items = [
+            entry["resource"] for (entry_bucket, name), entry in sorted(objects.items())
+            if entry_bucket == bucket and name.startswith(prefix)
+        ]
+        return jsonify({"kind": "storage#objects", "items": items})
+
+    @app.route('/storage/v1/b/<bucket>/o/<path:name>', methods=['GET'])
+    def get_object(bucket, name):
+        delay()
+        entry = objects.get((bucket, name))
+        if entry is None:
+            return not_found()
+        if request.args.get('alt') == 'media':
+            return Response(entry["data"], mimetype=entry["resource"]["contentType"])
+        return jsonify(entry["resource"])
+
+    @app.route('/download/storage/v1/b/<bucket>/o/<path:name>', methods=['GET'])
+    def download_object(bucket, name):
+        delay()
+        entry = objects.get((bucket, name))
+        if entry is None:
+            return not_found()
+        return Response(entry["data"], mimetype=entry["resource"]["contentType"])
+
+    @app.route('/storage/v1/b/<bucket>/o/<path:name>', methods=['PATCH'])
+    def patch_object(bucket, name):
+        delay()
+        entry = objects.get((bucket, name))
+        if entry is None:
+            return not_found()
+        changes = request.get_json(silent=True) or {}
+        with lock:
+            resource = entry["resource"]
+            if 'metadata' in changes:
+                resource["metadata"] = {**resource.get("metadata", {}), **(changes["metadata"] or {})}
+            if 'contentType' in changes:
+                resource["contentType"] = changes["contentType"]
+            resource["metageneration"] = str(int(resource["metageneration"]) + 1)
+        return jsonify(resource)
+
+    @app.route('/storage/v1/b/<bucket>/o/<path:name>', methods=['DELETE'])
+    def delete_object(bucket, name):
+        delay()
+        with lock:
+            if objects.pop((bucket, name), None) is None:
+                return not_found()
+        return Response(status=204)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4443)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+    create_app(args.latency, args.error_rate).run(host=args.host, port=args.port, threaded=True)
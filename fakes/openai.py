@@ -0,0 +1,130 @@
+"""Minimal OpenAI chat completions API for local runs.
+
+Serves POST /v1/chat/completions for both the SDK and the app's direct REST
+calls: plain completions, `response_format={"type": "json_object"}` and
+`stream=True` (with the trailing usage chunk when `include_usage` is set).
+Generated posts keep the headline / body / hashtags layout the app parses.
+Start it with
+
+    python -m fakes.openai --port 8082
+
+and run the app with OPENAI_BASE_URL=http://localhost:8082/v1.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import re
+import time
+
+from flask import Flask, Response, jsonify, request
+
+from fakes.faults import Faults
+
+
+def words(text):
+    return len(text.split())
+
+
+def generate_post(prompt):
+    business = re.search(r'post for (.+?)\. ', prompt)
+    topics = re.search(r'following topics: (.*?)\. Make', prompt, re.DOTALL)
+    business = business.group(1) if business else 'our business'
+    topics = [topic.strip() for topic in (topics.group(1) if topics else '').split(',') if topic.strip()] or ['what we do']
+    tags = ' '.join('#' + re.sub(r'\W+', '', topic.title()) for topic in topics[:5])
+    return (
+        f"✨ {business}: what's new in {topics[0]} ✨\n\n"
+        f"Trends move fast, and {business} moves with them. This season we're seeing a lot of interest in "
+        f"{', '.join(topics[:4])}, and we've put together something special for you. "
+        f"Stop by, say hi and see it for yourself!\n\n"
+        f"Contact us for more information today.\n\n"
+        f"{tags}"
+    )
+
+
+def generate_summary(prompt):
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return json.dumps({
+        "niche": "Local business",
+        "seo_keywords": ["local", "services", digest[:6]],
+        "pricing": {"basic": "$19", "premium": "$49"},
+        "bio": "Family-run since 2009.",
+        "reviews": {"average_rating": "4.7", "top_review": "Great service!"},
+        "additional_insights": {"awards": ["Best of Town 2023"], "notable_blog_post": "Our story"}
+    })
+
+
+def create_app(latency=0.0, error_rate=0.0, token_latency=0.0):
+    """Build the fake server; `token_latency` paces streamed chunks."""
+    app = Flask(__name__)
+    faults = Faults(latency, error_rate)
+    ids = itertools.count(1)
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        if faults.hit():
+            return jsonify({"error": {"message": "Injected fault", "type": "server_error"}}), 503
+        body = request.get_json(force=True)
+        model = body.get('model', 'gpt-4o')
+        prompt = '\n'.join(str(message.get('content', '')) for message in body.get('messages', []))
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            text = generate_summary(prompt)
+        else:
+            text = generate_post(prompt)
+        completion_id = f"chatcmpl-fake{next(ids)}"
+        created = int(time.time())
+        usage = {"prompt_tokens": words(prompt), "completion_tokens": words(text),
+                 "total_tokens": words(prompt) + words(text)}
+
+        if not body.get('stream'):
+            return jsonify({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+        include_usage = (body.get('stream_options') or {}).get('include_usage')
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                "usage": chunk_usage
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        def events():
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in re.findall(r'\S+\s*|\s+', text):
+                if token_latency:
+                    time.sleep(token_latency)
+                yield chunk({"content": piece})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return Response(events(), mimetype='text/event-stream')
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='seconds between streamed chunks')
+    args = parser.parse_args()
+    create_app(args.latency, args.error_rate, args.token_latency).run(host=args.host, port=args.port, threaded=True)
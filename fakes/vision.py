@@ -0,0 +1,67 @@
+"""In-memory stand-in for vision.ImageAnnotatorClient.
+
+Implements label_detection() and batch_annotate_images() with labels drawn
+deterministically from the image bytes, so identical uploads always get the
+same labels. Install it in the app's process with
+
+    app.clients.override('vision', FakeVisionClient())
+
+FakeVisionAsyncClient stands in for vision.ImageAnnotatorAsyncClient.
+"""
+import hashlib
+from types import SimpleNamespace
+
+from fakes.faults import as_faults
+
+LABELS = (
+    'Food', 'Tableware', 'Recipe', 'Ingredient', 'Cuisine', 'Dish', 'Coffee', 'Drink', 'Building',
+    'Interior design', 'Furniture', 'Plant', 'Flower', 'Sky', 'Tree', 'Car', 'Vehicle', 'Wheel',
+    'Clothing', 'Fashion', 'Shoe', 'Smile', 'Event', 'Fun', 'Leisure', 'Art', 'Font', 'Logo',
+    'Dog', 'Cat', 'Pet', 'Water', 'Beach', 'Sports equipment', 'Tool', 'Wood', 'Rectangle'
+)
+LABELS_PER_IMAGE = 8
+
+
+def image_content(image):
+    if isinstance(image, dict):
+        return image.get('content', b'')
+    return image.content
+
+
+def annotate(content):
+    digest = hashlib.sha256(content).digest()
+    picked = []
+    for byte in digest:
+        label = LABELS[byte % len(LABELS)]
+        if label not in picked:
+            picked.append(label)
+        if len(picked) == LABELS_PER_IMAGE:
+            break
+    return SimpleNamespace(
+        label_annotations=[
+            SimpleNamespace(description=label, score=round(0.99 - rank * 0.04, 2), mid=f"/m/fake{rank}")
+            for rank, label in enumerate(picked)
+        ],
+        error=SimpleNamespace(code=0, message='')
+    )
+
+
+class FakeVisionClient:
+    def __init__(self, faults=None, latency=0.0, error_rate=0.0):
+        self.faults = as_faults(faults, latency, error_rate)
+
+    def label_detection(self, image=None, **kwargs):
+        self.faults.check()
+        return annotate(image_content(image))
+
+    def batch_annotate_images(self, requests=None, **kwargs):
+        self.faults.check()
+        images = [request['image'] if isinstance(request, dict) else request.image for request in requests]
+        return SimpleNamespace(responses=[annotate(image_content(image)) for image in images])
+
+
+class FakeVisionAsyncClient(FakeVisionClient):
+    async def batch_annotate_images(self, requests=None, **kwargs):
+        await self.faults.async_check()
+        images = [request['image'] if isinstance(request, dict) else request.image for request in requests]
+        return SimpleNamespace(responses=[annotate(image_content(image)) for image in images])
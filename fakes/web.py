@@ -0,0 +1,75 @@
+"""Fake public web for the scraper: business homepages and ip-api.com.
+
+GET /site/<name> returns a small homepage whose <head> carries the title,
+meta tags and JSON-LD the scraper looks for, followed by a body large
+enough that stopping at </head> matters. GET /json/<ip> answers like
+ip-api.com. Start it with
+
+    python -m fakes.web --port 8083
+
+and run the app with GEOIP_URL=http://localhost:8083/json.
+"""
+import argparse
+import json
+
+from flask import Flask, Response, jsonify
+
+from fakes.faults import Faults
+
+BODY_FILLER = '<p>' + 'Fresh bread, coffee and pastries every morning. ' * 40 + '</p>\n'
+
+
+def homepage(name):
+    title = name.replace('-', ' ').title()
+    jsonld = {
+        "@context": "https://schema.org",
+        "@type": "Bakery",
+        "name": title,
+        "description": f"{title} is a neighbourhood bakery and coffee shop.",
+        "telephone": "+1 555 0100",
+        "priceRange": "$$",
+        "address": {"@type": "PostalAddress", "addressLocality": "Springfield", "postalCode": "12345"},
+        "aggregateRating": {"@type": "AggregateRating", "ratingValue": "4.7", "reviewCount": "212"}
+    }
+    return (
+        "<!doctype html><html><head>"
+        f"<title>{title} | Bakery &amp; Coffee</title>"
+        f'<meta name="description" content="{title} bakes sourdough, croissants and cakes daily.">'
+        '<meta name="keywords" content="bakery, coffee, sourdough, cakes">'
+        f'<meta property="og:title" content="{title}">'
+        '<link rel="stylesheet" href="/static/site.css">'
+        f'<script type="application/ld+json">{json.dumps(jsonld)}</script>'
+        "</head><body>\n" + BODY_FILLER * 25 + "</body></html>"
+    )
+
+
+def create_app(latency=0.0, error_rate=0.0):
+    app = Flask(__name__)
+    faults = Faults(latency, error_rate)
+
+    @app.route('/site/<name>', methods=['GET'])
+    def site(name):
+        if faults.hit():
+            return Response('Service Unavailable', 503)
+        return Response(homepage(name), mimetype='text/html')
+
+    @app.route('/json/<ip>', methods=['GET'])
+    def geolocate(ip):
+        if faults.hit():
+            return Response('Service Unavailable', 503)
+        return jsonify({
+            "status": "success", "query": ip, "country": "United States", "countryCode": "US",
+            "city": "Springfield", "zip": "12345", "lat": 39.78, "lon": -89.65
+        })
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8083)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+    create_app(args.latency, args.error_rate).run(host=args.host, port=args.port, threaded=True)
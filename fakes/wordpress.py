@@ -0,0 +1,109 @@
+"""Minimal in-memory WordPress REST API for local runs.
+
+Implements the parts of /wp-json/wp/v2 the app uses: media uploads, post
+creation and reading both back. Start it with
+
+    python -m fakes.wordpress --port 8081 --user dev --password secret
+
+and point /post_to_wordpress at http://localhost:8081.
+"""
+import argparse
+import itertools
+import re
+import threading
+
+from flask import Flask, Response, abort, jsonify, request
+
+from fakes.faults import Faults
+
+
+def create_app(username=None, password=None, latency=0.0, error_rate=0.0):
+    """Build the fake server; when `username` is set, Basic auth is enforced."""
+    app = Flask(__name__)
+    faults = Faults(latency, error_rate)
+    ids = itertools.count(1)
+    lock = threading.Lock()
+    media = {}
+    posts = {}
+
+    def check_auth():
+        if faults.hit():
+            abort(Response('{"code": "internal_server_error"}', 503, mimetype='application/json'))
+        if username is None:
+            return
+        auth = request.authorization
+        if not auth or auth.username != username or auth.password != password:
+            abort(Response('{"code": "rest_not_logged_in"}', 401, mimetype='application/json'))
+
+    @app.route('/wp-json/wp/v2/media', methods=['POST'])
+    def create_media():
+        check_auth()
+        disposition = request.headers.get('Content-Disposition', '')
+        match = re.search(r'filename="?([^";]+)"?', disposition)
+        if not match or not request.data:
+            return jsonify({"code": "rest_upload_no_data"}), 400
+        with lock:
+            media_id = next(ids)
+            item = {
+                "id": media_id,
+                "media_type": "image",
+                "mime_type": request.content_type,
+                "source_url": f"{request.host_url}wp-content/uploads/{media_id}/{match.group(1)}",
+                "data": request.data
+            }
+            media[media_id] = item
+        return jsonify({key: value for key, value in item.items() if key != "data"}), 201
+
+    @app.route('/wp-content/uploads/<int:media_id>/<path:file_name>', methods=['GET'])
+    def get_upload(media_id, file_name):
+        item = media.get(media_id)
+        if item is None:
+            abort(404)
+        return Response(item["data"], mimetype=item["mime_type"])
+
+    @app.route('/wp-json/wp/v2/posts', methods=['POST'])
+    def create_post():
+        check_auth()
+        data = request.get_json(silent=True) or {}
+        if not data.get('title') and not data.get('content'):
+            return jsonify({"code": "empty_content"}), 400
+        featured_media = data.get('featured_media', 0)
+        if featured_media and featured_media not in media:
+            return jsonify({"code": "rest_invalid_featured_media"}), 400
+        with lock:
+            post_id = next(ids)
+            post = {
+                "id": post_id,
+                "status": data.get('status', 'draft'),
+                "title": {"rendered": data.get('title', '')},
+                "content": {"rendered": data.get('content', '')},
+                "featured_media": featured_media,
+                "link": f"{request.host_url}?p={post_id}"
+            }
+            posts[post_id] = post
+        return jsonify(post), 201
+
+    @app.route('/wp-json/wp/v2/posts', methods=['GET'])
+    def list_posts():
+        return jsonify(list(posts.values()))
+
+    @app.route('/wp-json/wp/v2/posts/<int:post_id>', methods=['GET'])
+    def get_post(post_id):
+        post = posts.get(post_id)
+        if post is None:
+            return jsonify({"code": "rest_post_invalid_id"}), 404
+        return jsonify(post)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every write')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of writes answered with 503')
+    args = parser.parse_args()
+    create_app(args.user, args.password, args.latency, args.error_rate).run(host=args.host, port=args.port, threaded=True)
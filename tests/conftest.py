@@ -0,0 +1,141 @@
+"""Fixtures that run the app against the fakes.
+
+The GCS, WordPress, OpenAI and web fakes are served on local ports for the
+whole session; their URLs go into the environment before app.py is
+imported, since it reads them at import time. Every test gets a fresh
+FakeFirestore and FakeVisionClient and empty in-process caches.
+
+    python -m pytest -q
+"""
+import asyncio
+import io
+import itertools
+import os
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from fakes import gcs, openai, web, wordpress
+
+WP_USER = 'tester'
+WP_PASSWORD = 'tester-password'
+COLLECTIONS = ('users', 'label_cache', 'label_jobs', 'publish_jobs', 'summary_cache')
+
+fake_servers = {}
+fake_urls = {}
+image_seeds = itertools.count(1)
+
+
+def serve_in_thread(wsgi_app):
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def pytest_configure(config):
+    apps = {
+        'gcs': gcs.create_app(),
+        'wordpress': wordpress.create_app(WP_USER, WP_PASSWORD),
+        'openai': openai.create_app(),
+        'web': web.create_app()
+    }
+    for name, wsgi_app in apps.items():
+        fake_servers[name], fake_urls[name] = serve_in_thread(wsgi_app)
+    os.environ.update(
+        STORAGE_EMULATOR_HOST=fake_urls['gcs'],
+        OPENAI_BASE_URL=f"{fake_urls['openai']}/v1",
+        OPENAI_API_KEY='test',
+        GEOIP_URL=f"{fake_urls['web']}/json",
+        DRAFT_GENERATION='false',
+        LOG_LEVEL='CRITICAL'
+    )
+
+
+def pytest_unconfigure(config):
+    for server in fake_servers.values():
+        server.shutdown()
+
+
+@pytest.fixture
+def core():
+    import app
+    return app
+
+
+@pytest.fixture(autouse=True)
+def firestore(core):
+    from fakes.firestore import AsyncFakeFirestore, FakeFirestore
+
+    fs = FakeFirestore()
+    core.clients.override('firestore', fs)
+    core.clients.override('firestore_async', AsyncFakeFirestore(fs))
+    for name in COLLECTIONS:
+        core.clients.override(f'collection:{name}', fs.collection(name))
+    for cache in (core.label_cache, core.generation_cache, core.summary_cache, core.user_profile_cache):
+        cache.clear()
+    return fs
+
+
+@pytest.fixture(autouse=True)
+def vision(core):
+    from fakes.vision import FakeVisionAsyncClient, FakeVisionClient
+
+    vision_client = FakeVisionClient()
+    core.clients.override('vision', vision_client)
+    core.clients.override('vision_async', FakeVisionAsyncClient(faults=vision_client.faults))
+    return vision_client
+
+
+@pytest.fixture
+def client(core):
+    return core.app.test_client()
+
+
+@pytest.fixture(scope='session')
+def loop():
+    """One event loop for every async test, since the async clients bind to the loop they first run on."""
+    event_loop = asyncio.new_event_loop()
+    yield event_loop
+    event_loop.close()
+
+
+@pytest.fixture
+def asgi_client(loop):
+    import httpx
+
+    import asgi
+
+    async_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi.application), base_url='http://test')
+    yield async_client
+    loop.run_until_complete(async_client.aclose())
+
+
+@pytest.fixture
+def wordpress_url():
+    return fake_urls['wordpress']
+
+
+@pytest.fixture
+def web_url():
+    return fake_urls['web']
+
+
+def make_image(size=64):
+    """A small JPEG that no other call returns, so label caches never hide a Vision call."""
+    from PIL import Image
+
+    seed = next(image_seeds)
+    out = io.BytesIO()
+    Image.new('RGB', (size, size), (seed % 256, seed // 256 % 256, seed // 65536 % 256)).save(out, 'JPEG')
+    return out.getvalue()
+
+
+def add_conversation(core, convo_id, business_info='Rise and Bake', labels=('Bread', 'Coffee')):
+    """A conversation with business info and one labeled image in the bucket, as an upload leaves it."""
+    blob_name = f"{convo_id}/a.jpg"
+    core.storage_client.bucket(core.bucket_name).blob(blob_name).upload_from_string(make_image(), content_type='image/jpeg')
+    core.user_coll_ref.document(convo_id).set({'businessInfo': business_info, 'website': 'https://example.com'})
+    urls = {'original': core.public_url(blob_name)}
+    core.save_image_labels(convo_id, {1: list(labels)}, {'a.jpg': core.manifest_image(1, urls)})
+    return urls['original']
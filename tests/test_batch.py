@@ -0,0 +1,154 @@
+import datetime
+import os
+
+import pytest
+
+from conftest import add_conversation
+
+
+@pytest.fixture
+def batch(core):
+    import batch
+    return batch
+
+
+def run(batch, work_dir, *args):
+    return batch.main(['run', '--backend', 'local', '--work-dir', str(work_dir), *args])
+
+
+def post_data(firestore, convo_id):
+    return firestore.document('users', convo_id, 'post_data', convo_id).get()
+
+
+def test_batch_stores_posts_get_post_data_serves(core, batch, client, firestore, tmp_path):
+    for convo_id in ('c1', 'c2', 'c3'):
+        add_conversation(core, convo_id, business_info=f'Shop {convo_id}')
+    # Business info but no labels: nothing to generate
+    core.user_coll_ref.document('c4').set({'businessInfo': 'Shop c4'})
+
+    assert run(batch, tmp_path) == 0
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'done'
+    assert state['written'] == 3
+
+    stored = post_data(firestore, 'c1').to_dict()
+    core.generation_cache.clear()
+    assert client.get('/GetPOSTDATA?convo_id=c1').get_json()['content'] == stored['content']
+    # Already answered conversations are not batched again
+    assert run(batch, tmp_path) == 0
+    assert len(batch.list_batches(str(tmp_path))) == 1
+
+
+def test_batch_resumes_write_back_after_a_crash(core, batch, firestore, tmp_path, monkeypatch):
+    for convo_id in ('c1', 'c2', 'c3'):
+        add_conversation(core, convo_id, business_info=f'Shop {convo_id}')
+    monkeypatch.setattr(batch, 'BATCH_WRITE_SIZE', 1)
+
+    build_post_data = core.build_post_data
+    built = []
+
+    def crash_on_second_post(*args):
+        built.append(1)
+        if len(built) == 2:
+            raise RuntimeError('worker killed')
+        return build_post_data(*args)
+
+    monkeypatch.setattr(core, 'build_post_data', crash_on_second_post)
+    with pytest.raises(RuntimeError):
+        run(batch, tmp_path)
+    monkeypatch.setattr(core, 'build_post_data', build_post_data)
+
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'downloaded'
+    with open(os.path.join(tmp_path, state['batch_id'], 'written.txt')) as written_file:
+        [written] = written_file.read().split()
+    first_write = post_data(firestore, written).update_time
+    output_path = os.path.join(tmp_path, 'local', state['remote_id'], 'output.jsonl')
+    answered = os.path.getmtime(output_path)
+
+    assert run(batch, tmp_path) == 0
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'done'
+    assert state['written'] == 3
+    assert all(post_data(firestore, convo_id).exists for convo_id in ('c1', 'c2', 'c3'))
+    # The committed conversation is not rewritten and the model is not asked again
+    assert post_data(firestore, written).update_time == first_write
+    assert os.path.getmtime(output_path) == answered
+
+
+def test_batch_resumes_a_built_batch(core, batch, firestore, tmp_path):
+    add_conversation(core, 'c1')
+    state = batch.build_batch(str(tmp_path), limit=10)
+    assert state['status'] == 'built'
+
+    assert run(batch, tmp_path) == 0
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'done'
+    assert post_data(firestore, 'c1').exists
+
+
+def age_post(firestore, convo_id, seconds):
+    post_data_ref = firestore.document('users', convo_id, 'post_data', convo_id)
+    generated_at = post_data_ref.get().to_dict()['generated_at'] - datetime.timedelta(seconds=seconds)
+    post_data_ref.set({'generated_at': generated_at}, merge=True)
+    return generated_at
+
+
+def test_old_posts_with_current_inputs_are_not_batched_again(core, batch, client, firestore, tmp_path):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    age_post(firestore, 'c1', core.GENERATION_CACHE_TTL + 3600)
+    written = post_data(firestore, 'c1').update_time
+
+    assert run(batch, tmp_path) == 0
+    assert batch.list_batches(str(tmp_path)) == []
+    assert post_data(firestore, 'c1').update_time == written
+
+
+def test_batch_written_posts_outlive_the_online_ttl(core, batch, client, firestore, tmp_path):
+    add_conversation(core, 'c1')
+    assert run(batch, tmp_path) == 0
+    generated_at = age_post(firestore, 'c1', core.GENERATION_CACHE_TTL + 3600)
+    core.generation_cache.clear()
+
+    response = client.get('/GetPOSTDATA?convo_id=c1')
+    assert response.status_code == 200
+    stored = post_data(firestore, 'c1').to_dict()
+    assert stored['generated_at'] == generated_at
+    assert stored['generation_source'] == 'batch'
+
+
+def test_online_posts_still_expire(core, client, firestore):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    generated_at = age_post(firestore, 'c1', core.GENERATION_CACHE_TTL + 3600)
+    core.generation_cache.clear()
+
+    client.get('/GetPOSTDATA?convo_id=c1')
+    assert post_data(firestore, 'c1').to_dict()['generated_at'] > generated_at
+
+
+def test_crash_after_submitting_does_not_submit_twice(core, batch, firestore, tmp_path, monkeypatch):
+    add_conversation(core, 'c1')
+    created = []
+
+    class CrashingBackend(batch.LocalBatchBackend):
+        def create(self, batch_id, input_file_id):
+            remote_id = super().create(batch_id, input_file_id)
+            created.append(remote_id)
+            if len(created) == 1:
+                raise RuntimeError('worker killed before state.json was saved')
+            return remote_id
+
+    backend = CrashingBackend(os.path.join(tmp_path, 'local'))
+    monkeypatch.setattr(batch, 'create_backend', lambda name, work_dir: backend)
+    with pytest.raises(RuntimeError):
+        run(batch, tmp_path)
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'built'
+    assert state['input_file_id']
+
+    assert run(batch, tmp_path) == 0
+    [state] = batch.list_batches(str(tmp_path))
+    assert state['status'] == 'done'
+    assert created == [state['remote_id']]
@@ -0,0 +1,132 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from conftest import add_conversation
+
+
+def test_single_flight_runs_once_for_concurrent_callers(core):
+    calls = []
+    release = threading.Event()
+
+    def generate():
+        calls.append(1)
+        release.wait(5)
+        return 'post'
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        futures = [executor.submit(core.single_flight, 'key', generate) for _ in range(6)]
+        # Let every caller reach single_flight before the leader finishes
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ['post'] * 6
+    assert len(calls) == 1
+    assert core.single_flight('key', lambda: 'next') == 'next'
+
+
+def test_single_flight_shares_the_leaders_error(core):
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('model unavailable')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(core.single_flight, 'key', fail)
+        started.wait(5)
+        follower = executor.submit(core.single_flight, 'key', lambda: 'never')
+        time.sleep(0.1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result()
+
+
+def test_async_single_flight_survives_a_cancelled_caller(loop):
+    import asgi
+
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'post'
+
+    async def scenario():
+        first = asyncio.ensure_future(asgi.single_flight('key', generate))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(asgi.single_flight('key', generate))
+        await asyncio.sleep(0)
+        # The first client disconnects; the second still gets the shared result
+        first.cancel()
+        return await second
+
+    assert loop.run_until_complete(scenario()) == 'post'
+    assert len(calls) == 1
+
+
+def test_draft_timer_debounces_a_burst_of_uploads(core, monkeypatch):
+    drafted = []
+    done = threading.Event()
+    monkeypatch.setattr(core, 'DRAFT_GENERATION', True)
+    monkeypatch.setattr(core, 'DRAFT_DEBOUNCE_SECONDS', 0.2)
+    monkeypatch.setattr(core, 'generate_draft', lambda convo_id: (drafted.append(convo_id), done.set()))
+
+    for _ in range(5):
+        core.schedule_draft_generation('c1')
+        time.sleep(0.05)
+    assert not drafted
+
+    assert done.wait(5)
+    time.sleep(0.3)
+    assert drafted == ['c1']
+    assert 'c1' not in core.draft_timers
+
+
+def test_draft_is_served_by_get_post_data(core, client, firestore):
+    image_url = add_conversation(core, 'c1')
+    core.generate_draft('c1')
+    draft = firestore.document('users', 'c1', 'post_data', 'c1').get().to_dict()['draft']
+
+    core.generation_cache.clear()
+    response = client.get('/GetPOSTDATA?convo_id=c1')
+    assert response.status_code == 200
+    assert response.get_json() == core.build_post_data(draft['raw_content'], [image_url])
+    stored = firestore.document('users', 'c1', 'post_data', 'c1').get().to_dict()
+    assert stored['generation_key'] == draft['generation_key']
+    assert stored['generated_at'] == draft['generated_at']
+
+
+def test_unchanged_post_is_not_rewritten(core, client, firestore):
+    add_conversation(core, 'c1')
+    post_data_ref = firestore.document('users', 'c1', 'post_data', 'c1')
+    first = client.get('/GetPOSTDATA?convo_id=c1')
+    written = post_data_ref.get().update_time
+
+    second = client.get('/GetPOSTDATA?convo_id=c1')
+    assert second.get_json() == first.get_json()
+    assert post_data_ref.get().update_time == written
+
+
+def test_get_post_data_answers_304_for_the_current_etag(core, client):
+    add_conversation(core, 'c1')
+    etag = client.get('/GetPOSTDATA?convo_id=c1').headers['ETag']
+    assert client.get('/GetPOSTDATA?convo_id=c1', headers={'If-None-Match': etag}).status_code == 304
+
+    core.save_image_labels('c1', {2: ['Cake']})
+    assert client.get('/GetPOSTDATA?convo_id=c1', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_async_get_post_data_matches_the_stored_post(core, client, loop, asgi_client):
+    add_conversation(core, 'c1')
+    sync_body = client.get('/GetPOSTDATA?convo_id=c1').get_json()
+    response = loop.run_until_complete(asgi_client.get('/GetPOSTDATA?convo_id=c1'))
+    assert response.status_code == 200
+    assert response.json() == sync_body
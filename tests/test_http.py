@@ -0,0 +1,19 @@
+def test_only_idempotent_methods_retry_by_default(core):
+    assert core.request_attempts('get') == core.HTTP_MAX_RETRIES + 1
+    assert core.request_attempts('POST') == 1
+    assert core.request_attempts('POST', retry=True) == core.HTTP_MAX_RETRIES + 1
+
+
+def test_retries_connection_errors_and_retryable_statuses_until_the_last_attempt(core):
+    assert core.should_retry(0, 4)
+    assert core.should_retry(0, 4, 503)
+    assert not core.should_retry(0, 4, 404)
+    assert not core.should_retry(3, 4, 503)
+    assert not core.should_retry(3, 4)
+    assert not core.should_retry(0, 1)
+
+
+def test_backoff_is_jittered_under_an_exponential_cap(core):
+    delays = [core.retry_delay(3) for _ in range(50)]
+    assert all(0 <= delay <= core.HTTP_BACKOFF_BASE * 8 for delay in delays)
+    assert len(set(delays)) > 1
@@ -0,0 +1,82 @@
+import io
+import secrets
+
+from PIL import Image
+
+from conftest import make_image
+
+
+def encode(image, fmt='JPEG', **params):
+    out = io.BytesIO()
+    image.save(out, fmt, **params)
+    return out.getvalue()
+
+
+def open_image(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_exif_orientation_is_applied(core):
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    normalized = core.normalize_image(encode(Image.new('RGB', (80, 40)), exif=exif))
+    for rendition in ('vision', 'web', 'thumb'):
+        assert open_image(normalized[rendition]).size == (40, 80)
+
+
+def test_transparency_is_flattened_onto_white(core):
+    # Left half transparent, right half opaque red
+    image = Image.new('RGBA', (40, 40), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (20, 0, 40, 40))
+    vision = open_image(core.normalize_image(encode(image, 'PNG'))['vision'])
+    assert vision.format == 'JPEG'
+    assert vision.mode == 'RGB'
+    assert all(channel > 240 for channel in vision.getpixel((5, 20)))
+    red, green, blue = vision.getpixel((35, 20))
+    assert red > 200 and green < 60 and blue < 60
+
+
+def test_renditions_are_downscaled_jpegs(core):
+    normalized = core.normalize_image(encode(Image.new('RGB', (4000, 1000), (10, 120, 200))))
+    assert open_image(normalized['vision']).size == (core.VISION_MAX_SIDE, core.VISION_MAX_SIDE // 4)
+    assert open_image(normalized['web']).size == (core.WEB_MAX_SIDE, core.WEB_MAX_SIDE // 4)
+    assert open_image(normalized['thumb']).size == (core.THUMBNAIL_MAX_SIDE, core.THUMBNAIL_MAX_SIDE // 4)
+
+
+def test_small_images_are_not_upscaled(core):
+    normalized = core.normalize_image(make_image(64))
+    assert {open_image(normalized[rendition]).size for rendition in ('vision', 'web', 'thumb')} == {(64, 64)}
+
+
+def test_label_jobs_skip_the_renditions(core):
+    normalized = core.normalize_image(make_image(), renditions=False)
+    assert normalized['web'] is None and normalized['thumb'] is None
+    assert open_image(normalized['vision']).format == 'JPEG'
+
+
+def test_undecodable_uploads_go_to_vision_unchanged(core):
+    assert core.normalize_image(b'not an image') == {'vision': b'not an image', 'web': None, 'thumb': None}
+
+
+def test_upload_stores_renditions_and_posts_use_the_web_copy(core, client, firestore):
+    convo_id = f'c-{secrets.token_hex(4)}'
+    response = client.post('/Save_Image_in_Bucket', data={'id': convo_id, 'file': (io.BytesIO(make_image()), 'a.png')})
+    body = response.get_json()
+    assert body['web_url'] == core.public_url(f'{convo_id}/web/a.jpg')
+    assert body['thumbnail_url'] == core.public_url(f'{convo_id}/thumb/a.jpg')
+    assert body['file_url'] == core.public_url(f'{convo_id}/a.png')
+    manifest = firestore.document('users', convo_id, 'manifest', convo_id).get().to_dict()
+    assert manifest['images']['a.png']['url'] == body['web_url']
+    assert manifest['images']['a.png']['original_url'] == body['file_url']
+
+
+def test_image_listing_prefers_web_renditions(core):
+    convo_id = f'c-{secrets.token_hex(4)}'
+    bucket = core.storage_client.bucket(core.bucket_name)
+    for name in ('a.jpg', 'web/a.jpg', 'thumb/a.jpg', 'b.gif'):
+        bucket.blob(f'{convo_id}/{name}').upload_from_string(make_image(), content_type='image/jpeg')
+
+    assert sorted(core.get_image_urls(core.bucket_name, convo_id)) == [
+        core.public_url(f'{convo_id}/b.gif'),
+        core.public_url(f'{convo_id}/web/a.jpg'),
+    ]
@@ -0,0 +1,84 @@
+import io
+import json
+import queue
+import time
+
+from conftest import make_image
+
+
+def upload_async(client, convo_id, filename='a.jpg'):
+    return client.post('/Save_Image_in_Bucket?async=true',
+                       data={'id': convo_id, 'file': (io.BytesIO(make_image()), filename)})
+
+
+def wait_for_label_job(client, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/GetLabelJobStatus?job_id={job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"label job {job_id} did not finish")
+
+
+def test_async_upload_is_labeled_in_the_background(client, firestore):
+    response = upload_async(client, 'c1')
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['status_url'] == f"/GetLabelJobStatus?job_id={body['job_id']}"
+    # The manifest lists the image before its labels are known
+    manifest = firestore.document('users', 'c1', 'manifest', 'c1').get().to_dict()
+    assert list(manifest['images']) == ['a.jpg']
+
+    job = wait_for_label_job(client, body['job_id'])
+    assert job['status'] == 'done'
+    assert job['labels']
+    labels_doc = firestore.document('users', 'c1', 'labels', 'c1').get().to_dict()
+    assert labels_doc['labels'][0][f"image{body['upload_counter'] - 1}"] == job['labels']
+
+
+def test_failed_label_job_records_the_error(client, vision):
+    vision.faults.error_rate = 1.0
+    job = wait_for_label_job(client, upload_async(client, 'c1').get_json()['job_id'])
+    assert job['status'] == 'failed'
+    assert job['error']
+
+
+def test_unknown_label_job_is_not_found(client):
+    assert client.get('/GetLabelJobStatus?job_id=missing').status_code == 404
+    assert client.get('/GetLabelJobStatus').status_code == 400
+
+
+def test_full_queue_labels_inline(core, client, monkeypatch):
+    # No workers drain the queue, so the upload finds it full
+    saturated = queue.Queue(maxsize=1)
+    saturated.put(None)
+    monkeypatch.setattr(core, 'label_job_queue', saturated)
+    monkeypatch.setattr(core, 'LABEL_WORKERS', 0)
+
+    job_id = upload_async(client, 'c1').get_json()['job_id']
+    assert client.get(f'/GetLabelJobStatus?job_id={job_id}').get_json()['status'] == 'done'
+
+
+def test_pubsub_backend_publishes_the_job(core, client, monkeypatch):
+    published = []
+
+    class FakePublisher:
+        def topic_path(self, project, topic):
+            return f'projects/{project}/topics/{topic}'
+
+        def publish(self, topic_path, data):
+            published.append((topic_path, json.loads(data)))
+            return type('Future', (), {'result': lambda self: 'message-id'})()
+
+    monkeypatch.setattr(core, 'LABEL_QUEUE_BACKEND', 'pubsub')
+    core.clients.override('label_publisher', FakePublisher())
+    response = upload_async(client, 'c1')
+
+    [(topic_path, job)] = published
+    assert topic_path == f'projects/{core.GCP_PROJECT}/topics/{core.LABEL_TOPIC}'
+    assert job['job_id'] == response.get_json()['job_id']
+    assert job['convo_id'] == 'c1'
+    # The worker side: a message runs the job from the stored original
+    core.run_label_job(job)
+    assert client.get(f"/GetLabelJobStatus?job_id={job['job_id']}").get_json()['status'] == 'done'
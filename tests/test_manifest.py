@@ -0,0 +1,81 @@
+import datetime
+import secrets
+
+from conftest import make_image
+
+
+def snapshots(firestore, convo_id):
+    return (firestore.document('users', convo_id).get(),
+            firestore.document('users', convo_id, 'manifest', convo_id).get(),
+            firestore.document('users', convo_id, 'labels', convo_id).get())
+
+
+def legacy_labels(*images):
+    """A labels document as uploads wrote it before the manifest existed."""
+    now = datetime.datetime.now()
+    return {
+        'labels': [{f'image{i}': labels, 'timestamp': now} for i, labels in enumerate(images, 1)],
+        'counter': len(images)
+    }
+
+
+def test_labels_are_ranked_by_frequency_then_name(core):
+    assert core.ranked_labels({'cake': 1, 'bread': 3, 'coffee': 3, 'tea': 2}) == ['bread', 'coffee', 'tea', 'cake']
+
+
+def test_least_frequent_labels_are_dropped_past_the_budget(core):
+    counts = {f'label{i}': 100 - i for i in range(100)}
+    ranked = core.ranked_labels(counts, budget=20)
+    assert ranked == [f'label{i}' for i in range(len(ranked))]
+    assert sum(core.count_tokens(label) + 1 for label in ranked) <= 20
+    assert core.ranked_labels(counts, budget=0) == []
+
+
+def test_legacy_counts_normalize_and_count_each_image_once(core):
+    counts = core.legacy_label_counts(legacy_labels(['Bread', ' bread ', 'Cake'], ['BREAD', ''], ['Coffee  Cup']))
+    assert counts == {'bread': 2, 'cake': 1, 'coffee cup': 1}
+
+
+def test_uploads_count_labels_in_the_manifest(core, firestore):
+    urls = {'original': core.public_url('c1/a.jpg')}
+    core.save_image_labels('c1', {1: ['Bread', 'bread', 'Cake']}, {'a.jpg': core.manifest_image(1, urls)})
+    core.save_image_labels('c1', {2: ['Bread']})
+    manifest = firestore.document('users', 'c1', 'manifest', 'c1').get().to_dict()
+    assert manifest['label_counts'] == {'bread': 2, 'cake': 1}
+    assert manifest['labeled_images'] == 2
+
+
+def test_manifest_answers_once_it_covers_every_labeled_image(core, firestore):
+    firestore.document('users', 'c1').set({'businessInfo': 'Bakery'})
+    urls = lambda name: {'original': core.public_url(f'c1/{name}'), 'web': core.public_url(f'c1/web/{name}')}
+    core.save_image_labels('c1', {2: ['Cake']}, {'b.jpg': core.manifest_image(2, urls('b.jpg'))})
+    core.save_image_labels('c1', {1: ['Bread']}, {'a.jpg': core.manifest_image(1, urls('a.jpg'))})
+
+    business_info, labels, labels_exist, image_urls = core.parse_post_inputs(*snapshots(firestore, 'c1'))
+    assert (business_info, labels, labels_exist) == ('Bakery', ['bread', 'cake'], True)
+    # Upload order, pointing at the web renditions
+    assert image_urls == [core.public_url('c1/web/a.jpg'), core.public_url('c1/web/b.jpg')]
+
+
+def test_conversations_from_before_the_manifest_fall_back_to_the_labels(core, firestore):
+    firestore.document('users', 'c1').set({'businessInfo': 'Bakery'})
+    firestore.document('users', 'c1', 'labels', 'c1').set(legacy_labels(['Bread'], ['Bread', 'Cake']))
+    # A later upload started a manifest that has only seen one of the three images
+    core.save_image_labels('c1', {3: ['Coffee']})
+
+    _, labels, labels_exist, image_urls = core.parse_post_inputs(*snapshots(firestore, 'c1'))
+    assert labels_exist
+    assert labels == ['bread', 'cake', 'coffee']
+    assert image_urls is None
+
+
+def test_get_post_data_lists_the_bucket_for_legacy_conversations(core, client, firestore):
+    convo_id = f'c-{secrets.token_hex(4)}'
+    core.storage_client.bucket(core.bucket_name).blob(f'{convo_id}/a.jpg').upload_from_string(
+        make_image(), content_type='image/jpeg')
+    firestore.document('users', convo_id).set({'businessInfo': 'Bakery'})
+    firestore.document('users', convo_id, 'labels', convo_id).set(legacy_labels(['Bread']))
+
+    response = client.get(f'/GetPOSTDATA?convo_id={convo_id}')
+    assert response.status_code == 200
+    assert response.get_json()['image_urls'] == [core.public_url(f'{convo_id}/a.jpg')]
@@ -0,0 +1,54 @@
+import io
+
+from conftest import add_conversation, make_image
+
+
+def server_timing(response):
+    """{name: milliseconds} from a Server-Timing header."""
+    timings = {}
+    for entry in response.headers['Server-Timing'].split(', '):
+        name, duration = entry.split(';dur=')
+        timings[name] = float(duration)
+    return timings
+
+
+def test_metrics_exposes_route_and_dependency_latency(core, client):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_route_duration_seconds_count{method="GET",route="/GetPOSTDATA",status="200"}' in body
+    assert 'dependency_duration_seconds_count{dependency="firestore",operation="get_all",outcome="ok"}' in body
+    assert 'openai_tokens_total' in body
+
+
+def test_server_timing_lists_the_requests_dependencies(core, client):
+    add_conversation(core, 'c1')
+    timings = server_timing(client.get('/GetPOSTDATA?convo_id=c1'))
+    assert {'firestore-get_all', 'firestore-set', 'total'} <= set(timings)
+    assert timings['total'] >= timings['firestore-get_all']
+
+
+def test_server_timing_includes_work_on_the_io_pool(client):
+    response = client.post('/Save_Image_in_Bucket', data={'id': 'c1', 'file': (io.BytesIO(make_image()), 'a.jpg')})
+    assert response.status_code == 200
+    assert 'gcs-upload' in server_timing(response)
+
+
+def test_server_timing_includes_the_parallel_geo_lookup(core, client, web_url):
+    core.geo_cache.clear()
+    response = client.post('/scrape', json={'website_url': f'{web_url}/site/timed', 'id': 'c1'})
+    assert {'scrape-get', 'ip_api-get', 'firestore-set'} <= set(server_timing(response))
+
+
+def test_timings_do_not_leak_into_the_next_request(client):
+    client.post('/Save_Image_in_Bucket', data={'id': 'c1', 'file': (io.BytesIO(make_image()), 'a.jpg')})
+    assert set(server_timing(client.get('/GetWebsiteAddress?id=nobody'))) == {'firestore-get', 'total'}
+
+
+def test_async_server_timing_includes_firestore(core, loop, asgi_client):
+    add_conversation(core, 'c1')
+    response = loop.run_until_complete(asgi_client.get('/GetPOSTDATA?convo_id=c1'))
+    assert {'firestore-get_all', 'firestore-set', 'total'} <= set(server_timing(response))
@@ -0,0 +1,181 @@
+import asyncio
+import concurrent.futures
+import datetime
+import threading
+import time
+
+import pytest
+
+from conftest import WP_PASSWORD, WP_USER, add_conversation, fake_urls, serve_in_thread
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def seed_job(core, job_id, status, age_seconds=0):
+    core.publish_job_coll_ref.document(job_id).set({
+        'status': status, 'convo_id': 'c1', 'website': 'https://example.com', 'error': None,
+        'updated': now() - datetime.timedelta(seconds=age_seconds)
+    })
+
+
+def publish(client, convo_id, website, wait=None):
+    query = f'/post_to_wordpress?convo_id={convo_id}' + ('&wait=true' if wait else '')
+    return client.post(query, json={'userName': WP_USER, 'passWord': WP_PASSWORD, 'website': website})
+
+
+def wait_for_job(client, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/GetPublishJobStatus?job_id={job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"publish job {job_id} did not finish")
+
+
+def test_new_job_is_claimed_once(core):
+    assert core.claim_publish_job('job', 'c1', 'https://example.com')[0]
+    claimed, job_data = core.claim_publish_job('job', 'c1', 'https://example.com')
+    assert not claimed
+    assert job_data['status'] == 'queued'
+
+
+@pytest.mark.parametrize('status, age, claimed', [
+    ('failed', 0, True),
+    ('running', 0, False),
+    ('done', 10 ** 6, False),
+])
+def test_job_takeover_depends_on_status(core, status, age, claimed):
+    seed_job(core, 'job', status, age)
+    assert core.claim_publish_job('job', 'c1', 'https://example.com')[0] is claimed
+
+
+def test_stale_job_is_taken_over_by_exactly_one_retry(core):
+    seed_job(core, 'job', 'running', core.PUBLISH_JOB_STALE_SECONDS + 60)
+    barrier = threading.Barrier(8)
+
+    def claim(_):
+        barrier.wait(5)
+        return core.claim_publish_job('job', 'c1', 'https://example.com')[0]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(claim, range(8)))
+    assert results.count(True) == 1
+    assert core.publish_job_coll_ref.document('job').get().to_dict()['status'] == 'queued'
+
+
+def test_idempotency_key_changes_with_the_generated_post(core):
+    generated_at = now()
+    post_data = {'generation_key': 'k1', 'generated_at': generated_at, 'headline': 'h', 'content': 'c'}
+    key = core.publish_idempotency_key('c1', 'https://example.com/', post_data)
+    assert key == core.publish_idempotency_key('c1', 'https://example.com', dict(post_data))
+    assert key != core.publish_idempotency_key('c1', 'https://example.com', {**post_data, 'generation_key': 'k2'})
+    assert key != core.publish_idempotency_key(
+        'c1', 'https://example.com', {**post_data, 'generated_at': generated_at + datetime.timedelta(seconds=1)}
+    )
+
+
+def test_publish_waits_then_deduplicates_retries(core, client, wordpress_url):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+
+    created = publish(client, 'c1', wordpress_url, wait=True)
+    assert created.status_code == 201
+    assert created.get_json()['link']
+
+    retried = publish(client, 'c1', wordpress_url)
+    assert retried.status_code == 200
+    assert retried.get_json()['link'] == created.get_json()['link']
+
+
+def test_publish_runs_in_the_background_by_default(core, client, wordpress_url):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+
+    queued = publish(client, 'c1', wordpress_url)
+    assert queued.status_code == 202
+    job = wait_for_job(client, queued.get_json()['job_id'])
+    assert job['status'] == 'done'
+    assert job['link']
+
+
+def test_regenerated_post_can_be_published_again(core, client, wordpress_url):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    first = publish(client, 'c1', wordpress_url, wait=True).get_json()
+
+    client.get('/GetPOSTDATA?convo_id=c1&regenerate=true')
+    second = publish(client, 'c1', wordpress_url, wait=True)
+    assert second.status_code == 201
+    assert second.get_json()['job_id'] != first['job_id']
+
+
+def test_failed_publish_is_retried_under_the_same_job(core, client):
+    from fakes import wordpress
+
+    server, broken_url = serve_in_thread(wordpress.create_app(WP_USER, WP_PASSWORD, error_rate=1.0))
+    try:
+        add_conversation(core, 'c1')
+        client.get('/GetPOSTDATA?convo_id=c1')
+        failed = publish(client, 'c1', broken_url, wait=True)
+        assert failed.status_code == 500
+    finally:
+        server.shutdown()
+
+    job_id = core.publish_idempotency_key(
+        'c1', broken_url, core.user_coll_ref.document('c1').collection('post_data').document('c1').get().to_dict()
+    )
+    assert core.publish_job_coll_ref.document(job_id).get().to_dict()['status'] == 'failed'
+    assert core.claim_publish_job(job_id, 'c1', broken_url)[0]
+
+
+def test_async_publish_deduplicates_retries(core, client, loop, asgi_client):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    body = {'userName': WP_USER, 'passWord': WP_PASSWORD, 'website': fake_urls['wordpress']}
+
+    created = loop.run_until_complete(asgi_client.post('/post_to_wordpress?convo_id=c1&wait=true', json=body))
+    assert created.status_code == 201
+    retried = loop.run_until_complete(asgi_client.post('/post_to_wordpress?convo_id=c1', json=body))
+    assert retried.status_code == 200
+    assert retried.json()['link'] == created.json()['link']
+
+
+def fail_publishing(*args):
+    raise RuntimeError('WordPress client crashed')
+
+
+def test_background_publish_error_marks_the_job_failed(core, client, wordpress_url, monkeypatch):
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    monkeypatch.setattr(core, 'post_creator', fail_publishing)
+
+    queued = publish(client, 'c1', wordpress_url)
+    assert queued.status_code == 202
+    job = wait_for_job(client, queued.get_json()['job_id'])
+    assert job['status'] == 'failed'
+    assert job['error'] == 'WordPress client crashed'
+    assert core.claim_publish_job(job['job_id'], 'c1', wordpress_url)[0]
+
+
+def test_async_background_publish_error_marks_the_job_failed(core, client, loop, asgi_client, monkeypatch):
+    import asgi
+
+    async def fail_publishing_async(*args):
+        fail_publishing()
+
+    add_conversation(core, 'c1')
+    client.get('/GetPOSTDATA?convo_id=c1')
+    monkeypatch.setattr(asgi, 'post_creator', fail_publishing_async)
+    body = {'userName': WP_USER, 'passWord': WP_PASSWORD, 'website': fake_urls['wordpress']}
+
+    queued = loop.run_until_complete(asgi_client.post('/post_to_wordpress?convo_id=c1', json=body))
+    assert queued.status_code == 202
+    job_ref = core.publish_job_coll_ref.document(queued.json()['job_id'])
+    for _ in range(100):
+        loop.run_until_complete(asyncio.sleep(0.02))
+        if job_ref.get().to_dict()['status'] == 'failed':
+            break
+    assert job_ref.get().to_dict()['error'] == 'WordPress client crashed'
@@ -0,0 +1,60 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture
+def user(core):
+    core.user_coll_ref.document('u1').set({'website': 'https://example.com/' + 'a' * 2000, 'businessInfo': 'Bakery'})
+    return 'u1'
+
+
+def test_large_json_is_gzipped_for_clients_that_accept_it(client, user):
+    response = client.get(f'/GetWebsiteAddress?id={user}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.get_data()))['website_address'].startswith('https://example.com/')
+
+
+def test_brotli_is_preferred_when_available(client, user):
+    brotli = pytest.importorskip('brotli')
+    response = client.get(f'/GetWebsiteAddress?id={user}', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(response.get_data()))['website_address'].startswith('https://example.com/')
+
+
+def test_small_or_unaccepted_bodies_are_sent_as_is(core, client, user):
+    assert 'Content-Encoding' not in client.get(f'/GetWebsiteAddress?id={user}').headers
+    core.user_coll_ref.document('u2').set({'website': 'https://example.com'})
+    response = client.get('/GetWebsiteAddress?id=u2', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json() == {'website_address': 'https://example.com'}
+
+
+def test_website_address_answers_304_until_the_profile_changes(client, user):
+    etag = client.get(f'/GetWebsiteAddress?id={user}').headers['ETag']
+    cached = client.get(f'/GetWebsiteAddress?id={user}', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+
+    client.post('/Save_UserData_in_Firestore', json={
+        'session': user, 'person': 'Ann', 'url': 'https://new.example', 'businessInfo': 'Bakery'
+    })
+    changed = client.get(f'/GetWebsiteAddress?id={user}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json() == {'website_address': 'https://new.example'}
+
+
+def test_check_existing_user_post_is_never_conditional(client, user):
+    first = client.post('/Check_Existing_User', json={'userID': user})
+    assert 'ETag' not in first.headers
+    again = client.post('/Check_Existing_User', json={'userID': user}, headers={'If-None-Match': '*'})
+    assert again.status_code == 200
+    assert again.get_json() == first.get_json()
+
+
+def test_check_existing_user_is_compressed(client, user):
+    response = client.post('/Check_Existing_User', json={'userID': user}, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data()))['found'] is True
@@ -0,0 +1,20 @@
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('cryptography', 'grpc', 'google.cloud.firestore', 'google.cloud.storage',
+                 'google.api_core.exceptions', 'firebase_admin')
+
+
+def test_import_does_not_load_the_google_sdks():
+    # A fresh interpreter: this one already imported them through the fakes
+    script = f"import json, sys, app; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', script], cwd=root, check=True, capture_output=True, text=True).stdout
+    assert json.loads(output.splitlines()[-1]) == []
+
+
+def test_firestore_loads_on_first_use(core):
+    assert core.firestore.SERVER_TIMESTAMP is not None
+    assert issubclass(core.api_exceptions.AlreadyExists, Exception)
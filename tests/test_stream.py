@@ -0,0 +1,72 @@
+import json
+import re
+
+from conftest import add_conversation
+
+
+def parse_events(body):
+    """[(event, data)] from a text/event-stream body."""
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def stream(client, convo_id, regenerate=False):
+    response = client.get(f'/GetPOSTDATA/stream?convo_id={convo_id}' + ('&regenerate=true' if regenerate else ''))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    return parse_events(response.get_data(as_text=True))
+
+
+def test_stream_emits_tokens_headline_tags_then_the_post(core, client):
+    add_conversation(core, 'c1')
+    events = stream(client, 'c1')
+    names = [name for name, _ in events]
+
+    assert names[-1] == 'done'
+    assert names.count('headline') == 1
+    assert names.index('headline') > names.index('token')
+    text = ''.join(data['text'] for name, data in events if name == 'token')
+    tags = [data['tag'] for name, data in events if name == 'tag']
+    assert tags == re.findall(r'#\w+', text)
+
+    done = events[-1][1]
+    assert done['headline'] == dict(events)['headline']['headline']
+    assert done == core.build_post_data(text, done['image_urls'])
+
+
+def test_stream_matches_and_reuses_the_stored_post(core, client, firestore):
+    add_conversation(core, 'c1')
+    streamed = stream(client, 'c1')[-1][1]
+    assert client.get('/GetPOSTDATA?convo_id=c1').get_json() == streamed
+    written = firestore.document('users', 'c1', 'post_data', 'c1').get().update_time
+
+    # The stored generation is replayed without tokens and not rewritten
+    replayed = stream(client, 'c1')
+    assert 'token' not in [name for name, _ in replayed]
+    assert replayed[-1] == ('done', streamed)
+    assert firestore.document('users', 'c1', 'post_data', 'c1').get().update_time == written
+
+
+def test_stream_regenerate_calls_the_model_again(core, client):
+    add_conversation(core, 'c1')
+    stream(client, 'c1')
+    assert 'token' in [name for name, _ in stream(client, 'c1', regenerate=True)]
+
+
+def test_stream_reports_errors_as_an_event(core, client, monkeypatch):
+    add_conversation(core, 'c1')
+
+    def unavailable(**kwargs):
+        raise RuntimeError('model unavailable')
+
+    monkeypatch.setattr(core.client.chat.completions, 'create', unavailable)
+    assert stream(client, 'c1') == [('error', {'error': 'model unavailable'})]
+
+
+def test_stream_validates_before_streaming(core, client):
+    assert client.get('/GetPOSTDATA/stream').status_code == 400
+    core.user_coll_ref.document('c1').set({'businessInfo': 'Bakery'})
+    assert client.get('/GetPOSTDATA/stream?convo_id=c1').status_code == 400
@@ -0,0 +1,91 @@
+import json
+import types
+
+import pytest
+
+HEAD = b"""<html><head>
+<title> Rise &amp; Bake </title>
+<meta name="description" content="Sourdough and pastries in Leeds">
+<meta property="og:description" content="Sourdough and pastries in Leeds">
+<meta property="og:title" content="Rise and Bake">
+<meta property="og:image" content="https://example.com/logo.png">
+<meta name="viewport" content="width=device-width">
+<meta name="keywords" content="">
+<script>window.dataLayer = [];</script>
+<style>body { color: red }</style>
+<script type="application/ld+json">
+{"@graph": [{"@type": "Bakery", "name": "Rise and Bake", "url": "https://example.com", "telephone": "0113 000"},
+            {"@type": "WebSite", "potentialAction": {"@type": "SearchAction"}}]}
+</script>
+<script type="application/ld+json">{not json</script>
+</head><body>ignored</body></html>"""
+
+
+def test_compaction_keeps_only_descriptive_text(core):
+    compacted = core.compact_head_content(core.parse_head(HEAD))
+    assert compacted.splitlines() == [
+        'title: Rise & Bake',
+        'description: Sourdough and pastries in Leeds',
+        'og:description: Sourdough and pastries in Leeds',
+        'og:title: Rise and Bake',
+        'json-ld: {"@type":"Bakery","name":"Rise and Bake","telephone":"0113 000"}',
+        'json-ld: {"@type":"WebSite"}',
+    ]
+
+
+def test_compaction_of_a_missing_head(core):
+    assert core.compact_head_content(None) == ''
+
+
+def test_identical_lines_are_kept_once(core):
+    head = core.parse_head(b'<head><meta name="description" content="Cakes"><meta name="description" content="Cakes"></head>')
+    assert core.compact_head_content(head) == 'description: Cakes'
+
+
+@pytest.mark.parametrize('tiktoken', [True, False])
+def test_truncation_respects_the_token_budget(core, monkeypatch, tiktoken):
+    if tiktoken:
+        pytest.importorskip('tiktoken')
+    else:
+        monkeypatch.setattr(core, 'token_encoding', False)
+    text = ' '.join(f'word{i}' for i in range(500))
+    truncated = core.truncate_to_tokens(text, 50)
+    assert text.startswith(truncated)
+    assert core.count_tokens(truncated) <= 50
+    assert core.truncate_to_tokens('short', 50) == 'short'
+
+
+def test_scripts_do_not_change_the_summary_cache_key(core):
+    with_scripts = core.parse_head(b'<head><title>Shop</title><script>track(1)</script></head>')
+    without = core.parse_head(b'<head><title>Shop</title></head>')
+    assert core.summary_input(with_scripts) == core.summary_input(without)
+
+
+def test_summary_asks_for_a_json_object(core):
+    request = core.summary_request('title: Shop')
+    assert request['response_format'] == {"type": "json_object"}
+    assert 'title: Shop' in request['messages'][0]['content']
+    assert core.get_openai_summary('title: Shop')['niche']
+
+
+def test_summary_reply_is_parsed_without_fence_stripping(core):
+    usage = types.SimpleNamespace(prompt_tokens=1, completion_tokens=1)
+    reply = lambda content: types.SimpleNamespace(
+        usage=usage, choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+    )
+    assert core.parse_summary(reply(json.dumps({'niche': 'Bakery'}))) == {'niche': 'Bakery'}
+    with pytest.raises(ValueError):
+        core.parse_summary(reply('```json\n{}\n```'))
+
+
+def test_equal_compacted_heads_share_one_model_call(core, monkeypatch):
+    calls = []
+    get_openai_summary = core.get_openai_summary
+    monkeypatch.setattr(core, 'get_openai_summary', lambda content: calls.append(content) or get_openai_summary(content))
+
+    first = core.get_cached_openai_summary(core.parse_head(b'<head><title>Shop</title><style>a{}</style></head>'))
+    core.summary_cache.clear()
+    # The in-process tier is gone; the Firestore tier answers
+    second = core.get_cached_openai_summary(core.parse_head(b'<head><title>Shop</title></head>'))
+    assert first == second
+    assert calls == ['title: Shop']
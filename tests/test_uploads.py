@@ -0,0 +1,169 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import secrets
+
+from conftest import make_image
+
+
+def upload(client, convo_id, filename='a.jpg'):
+    return client.post('/Save_Image_in_Bucket', data={'id': convo_id, 'file': (io.BytesIO(make_image()), filename)})
+
+
+def quota_count(firestore, convo_id):
+    return (firestore.document('users', convo_id, 'quota', 'uploads').get().to_dict() or {}).get('count')
+
+
+def test_quota_transaction_hands_out_each_slot_once(core, firestore):
+    assert core.reserve_upload_slots('c1', 3) == 1
+    assert core.reserve_upload_slots('c1', 3) is None
+    assert core.reserve_upload_slots('c1', 2) == 4
+    assert core.reserve_upload_slots('c1') is None
+    assert quota_count(firestore, 'c1') == core.MAX_UPLOADS
+
+
+def test_concurrent_uploads_never_exceed_the_quota(core, firestore):
+    def upload_one(i):
+        return upload(core.app.test_client(), 'c1', f'img{i}.jpg')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(upload_one, range(core.MAX_UPLOADS + 3)))
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] * core.MAX_UPLOADS + [400] * 3
+    counters = sorted(response.get_json()['upload_counter'] for response in responses if response.status_code == 200)
+    assert counters == list(range(2, core.MAX_UPLOADS + 2))
+    assert quota_count(firestore, 'c1') == core.MAX_UPLOADS
+
+
+def test_failed_upload_gives_its_slot_back(client, firestore, vision):
+    vision.faults.error_rate = 1.0
+    response = upload(client, 'c1')
+    assert response.status_code == 500
+    assert response.get_json()['error'].startswith('Upload failed')
+    assert quota_count(firestore, 'c1') == 0
+
+    vision.faults.error_rate = 0.0
+    response = upload(client, 'c1')
+    assert response.status_code == 200
+    assert response.get_json()['upload_counter'] == 2
+
+
+def test_failed_batch_upload_gives_all_its_slots_back(client, firestore, vision):
+    vision.faults.error_rate = 1.0
+    files = [(io.BytesIO(make_image()), 'a.jpg'), (io.BytesIO(make_image()), 'b.jpg')]
+    response = client.post('/Save_Images_in_Bucket', data={'id': 'c1', 'file': files})
+    assert response.status_code == 500
+    assert quota_count(firestore, 'c1') == 0
+
+
+def test_upload_without_id_is_rejected(client, firestore):
+    response = client.post('/Save_Image_in_Bucket', data={'file': (io.BytesIO(make_image()), 'a.jpg')})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "id is required"}
+
+
+def test_empty_stream_upload_is_rejected(client, firestore):
+    response = client.put('/Save_Image_in_Bucket/stream?id=c1&filename=a.jpg', data=b'')
+    assert response.status_code == 400
+
+    chunked = client.put('/Save_Image_in_Bucket/stream?id=c1&filename=a.jpg', input_stream=io.BytesIO(b''),
+                         headers={'Transfer-Encoding': 'chunked'})
+    assert chunked.status_code == 400
+    assert not quota_count(firestore, 'c1')
+
+
+def test_stream_upload_labels_the_image(client, firestore):
+    response = client.put('/Save_Image_in_Bucket/stream?id=c1&filename=a.jpg', data=make_image(),
+                          content_type='image/jpeg')
+    assert response.status_code == 200
+    assert response.get_json()['last_image_label']
+    manifest = firestore.document('users', 'c1', 'manifest', 'c1').get().to_dict()
+    assert list(manifest['images']) == ['a.jpg']
+
+
+def test_async_uploads_share_the_quota(core, firestore, loop, asgi_client):
+    async def upload_all():
+        return await asyncio.gather(*[
+            asgi_client.post('/Save_Image_in_Bucket', data={'id': 'c1'},
+                             files={'file': (f'img{i}.jpg', make_image(), 'image/jpeg')})
+            for i in range(core.MAX_UPLOADS + 2)
+        ])
+
+    responses = loop.run_until_complete(upload_all())
+    assert sorted(response.status_code for response in responses) == [200] * core.MAX_UPLOADS + [400] * 2
+    assert quota_count(firestore, 'c1') == core.MAX_UPLOADS
+
+
+def test_async_failed_upload_gives_its_slot_back(firestore, vision, loop, asgi_client):
+    vision.faults.error_rate = 1.0
+    response = loop.run_until_complete(asgi_client.post(
+        '/Save_Image_in_Bucket', data={'id': 'c1'}, files={'file': ('a.jpg', make_image(), 'image/jpeg')}
+    ))
+    assert response.status_code == 500
+    assert quota_count(firestore, 'c1') == 0
+
+
+def test_label_cache_skips_vision_for_known_images(core, vision):
+    image = make_image()
+    first = core.detect_labels_batch([image, image])
+    calls = vision.faults.stats()['calls']
+    core.label_cache.clear()
+
+    # The Firestore tier answers once the in-process tier is gone
+    assert core.detect_labels_batch([image]) == [first[0]]
+    assert vision.faults.stats()['calls'] == calls
+
+
+def stream_upload(client, convo_id, filename, data, **kwargs):
+    return client.put(f'/Save_Image_in_Bucket/stream?id={convo_id}&filename={filename}', data=data,
+                      content_type='image/jpeg', **kwargs)
+
+
+def test_oversized_stream_upload_is_rejected_up_front(core, client, firestore, monkeypatch):
+    monkeypatch.setattr(core, 'UPLOAD_MAX_BYTES', 1024)
+    response = stream_upload(client, 'c1', 'a.jpg', b'x' * 2048)
+    assert response.status_code == 413
+    # Refused from Content-Length alone, before a slot is claimed
+    assert quota_count(firestore, 'c1') is None
+
+
+def test_oversized_chunked_upload_is_cut_off_and_refunded(core, client, firestore, monkeypatch):
+    monkeypatch.setattr(core, 'UPLOAD_MAX_BYTES', 1024)
+    # No Content-Length; the server has already de-chunked the body, as gunicorn does
+    response = client.put('/Save_Image_in_Bucket/stream?id=c1&filename=a.jpg', input_stream=io.BytesIO(b'x' * 4096),
+                          headers={'Transfer-Encoding': 'chunked', 'Content-Type': 'image/jpeg'},
+                          environ_base={'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    assert quota_count(firestore, 'c1') == 0
+
+
+def test_duplicate_stream_upload_keeps_the_first_copy(core, client, firestore):
+    convo_id = f'c-{secrets.token_hex(4)}'
+    image = make_image()
+    first = stream_upload(client, convo_id, 'a.jpg', image).get_json()
+    assert first['sha256'] == hashlib.sha256(image).hexdigest()
+    assert 'duplicate' not in first
+
+    second = stream_upload(client, convo_id, 'b.jpg', image)
+    assert second.status_code == 200
+    assert second.get_json() == {
+        'file_name': 'a.jpg', 'file_url': first['file_url'], 'sha256': first['sha256'],
+        'duplicate': True, 'upload_counter': first['upload_counter']
+    }
+    bucket = core.storage_client.bucket(core.bucket_name)
+    assert bucket.blob(f'{convo_id}/a.jpg').exists()
+    assert not bucket.blob(f'{convo_id}/b.jpg').exists()
+    # The duplicate's slot is given back and Vision labeled the image once
+    assert quota_count(firestore, convo_id) == 1
+    labels = firestore.document('users', convo_id, 'labels', convo_id).get().to_dict()['labels']
+    assert len(labels) == 1
+
+
+def test_reuploading_the_same_file_keeps_it(core, client):
+    convo_id = f'c-{secrets.token_hex(4)}'
+    image = make_image()
+    stream_upload(client, convo_id, 'a.jpg', image)
+    assert stream_upload(client, convo_id, 'a.jpg', image).get_json()['duplicate'] is True
+    assert core.storage_client.bucket(core.bucket_name).blob(f'{convo_id}/a.jpg').exists()
@@ -0,0 +1,50 @@
+import types
+
+
+def website_address(client, user_id):
+    return client.get(f'/GetWebsiteAddress?id={user_id}')
+
+
+def save_user(client, user_id, website):
+    return client.post('/Save_UserData_in_Firestore', json={
+        'session': user_id, 'person': 'Ann', 'url': website, 'businessInfo': 'Bakery'
+    })
+
+
+def test_unknown_user_is_found_once_created_elsewhere(core, client):
+    assert website_address(client, 'u1').status_code == 404
+    # Written by another worker: no local invalidation happens
+    core.user_coll_ref.document('u1').set({'website': 'https://example.com'})
+    response = website_address(client, 'u1')
+    assert response.status_code == 200
+    assert response.get_json() == {'website_address': 'https://example.com'}
+
+
+def test_profile_reads_are_cached(core, client, firestore):
+    core.user_coll_ref.document('u1').set({'website': 'https://example.com'})
+    website_address(client, 'u1')
+    # A write that bypasses this process is not seen until the entry is dropped
+    firestore.document('users', 'u1').set({'website': 'https://other.example'})
+    assert website_address(client, 'u1').get_json() == {'website_address': 'https://example.com'}
+
+
+def test_write_routes_invalidate_the_profile(core, client):
+    save_user(client, 'u1', 'https://example.com')
+    assert website_address(client, 'u1').get_json() == {'website_address': 'https://example.com'}
+
+    save_user(client, 'u1', 'https://new.example')
+    assert website_address(client, 'u1').get_json() == {'website_address': 'https://new.example'}
+
+    client.post('/Save_businessInfo_against_UserData', json={'userID': 'u1', 'businessInfo': 'Cafe'})
+    user = client.post('/Check_Existing_User', json={'userID': 'u1'}).get_json()
+    assert user['Data']['businessInfo'] == 'Cafe'
+
+
+def test_listener_drops_profiles_changed_by_other_workers(core, client, firestore):
+    core.user_coll_ref.document('u1').set({'website': 'https://example.com'})
+    website_address(client, 'u1')
+    firestore.document('users', 'u1').set({'website': 'https://other.example'})
+
+    change = types.SimpleNamespace(document=types.SimpleNamespace(id='u1'))
+    core.on_user_profiles_changed([], [change], None)
+    assert website_address(client, 'u1').get_json() == {'website_address': 'https://other.example'}